@@ -238,11 +238,11 @@ class GSConverterNeRFMarchingCubes(nn.Module):
 
         return image, alpha
 
-    def fit_mesh(self, iters=2048, remesh_after_n_iteration=512, resolution=512, grid_size=256, S=128, density_thresh=10, decimate_target=5e4):
+    def fit_mesh(self, iters=2048, remesh_after_n_iteration=512, resolution=512, grid_size=256, S=128, density_thresh=10, decimate_target=5e4, coarse_block_size=0):
 
         self.opt.output_size = resolution
         
-        vertices, triangles = marching_cubes_density_to_mesh(self.get_density, grid_size, S, density_thresh, decimate_target)
+        vertices, triangles = marching_cubes_density_to_mesh(self.get_density, grid_size, S, density_thresh, decimate_target, coarse_block_size)
         
         self.v = torch.from_numpy(vertices).contiguous().float().to(self.device)
         self.f = torch.from_numpy(triangles).contiguous().int().to(self.device)
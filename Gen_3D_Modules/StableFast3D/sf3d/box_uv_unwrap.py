@@ -104,6 +104,67 @@ def _box_assign_vertex_to_cube_face(
     return uv, index
 
 
+def _find_potentially_overlapping_pairs(
+    center_uv: Float[Tensor, "Nf 2"],
+    radius: Float[Tensor, "Nf"],
+    max_pairs_per_chunk: int = 1 << 24,
+) -> Integer[Tensor, "Np 2"]:
+    """
+    Unique pairs (first < second) of triangles whose uv centers are closer than three
+    times the radius of one of them. Triangles are bucketed in a uniform grid with cells
+    of three times the largest radius, so only neighboring cells are compared instead of
+    building the dense Nf x Nf distance matrix.
+    """
+    n = center_uv.shape[0]
+    device = center_uv.device
+    cell_size = (radius.max() * 3.0).clamp_min(1e-8)
+    cell = torch.floor((center_uv - center_uv.min(dim=0).values) / cell_size).long()
+    num_cells_y = cell[:, 1].max() + 3
+    cell_key = (cell[:, 0] + 1) * num_cells_y + (cell[:, 1] + 1)
+    sorted_key, order = torch.sort(cell_key)
+
+    pairs = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            neighbor_key = cell_key + dx * num_cells_y + dy
+            start = torch.searchsorted(sorted_key, neighbor_key, right=False)
+            count = torch.searchsorted(sorted_key, neighbor_key, right=True) - start
+            # expand in chunks of triangles to bound memory
+            cum_count = torch.cumsum(count, 0)
+            chunk_ends = torch.searchsorted(
+                cum_count,
+                torch.arange(
+                    max_pairs_per_chunk,
+                    int(cum_count[-1]) + max_pairs_per_chunk,
+                    max_pairs_per_chunk,
+                    device=device,
+                ),
+                right=True,
+            ).tolist()
+            chunk_start = 0
+            for chunk_end in chunk_ends:
+                chunk_end = max(min(chunk_end, n), chunk_start + 1)
+                idx = torch.arange(chunk_start, chunk_end, device=device)
+                first = torch.repeat_interleave(idx, count[idx])
+                offset = torch.arange(first.shape[0], device=device) - torch.repeat_interleave(
+                    torch.cumsum(count[idx], 0) - count[idx], count[idx]
+                )
+                second = order[start[first] + offset]
+                dist = (center_uv[second] - center_uv[first]).norm(dim=-1)
+                keep = (first < second) & (
+                    (dist <= radius[first] * 3.0) | (dist <= radius[second] * 3.0)
+                )
+                pairs.append(torch.stack([first[keep], second[keep]], dim=1))
+                chunk_start = chunk_end
+                if chunk_start >= n:
+                    break
+
+    pairs = torch.cat(pairs, dim=0)
+    # same lexicographic order as torch.unique(dim=0)
+    pair_key = pairs[:, 0] * n + pairs[:, 1]
+    return pairs[torch.argsort(pair_key)]
+
+
 def _assign_faces_uv_to_atlas_index(
     vertex_positions: Float[Tensor, "Nv 3"],
     triangle_idxs: Integer[Tensor, "Nf 3"],
@@ -133,28 +194,11 @@ def _assign_faces_uv_to_atlas_index(
             # And also the radius of the triangle
             uv_triangle_radius = (uv_triangle - center_uv).norm(dim=-1).max(-1).values
 
-            potentially_overlapping_mask = (
-                # Find all close triangles
-                (center_uv[None, ...] - center_uv[:, None]).norm(dim=-1)
-                # Do not select the same element by offseting with an large valued identity matrix
-                + torch.eye(
-                    uv_triangle.shape[0],
-                    device=uv_triangle.device,
-                    dtype=uv_triangle.dtype,
-                ).unsqueeze(-1)
-                * 1000
-            )
-            # Mark all potentially overlapping triangles to reduce the number of triangle intersection tests
-            potentially_overlapping_mask = (
-                potentially_overlapping_mask
-                <= (uv_triangle_radius.view(-1, 1, 1) * 3.0)
-            ).squeeze(-1)
-            overlap_coords = torch.stack(torch.where(potentially_overlapping_mask), -1)
-
+            # Find all close triangles to reduce the number of triangle intersection tests
             # Only unique triangles (A|B and B|A should be the same)
-            f = torch.min(overlap_coords, dim=-1).values
-            s = torch.max(overlap_coords, dim=-1).values
-            overlap_coords = torch.unique(torch.stack([f, s], dim=1), dim=0)
+            overlap_coords = _find_potentially_overlapping_pairs(
+                center_uv[:, 0], uv_triangle_radius
+            )
             first, second = overlap_coords.unbind(-1)
 
             # Get the triangles
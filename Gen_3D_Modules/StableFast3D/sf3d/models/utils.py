@@ -1,6 +1,5 @@
 import dataclasses
 import importlib
-import math
 from dataclasses import dataclass
 from typing import Any, List, Optional, Tuple, Union
 
@@ -96,10 +95,14 @@ def triangle_intersection_2d(
     """Returns True if triangles collide, False otherwise"""
 
     def chk_edge(x: Float[Tensor, "*B 3 3"]) -> Bool[Tensor, "*B"]:  # noqa: F821
-        logdetx = torch.logdet(x.double())
+        # Closed form determinant of the rows (x, y, 1), much faster than a batched logdet
+        x = x.double()
+        detx = (x[..., 1, 0] - x[..., 0, 0]) * (x[..., 2, 1] - x[..., 0, 1]) - (
+            x[..., 2, 0] - x[..., 0, 0]
+        ) * (x[..., 1, 1] - x[..., 0, 1])
         if eps is None:
-            return ~torch.isfinite(logdetx)
-        return ~(torch.isfinite(logdetx) & (logdetx > math.log(eps)))
+            return ~(detx > 0)
+        return ~(detx > eps)
 
     t1s = tri_winding(t1)
     t2s = tri_winding(t2)
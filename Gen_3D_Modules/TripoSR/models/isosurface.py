@@ -1,10 +1,21 @@
-from typing import Callable, Optional, Tuple
+from typing import Optional, Tuple
 
+import numpy as np
 import torch
 import torch.nn as nn
 from mcubes import marching_cubes
 
 from mesh_processer.mesh_utils import switch_vector_axis
+from ..utils import scale_tensor
+
+
+def marching_cubes_volume(volume: np.ndarray, resolution: int) -> Tuple[np.ndarray, np.ndarray]:
+    # module level so it can also run in a worker process
+    v_pos, t_pos_idx = marching_cubes(volume, 0.0)
+    v_pos = switch_vector_axis(v_pos, (2, 1, 0))
+    v_pos = v_pos[..., [2, 1, 0]]
+    v_pos = v_pos / (resolution - 1.0)
+    return v_pos, t_pos_idx
 
 
 class IsosurfaceHelper(nn.Module):
@@ -19,8 +30,10 @@ class MarchingCubeHelper(IsosurfaceHelper):
     def __init__(self, resolution: int) -> None:
         super().__init__()
         self.resolution = resolution
-        self.mc_func: Callable = marching_cubes
         self._grid_vertices: Optional[torch.FloatTensor] = None
+        # non-persistent buffer, so the scaled grid stays on device between calls and follows the model when it is moved
+        self.register_buffer("scaled_grid_vertices", None, persistent=False)
+        self.scaled_grid_range: Optional[Tuple[float, float]] = None
 
     @property
     def grid_vertices(self) -> torch.FloatTensor:
@@ -38,13 +51,22 @@ class MarchingCubeHelper(IsosurfaceHelper):
             self._grid_vertices = verts
         return self._grid_vertices
 
+    def get_scaled_grid_vertices(self, value_range: Tuple[float, float], device) -> torch.FloatTensor:
+        if (
+            self.scaled_grid_vertices is None
+            or self.scaled_grid_vertices.device != torch.device(device)
+            or self.scaled_grid_range != tuple(value_range)
+        ):
+            self.scaled_grid_vertices = None
+            self.scaled_grid_vertices = scale_tensor(
+                self.grid_vertices.to(device), self.points_range, value_range
+            )
+            self.scaled_grid_range = tuple(value_range)
+        return self.scaled_grid_vertices
+
     def forward(
         self,
         level: torch.FloatTensor,
     ) -> Tuple[torch.FloatTensor, torch.LongTensor]:
         level = -level.view(self.resolution, self.resolution, self.resolution)
-        v_pos, t_pos_idx = self.mc_func(level.detach().cpu().numpy(), 0.0)
-        v_pos = switch_vector_axis(v_pos, (2, 1, 0))
-        v_pos = v_pos[..., [2, 1, 0]]
-        v_pos = v_pos / (self.resolution - 1.0)
-        return v_pos, t_pos_idx
+        return marching_cubes_volume(level.detach().cpu().numpy(), self.resolution)
@@ -26,6 +26,12 @@ class TriplaneNeRFRenderer(BaseModule):
         num_samples_per_ray: int = 128
         randomized: bool = False
 
+        # accelerated renderer (_forward_accelerated)
+        occupancy_grid_resolution: int = 64
+        occupancy_alpha_thresh: float = 1e-4
+        early_termination_transmittance: float = 1e-4
+        samples_per_step: int = 16
+
     cfg: Config
 
     def configure(self) -> None:
@@ -151,19 +157,133 @@ class TriplaneNeRFRenderer(BaseModule):
 
         return comp_rgb
 
+    def build_occupancy_grid(
+        self,
+        decoder: torch.nn.Module,
+        triplane: torch.Tensor,
+    ) -> torch.BoolTensor:
+        """
+        Coarse [G, G, G] occupancy of the (-radius, radius) cube. A cell is occupied when the density at any of its
+        corners gives a sample alpha above occupancy_alpha_thresh, dilated by one cell for features between corners.
+        """
+        grid_res = self.cfg.occupancy_grid_resolution
+        coords = torch.linspace(
+            -self.cfg.radius, self.cfg.radius, grid_res + 1, device=triplane.device
+        )
+        corners = torch.stack(torch.meshgrid(coords, coords, coords, indexing="ij"), dim=-1)
+        density = self.query_triplane(decoder, corners, triplane)["density_act"][..., 0]
+        # same sample spacing as _forward
+        alpha = 1 - torch.exp(-density / self.cfg.num_samples_per_ray)
+        cell_alpha = F.max_pool3d(alpha[None, None], kernel_size=2, stride=1)
+        cell_alpha = F.max_pool3d(cell_alpha, kernel_size=3, stride=1, padding=1)
+        return cell_alpha[0, 0] > self.cfg.occupancy_alpha_thresh
+
+    def _lookup_occupancy(self, occupancy: torch.BoolTensor, xyz: torch.Tensor):
+        grid_res = occupancy.shape[0]
+        ids = ((xyz + self.cfg.radius) / (2 * self.cfg.radius) * grid_res).long()
+        ids = ids.clamp_(0, grid_res - 1)
+        return occupancy[ids[..., 0], ids[..., 1], ids[..., 2]]
+
+    def _forward_accelerated(
+        self,
+        decoder: torch.nn.Module,
+        triplane: torch.Tensor,
+        rays_o: torch.Tensor,
+        rays_d: torch.Tensor,
+        occupancy: torch.BoolTensor = None,
+    ):
+        """
+        Same samples and compositing as _forward, with the MLP only evaluated at samples inside occupied cells
+        and rays marched samples_per_step at a time, dropped once their transmittance falls below early_termination_transmittance.
+        rays_o and rays_d may hold any number of views, e.g. [N_views, H, W, 3].
+        """
+        rays_shape = rays_o.shape[:-1]
+        rays_o = rays_o.reshape(-1, 3)
+        rays_d = rays_d.reshape(-1, 3)
+        n_rays = rays_o.shape[0]
+
+        if occupancy is None:
+            occupancy = self.build_occupancy_grid(decoder, triplane)
+
+        t_near, t_far, rays_valid = rays_intersect_bbox(rays_o, rays_d, self.cfg.radius)
+        t_near, t_far = t_near[rays_valid], t_far[rays_valid]
+        rays_o, rays_d = rays_o[rays_valid], rays_d[rays_valid]
+
+        t_vals = torch.linspace(
+            0, 1, self.cfg.num_samples_per_ray + 1, device=triplane.device
+        )
+        t_mid = (t_vals[:-1] + t_vals[1:]) / 2.0
+        deltas = t_vals[1:] - t_vals[:-1]
+
+        eps = 1e-10
+        n_valid = rays_o.shape[0]
+        transmittance = torch.ones(n_valid, device=triplane.device)
+        comp_rgb_ = torch.zeros(n_valid, 3, device=triplane.device)
+        opacity_ = torch.zeros(n_valid, device=triplane.device)
+        alive = torch.arange(n_valid, device=triplane.device)
+
+        for start in range(0, self.cfg.num_samples_per_ray, self.cfg.samples_per_step):
+            if alive.numel() == 0:
+                break
+            step_mid = t_mid[start : start + self.cfg.samples_per_step]
+            step_deltas = deltas[start : start + self.cfg.samples_per_step]
+
+            z_vals = t_near[alive] * (1 - step_mid[None]) + t_far[alive] * step_mid[None]  # (N_alive, N_step)
+            xyz = rays_o[alive, None, :] + z_vals[..., None] * rays_d[alive, None, :]  # (N_alive, N_step, 3)
+
+            occupied = self._lookup_occupancy(occupancy, xyz)
+            density = torch.zeros(z_vals.shape, device=triplane.device)
+            color = torch.zeros(*z_vals.shape, 3, device=triplane.device)
+            if occupied.any():
+                mlp_out = self.query_triplane(
+                    decoder=decoder,
+                    positions=xyz[occupied],
+                    triplane=triplane,
+                )
+                density[occupied] = mlp_out["density_act"][..., 0].to(density.dtype)
+                color[occupied] = mlp_out["color"].to(color.dtype)
+
+            alpha = 1 - torch.exp(-step_deltas * density)
+            accum_prod = torch.cat(
+                [
+                    torch.ones_like(alpha[:, :1]),
+                    torch.cumprod(1 - alpha[:, :-1] + eps, dim=-1),
+                ],
+                dim=-1,
+            )
+            weights = alpha * accum_prod * transmittance[alive, None]
+            comp_rgb_[alive] += (weights[..., None] * color).sum(dim=-2)
+            opacity_[alive] += weights.sum(dim=-1)
+            transmittance[alive] *= torch.prod(1 - alpha + eps, dim=-1)
+
+            alive = alive[transmittance[alive] > self.cfg.early_termination_transmittance]
+
+        comp_rgb = torch.zeros(n_rays, 3, dtype=comp_rgb_.dtype, device=comp_rgb_.device)
+        opacity = torch.zeros(n_rays, dtype=opacity_.dtype, device=opacity_.device)
+        comp_rgb[rays_valid] = comp_rgb_
+        opacity[rays_valid] = opacity_
+
+        comp_rgb += 1 - opacity[..., None]
+        comp_rgb = comp_rgb.view(*rays_shape, 3)
+
+        return comp_rgb
+
     def forward(
         self,
         decoder: torch.nn.Module,
         triplane: torch.Tensor,
         rays_o: torch.Tensor,
         rays_d: torch.Tensor,
+        accelerated: bool = False,
     ) -> Dict[str, torch.Tensor]:
+        # _forward stays the reference implementation
+        forward_func = self._forward_accelerated if accelerated else self._forward
         if triplane.ndim == 4:
-            comp_rgb = self._forward(decoder, triplane, rays_o, rays_d)
+            comp_rgb = forward_func(decoder, triplane, rays_o, rays_d)
         else:
             comp_rgb = torch.stack(
                 [
-                    self._forward(decoder, triplane[i], rays_o[i], rays_d[i])
+                    forward_func(decoder, triplane[i], rays_o[i], rays_d[i])
                     for i in range(triplane.shape[0])
                 ],
                 dim=0,
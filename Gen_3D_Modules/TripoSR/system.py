@@ -1,7 +1,10 @@
 import math
 import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
-from typing import List, Union
+from typing import List, Optional, Union
 
 import numpy as np
 import PIL.Image
@@ -13,7 +16,10 @@ from huggingface_hub import hf_hub_download
 from omegaconf import OmegaConf
 from PIL import Image
 
-from .models.isosurface import MarchingCubeHelper
+from .models.isosurface import MarchingCubeHelper, marching_cubes_volume
+from mesh_processer.mesh_utils import narrow_band_density_grid
+from shared_utils.safetensors_utils import load_checkpoint_into_model
+from shared_utils.log_utils import cstr
 from .utils import (
     BaseModule,
     ImagePreprocessor,
@@ -22,6 +28,35 @@ from .utils import (
     scale_tensor,
 )
 
+# Marching cubes worker pool, created once and reused by every extract_mesh call
+_marching_cubes_executor = None
+_marching_cubes_executor_workers = 0
+
+def get_marching_cubes_executor(workers: int) -> Optional[ProcessPoolExecutor]:
+    """
+    Process pool running marching_cubes_volume, None where it can't be started safely (then marching cubes runs in-process).
+
+    mcubes holds the GIL, so threads would not overlap with the density queries. The server process is never forked
+    (it is multithreaded and holds a CUDA context, a forked child can deadlock on their locks): workers fork from a fork server,
+    a fresh interpreter which imports the main script of the server (ComfyUI's main.py) once when the pool is first created.
+    Spawned workers would import it again each, so platforms without fork server (Windows) don't get a pool.
+    """
+    global _marching_cubes_executor, _marching_cubes_executor_workers
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        if _marching_cubes_executor_workers != -1:
+            cstr(f"[TSR] marching cubes workers need the forkserver start method, not available on this platform, running marching cubes in-process").warning.print()
+            _marching_cubes_executor_workers = -1
+        return None
+    if _marching_cubes_executor is None or _marching_cubes_executor_workers != workers:
+        if _marching_cubes_executor is not None:
+            _marching_cubes_executor.shutdown()
+        mp_context = multiprocessing.get_context("forkserver")
+        # imported once by the fork server instead of by every worker
+        mp_context.set_forkserver_preload(["__main__", marching_cubes_volume.__module__])
+        cstr(f"[TSR] starting {workers} marching cubes worker processes").msg.print()
+        _marching_cubes_executor = ProcessPoolExecutor(workers, mp_context=mp_context)
+        _marching_cubes_executor_workers = workers
+    return _marching_cubes_executor
 
 class TSR(BaseModule):
     @dataclass
@@ -55,8 +90,7 @@ class TSR(BaseModule):
         cfg = OmegaConf.load(config_path)
         OmegaConf.resolve(cfg)
         model = cls(cfg)
-        ckpt = torch.load(weight_path, map_location="cpu")
-        model.load_state_dict(ckpt)
+        load_checkpoint_into_model(model, weight_path, class_name=cls.__name__)
         return model
 
     def configure(self):
@@ -71,6 +105,7 @@ class TSR(BaseModule):
         self.decoder = find_class(self.cfg.decoder_cls)(self.cfg.decoder)
         self.renderer = find_class(self.cfg.renderer_cls)(self.cfg.renderer)
         self.image_processor = ImagePreprocessor()
+        # only the helper of the current resolution is kept, its dense grid stays on device
         self.isosurface_helper = None
 
     def forward(
@@ -108,6 +143,37 @@ class TSR(BaseModule):
         scene_codes = self.post_processor(self.tokenizer.detokenize(tokens))
         return scene_codes
 
+    def forward_batched(
+        self,
+        images: torch.FloatTensor,
+        device: str,
+        micro_batch_size: int = 0,
+    ) -> torch.FloatTensor:
+        """
+        Get scene codes of a [B, H, W, 3] image batch, running the tokenizer and backbone on micro-batches.
+
+        Args:
+            micro_batch_size: number of images per forward pass, 0 sizes it from the memory
+                used by the first image and the memory left free on the device.
+        """
+        scene_codes = []
+        start = 0
+        if micro_batch_size <= 0:
+            micro_batch_size = 1
+            if torch.device(device).type == "cuda" and len(images) > 1:
+                torch.cuda.synchronize(device)
+                torch.cuda.reset_peak_memory_stats(device)
+                baseline = torch.cuda.memory_allocated(device)
+                scene_codes.append(self(images[:1], device))
+                per_image = max(torch.cuda.max_memory_allocated(device) - baseline, 1)
+                free, _ = torch.cuda.mem_get_info(device)
+                micro_batch_size = max(1, int(free * 0.8) // per_image)
+                start = 1
+
+        for i in range(start, len(images), micro_batch_size):
+            scene_codes.append(self(images[i : i + micro_batch_size], device))
+        return torch.cat(scene_codes, dim=0)
+
     def render(
         self,
         scene_codes,
@@ -118,7 +184,14 @@ class TSR(BaseModule):
         height: int = 256,
         width: int = 256,
         return_type: str = "pil",
+        accelerated: bool = False,
     ):
+        """
+        Render n_views orbit views of every scene code.
+
+        With accelerated, all views of a scene are rendered as one ray set by the renderer's occupancy-grid path with early ray termination,
+        otherwise each view goes through the reference renderer.
+        """
         rays_o, rays_d = get_spherical_cameras(
             n_views, elevation_deg, camera_distance, fovy_deg, height, width
         )
@@ -138,6 +211,14 @@ class TSR(BaseModule):
 
         images = []
         for scene_code in scene_codes:
+            if accelerated:
+                with torch.no_grad():
+                    views = self.renderer(
+                        self.decoder, scene_code, rays_o, rays_d, accelerated=True
+                    )
+                images.append([process_output(image) for image in views])
+                continue
+
             images_ = []
             for i in range(n_views):
                 with torch.no_grad():
@@ -157,36 +238,83 @@ class TSR(BaseModule):
             return
         self.isosurface_helper = MarchingCubeHelper(resolution)
 
-    def extract_mesh(self, scene_codes, resolution: int = 256, threshold: float = 25.0):
-        self.set_marching_cubes_resolution(resolution)
-        meshes = []
-        for scene_code in scene_codes:
-            with torch.no_grad():
-                density = self.renderer.query_triplane(
+    def _query_density_volume(self, scene_code, threshold, coarse_block_size=0):
+        resolution = self.isosurface_helper.resolution
+        radius = self.renderer.cfg.radius
+        if coarse_block_size > 0:
+            # sparse two-level query, only blocks near the surface are evaluated at full resolution
+            def get_density_func(pts):
+                return self.renderer.query_triplane(
                     self.decoder,
-                    scale_tensor(
-                        self.isosurface_helper.grid_vertices.to(scene_codes.device),
-                        self.isosurface_helper.points_range,
-                        (-self.renderer.cfg.radius, self.renderer.cfg.radius),
-                    ),
+                    scale_tensor(pts.to(scene_code.device), (-1, 1), (-radius, radius)),
                     scene_code,
                 )["density_act"]
-            v_pos, t_pos_idx = self.isosurface_helper(-(density - threshold))
-            v_pos = scale_tensor(
-                torch.from_numpy(v_pos).float().to(scene_codes.device),
-                self.isosurface_helper.points_range,
-                (-self.renderer.cfg.radius, self.renderer.cfg.radius),
-            )
-            with torch.no_grad():
-                color = self.renderer.query_triplane(
-                    self.decoder,
-                    v_pos,
-                    scene_code,
-                )["color"]
-            mesh = trimesh.Trimesh(
-                vertices=v_pos.cpu().numpy(),
-                faces=t_pos_idx,
-                vertex_colors=color.cpu().numpy(),
-            )
-            meshes.append(mesh)
+            
+            density = narrow_band_density_grid(get_density_func, resolution, density_thresh=threshold, coarse_block_size=coarse_block_size)
+            return density - threshold
+        
+        with torch.no_grad():
+            density = self.renderer.query_triplane(
+                self.decoder,
+                self.isosurface_helper.get_scaled_grid_vertices((-radius, radius), scene_code.device),
+                scene_code,
+            )["density_act"]
+        return (density - threshold).view(resolution, resolution, resolution).cpu().numpy()
+
+    def _colorize_mesh(self, scene_code, v_pos, t_pos_idx):
+        v_pos = scale_tensor(
+            torch.from_numpy(v_pos).float().to(scene_code.device),
+            self.isosurface_helper.points_range,
+            (-self.renderer.cfg.radius, self.renderer.cfg.radius),
+        )
+        with torch.no_grad():
+            color = self.renderer.query_triplane(
+                self.decoder,
+                v_pos,
+                scene_code,
+            )["color"]
+        return trimesh.Trimesh(
+            vertices=v_pos.cpu().numpy(),
+            faces=t_pos_idx,
+            vertex_colors=color.cpu().numpy(),
+        )
+
+    def extract_mesh(self, scene_codes, resolution: int = 256, threshold: float = 25.0, marching_cubes_workers: int = 0, coarse_block_size: int = 0):
+        """
+        Extract one mesh per scene code.
+
+        With coarse_block_size > 0 the density is queried coarse-to-fine (see narrow_band_density_grid),
+        so the number of queries grows with the surface area instead of the volume of the grid.
+
+        With marching_cubes_workers > 0 and more than one scene code, marching cubes runs in worker processes
+        while the GPU queries the density of the next scene codes (see get_marching_cubes_executor).
+        At most marching_cubes_workers volumes are pending at once to bound host memory.
+        """
+        self.set_marching_cubes_resolution(resolution)
+
+        executor = None
+        if marching_cubes_workers > 0 and len(scene_codes) > 1:
+            executor = get_marching_cubes_executor(marching_cubes_workers)
+
+        meshes = []
+        pending = deque()
+        try:
+            for scene_code in scene_codes:
+                volume = self._query_density_volume(scene_code, threshold, coarse_block_size)
+                if executor is None:
+                    meshes.append(self._colorize_mesh(scene_code, *marching_cubes_volume(volume, resolution)))
+                    continue
+
+                pending.append((scene_code, executor.submit(marching_cubes_volume, volume, resolution)))
+                while len(pending) > marching_cubes_workers:
+                    scene_code_done, future = pending.popleft()
+                    meshes.append(self._colorize_mesh(scene_code_done, *future.result()))
+
+            while len(pending) > 0:
+                scene_code_done, future = pending.popleft()
+                meshes.append(self._colorize_mesh(scene_code_done, *future.result()))
+        finally:
+            # the pool is kept, only drop the work of an interrupted call
+            for _, future in pending:
+                future.cancel()
         return meshes
@@ -3,7 +3,8 @@ import time
 import torch
 import torch_scatter
 from typing import Tuple
-from .remesh import calc_edge_length, calc_edges, calc_face_collapses, calc_face_normals, calc_vertex_normals, collapse_edges, flip_edges, pack, prepend_dummies, remove_dummies, split_edges
+from shared_utils.log_utils import record_time
+from .remesh import calc_edge_length, calc_edges, calc_edges_from_twins, calc_face_collapses, calc_face_normals, calc_twins, calc_vertex_normals, check_twins, collapse_edges, flip_edges, pack, prepend_dummies, remove_dummies, split_edges
 
 @torch.no_grad()
 def remesh(
@@ -12,8 +13,15 @@ def remesh(
         min_edgelen:torch.Tensor, #V
         max_edgelen:torch.Tensor, #V
         flip:bool,
-        max_vertices=1e6
+        max_vertices=1e6,
+        twins:torch.Tensor=None, #(F+1)*3 long, half-edge twins of faces with dummies, see calc_twins
+        timings:dict=None, #accumulates seconds per stage if given
         ):
+    """
+    returns (vertices_etc,faces,twins). With twins, edges are derived from the half-edge connectivity in O(F) and the
+    connectivity is updated locally by each operation, otherwise they are rebuilt with a sort (calc_edges) at each stage
+    """
+    start = record_time(timings)
 
     # dummies
     vertices_etc,faces = prepend_dummies(vertices_etc,faces)
@@ -22,32 +30,59 @@ def remesh(
     min_edgelen = torch.concat((nan_tensor,min_edgelen))
     max_edgelen = torch.concat((nan_tensor,max_edgelen))
 
+    def get_edges(with_edge_to_face=False):
+        if twins is None:
+            return calc_edges(faces,with_edge_to_face=with_edge_to_face)
+        return calc_edges_from_twins(faces,twins,with_edge_to_face=with_edge_to_face)
+
     # collapse
-    edges,face_to_edge = calc_edges(faces) #E,2 F,3
+    edges,face_to_edge = get_edges() #E,2 F,3
+    start = record_time(timings,'edges',start)
     edge_length = calc_edge_length(vertices,edges) #E
     face_normals = calc_face_normals(vertices,faces,normalize=False) #F,3
     vertex_normals = calc_vertex_normals(vertices,faces,face_normals) #V,3
     face_collapse = calc_face_collapses(vertices,faces,edges,face_to_edge,edge_length,face_normals,vertex_normals,min_edgelen,area_ratio=0.5)
     shortness = (1 - edge_length / min_edgelen[edges].mean(dim=-1)).clamp_min_(0) #e[0,1] 0...ok, 1...edgelen=0
     priority = face_collapse.float() + shortness
-    vertices_etc,faces = collapse_edges(vertices_etc,faces,edges,priority)
+    vertices_etc,faces = collapse_edges(vertices_etc,faces,edges,priority,twins=twins)
+    start = record_time(timings,'collapse',start)
 
     # split
     if vertices.shape[0]<max_vertices:
-        edges,face_to_edge = calc_edges(faces) #E,2 F,3
+        edges,face_to_edge = get_edges() #E,2 F,3
+        start = record_time(timings,'edges',start)
         vertices = vertices_etc[:,:3] #V,3
         edge_length = calc_edge_length(vertices,edges) #E
         splits = edge_length > max_edgelen[edges].mean(dim=-1)
-        vertices_etc,faces = split_edges(vertices_etc,faces,edges,face_to_edge,splits,pack_faces=False)
+        if twins is None:
+            vertices_etc,faces = split_edges(vertices_etc,faces,edges,face_to_edge,splits,pack_faces=False)
+        else:
+            vertices_etc,faces,twins = split_edges(vertices_etc,faces,edges,face_to_edge,splits,pack_faces=False,twins=twins)
+        start = record_time(timings,'split',start)
 
-    vertices_etc,faces = pack(vertices_etc,faces)
+    if twins is None:
+        vertices_etc,faces = pack(vertices_etc,faces)
+    else:
+        vertices_etc,faces,twins = pack(vertices_etc,faces,twins)
     vertices = vertices_etc[:,:3]
+    start = record_time(timings,'pack',start)
 
     if flip:
-        edges,_,edge_to_face = calc_edges(faces,with_edge_to_face=True) #E,2 F,3
-        flip_edges(vertices,faces,edges,edge_to_face,with_border=False)
-
-    return remove_dummies(vertices_etc,faces)
+        edges,_,edge_to_face = get_edges(with_edge_to_face=True) #E,2 F,3
+        start = record_time(timings,'edges',start)
+        flip_edges(vertices,faces,edges,edge_to_face,with_border=False,twins=twins)
+        start = record_time(timings,'flip',start)
+
+    if twins is not None:
+        valid = check_twins(faces,twins)
+        start = record_time(timings,'check',start)
+        if not valid:
+            # a local update met a configuration it does not handle, rebuild once
+            twins = calc_twins(faces)
+            start = record_time(timings,'rebuild',start)
+
+    vertices_etc,faces = remove_dummies(vertices_etc,faces)
+    return vertices_etc,faces,twins
     
 def lerp_unbiased(a:torch.Tensor,b:torch.Tensor,weight:float,step:int):
     """lerp with adam's bias correction"""
@@ -76,6 +111,8 @@ class MeshOptimizer:
             grad_lim=10., #gradients are clipped to m1.abs()*grad_lim
             remesh_interval=1, #larger intervals are faster but with worse mesh quality
             local_edgelen=True, #set to False to use a global scalar reference edge length instead
+            incremental_edges=True, #keep half-edge connectivity updated locally instead of rebuilding edges with a sort
+            profile=False, #accumulate seconds per remesh stage in self.timings
             ):
         self._vertices = vertices
         self._faces = faces
@@ -92,6 +129,8 @@ class MeshOptimizer:
         self._remesh_interval = remesh_interval
         self._local_edgelen = local_edgelen
         self._step = 0
+        self._twins = calc_twins(prepend_dummies(vertices,faces)[1]) if incremental_edges else None
+        self.timings = {} if profile else None
 
         V = self._vertices.shape[0]
         # prepare continuous tensor for all vertex-based data 
@@ -130,7 +169,14 @@ class MeshOptimizer:
         self._step += 1
 
         # spatial smoothing
-        edges,_ = calc_edges(self._faces) #E,2
+        start = record_time(self.timings)
+        if self._twins is None:
+            edges,_ = calc_edges(self._faces) #E,2
+        else:
+            faces = torch.nn.functional.pad(self._faces+1,(0,0,1,0)) #with dummy
+            edges,_ = calc_edges_from_twins(faces,self._twins)
+            edges = edges[1:] - 1 #E,2 without dummies
+        start = record_time(self.timings,'edges',start)
         E = edges.shape[0]
         edge_smooth = self._smooth[edges] #E,2,S
         neighbor_smooth = torch.zeros_like(self._smooth) #V,S
@@ -182,7 +228,7 @@ class MeshOptimizer:
         min_edge_len = self._ref_len * (1 - self._edge_len_tol)
         max_edge_len = self._ref_len * (1 + self._edge_len_tol)
         
-        self._vertices_etc,self._faces = remesh(self._vertices_etc,self._faces,min_edge_len,max_edge_len,flip, max_vertices=1e6)
+        self._vertices_etc,self._faces,self._twins = remesh(self._vertices_etc,self._faces,min_edge_len,max_edge_len,flip, max_vertices=1e6, twins=self._twins, timings=self.timings)
 
         self._split_vertices_etc()
         self._vertices.requires_grad_()
@@ -8,7 +8,7 @@ from .remesh import calc_vertex_normals
 from .opt import MeshOptimizer
 from .func import make_star_cameras_orthographic, make_star_cameras_orthographic_py3d
 from .render import NormalsRenderer, Pytorch3DNormalsRenderer
-from Unique3D.scripts.project_mesh import multiview_color_projection, get_cameras_list
+from Unique3D.scripts.project_mesh import multiview_color_projection, get_cameras_list, images_to_tensor
 from Unique3D.scripts.utils import to_py3d_mesh, from_py3d_mesh, init_target
 
 def run_mesh_refine(vertices, faces, pils: List[Image.Image], steps=100, start_edge_len=0.02, end_edge_len=0.005, decay=0.99, update_normal_interval=10, update_warmup=10, return_mesh=False, process_inputs=False, process_outputs=False):
@@ -36,6 +36,10 @@ def run_mesh_refine(vertices, faces, pils: List[Image.Image], steps=100, start_e
 
     mask = target_images[..., -1] < 0.5
 
+    # projection inputs stay on the device across target updates
+    projection_images = images_to_tensor(pils, device=vertices.device)
+    projection_cameras = get_cameras_list(azim_list = [0, 90, 180, 270], device=vertices.device, focal=1.)
+
     comfy_pbar = comfy.utils.ProgressBar(steps)
 
     for i in tqdm(range(steps)):
@@ -49,8 +53,7 @@ def run_mesh_refine(vertices, faces, pils: List[Image.Image], steps=100, start_e
         if i < update_warmup or i % update_normal_interval == 0:
             with torch.no_grad():
                 py3d_mesh = to_py3d_mesh(vertices, faces, normals)
-                cameras = get_cameras_list(azim_list = [0, 90, 180, 270], device=vertices.device, focal=1.)
-                _, _, target_normal = from_py3d_mesh(multiview_color_projection(py3d_mesh, pils, cameras_list=cameras, weights=[2.0, 0.8, 1.0, 0.8], confidence_threshold=0.1, complete_unseen=False, below_confidence_strategy='original', reweight_with_cosangle='linear'))
+                _, _, target_normal = from_py3d_mesh(multiview_color_projection(py3d_mesh, projection_images, cameras_list=projection_cameras, weights=[2.0, 0.8, 1.0, 0.8], confidence_threshold=0.1, complete_unseen=False, below_confidence_strategy='original', reweight_with_cosangle='linear'))
                 target_normal = target_normal * 2 - 1
                 target_normal = torch.nn.functional.normalize(target_normal, dim=-1)
                 debug_images = renderer.render(vertices,target_normal,faces)
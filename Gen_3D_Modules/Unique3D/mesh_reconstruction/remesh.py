@@ -62,6 +62,91 @@ def calc_edges(
     edge_to_face[0] = 0
     return edges, face_to_edge, edge_to_face
 
+def calc_twins(
+        faces:torch.Tensor, #F,3 long, 0 for unused, first face must be dummy
+    )->torch.Tensor: #F*3 long, -1 for border, None if not supported
+    """
+    half-edge connectivity, kept on device and updated locally by collapse_edges, split_edges, pack and flip_edges
+    instead of rebuilding the edges with a global sort after every change
+
+    half-edge h=3*f+s goes from faces[f,s] to faces[f,(s+1)%3], twins[h] is the half-edge of the neighboring face
+    going the opposite way, -1 on borders and for unused faces.
+    returns None for non-manifold or inconsistently oriented meshes, use calc_edges for those
+    """
+    F = faces.shape[0]
+    start = faces.reshape(F*3)
+    end = faces.roll(-1,1).reshape(F*3)
+    used = (faces[:,:1]!=0).expand(F,3).reshape(F*3)
+    V = faces.max().item()+1 #sync
+    key = torch.minimum(start,end)*V + torch.maximum(start,end) #F*3
+    key[~used] = -1
+    sorted_key,order = key.sort()
+    same = (sorted_key[1:]==sorted_key[:-1]).logical_and_(sorted_key[:-1]>=0) #F*3-1, pairs
+    if same[1:].logical_and(same[:-1]).any(): #sync, more than two faces on an edge
+        return None
+    a,b = order[:-1][same],order[1:][same]
+    if (start[a]!=end[b]).any(): #sync, neighbors with opposite orientation
+        return None
+    twins = torch.full((F*3,),-1,dtype=torch.long,device=faces.device)
+    twins[a] = b
+    twins[b] = a
+    return twins
+
+def check_twins(
+        faces:torch.Tensor, #F,3 long, 0 for unused
+        twins:torch.Tensor, #F*3 long, -1 for border
+    )->bool:
+    """check that twins are mutual and connect the same vertices in opposite directions"""
+    F = faces.shape[0]
+    start = faces.reshape(F*3)
+    end = faces.roll(-1,1).reshape(F*3)
+    h = torch.arange(0,F*3,device=faces.device)[twins>=0]
+    t = twins[h]
+    return bool((twins[t]==h).all() and (start[t]==end[h]).all() and (end[t]==start[h]).all()) #sync
+
+def calc_edges_from_twins(
+        faces: torch.Tensor,  # F,3 long, 0 for unused, first face must be dummy
+        twins: torch.Tensor,  # F*3 long, -1 for border
+        with_edge_to_face: bool = False
+    ) -> Tuple[torch.Tensor, ...]:
+    """
+    same as calc_edges in O(F) without sorting, edges are ordered by their first half-edge instead of by vertex index
+    """
+    F = faces.shape[0]
+    start = faces.reshape(F*3)
+    end = faces.roll(-1,1).reshape(F*3)
+    used = (faces[:,:1]!=0).expand(F,3).reshape(F*3)
+    half_edges = torch.arange(0,F*3,device=faces.device)
+
+    # one half-edge represents each edge, edge 0 is reserved for unused
+    is_first = used.logical_and(torch.logical_or(twins<0,half_edges<twins)) #F*3
+    edge_ind = is_first.cumsum(dim=0) #F*3
+    full_to_unique = torch.where(is_first,edge_ind,edge_ind[twins.clamp_min(0)]) * used #F*3
+    E = edge_ind[-1].item()+1 #sync
+    edges = torch.zeros((E,2),dtype=torch.long,device=faces.device)
+    edges[full_to_unique[is_first]] = torch.stack((torch.minimum(start,end),torch.maximum(start,end)),dim=-1)[is_first]
+    face_to_edge = full_to_unique.reshape(F,3)
+
+    if not with_edge_to_face:
+        return edges, face_to_edge
+
+    is_right = start>end #F*3
+    edge_to_face = torch.zeros((E,2,2),dtype=torch.long,device=faces.device) #E,LR=2,S=2
+    edge_to_face[full_to_unique[used],is_right[used].long()] = torch.stack((half_edges//3,half_edges%3),dim=-1)[used]
+    edge_to_face[0] = 0
+    return edges, face_to_edge, edge_to_face
+
+def pack_twins(
+        twins:torch.Tensor, #F*3 long, -1 for border
+        face_mask:torch.Tensor, #F bool, faces to keep
+        )->torch.Tensor: #F'*3
+    """remap twins after removing the faces outside face_mask, their half-edges must not be twins of kept ones"""
+    F = face_mask.shape[0]
+    face_ind = face_mask.cumsum(dim=0) - 1 #F
+    half_edge_ind = (face_ind[:,None]*3 + torch.arange(0,3,device=twins.device)).reshape(F*3)
+    twins = twins.reshape(F,3)[face_mask].reshape(-1)
+    return torch.where(twins>=0,half_edge_ind[twins.clamp_min(0)],twins)
+
 def calc_edge_length(
         vertices:torch.Tensor, #V,3 first may be dummy
         edges:torch.Tensor, #E,2 long, lower vertex index first, (0,0) for unused
@@ -120,7 +205,8 @@ def calc_face_ref_normals(
 def pack(
         vertices:torch.Tensor, #V,3 first unused and nan
         faces:torch.Tensor, #F,3 long, 0 for unused
-        )->Tuple[torch.Tensor,torch.Tensor]: #(vertices,faces), keeps first vertex unused
+        twins:torch.Tensor=None, #F*3 long, optional half-edge twins to remap
+        )->Tuple[torch.Tensor,...]: #(vertices,faces[,twins]), keeps first vertex unused
     """removes unused elements in vertices and faces"""
     V = vertices.shape[0]
     
@@ -128,6 +214,8 @@ def pack(
     used_faces = faces[:,0]!=0
     used_faces[0] = True
     faces = faces[used_faces] #sync
+    if twins is not None:
+        twins = pack_twins(twins,used_faces)
 
     # remove unused vertices
     used_vertices = torch.zeros(V,3,dtype=torch.bool,device=vertices.device)
@@ -142,6 +230,8 @@ def pack(
     ind[used_vertices] =  torch.arange(0,V1,device=vertices.device) #sync
     faces = ind[faces]
 
+    if twins is not None:
+        return vertices,faces,twins
     return vertices,faces
 
 def split_edges(
@@ -151,7 +241,8 @@ def split_edges(
         face_to_edge:torch.Tensor, #F,3 long 0 for unused
         splits, #E bool
         pack_faces:bool=True,
-        )->Tuple[torch.Tensor,torch.Tensor]: #(vertices,faces)
+        twins:torch.Tensor=None, #F*3 long, optional half-edge twins to update
+        )->Tuple[torch.Tensor,...]: #(vertices,faces[,twins])
 
     #   c2                    c2               c...corners = faces
     #    . .                   . .             s...side_vert, 0 means no split
@@ -175,7 +266,7 @@ def split_edges(
     S = splits.sum().item() #sync
 
     if S==0:
-        return vertices,faces
+        return (vertices,faces) if twins is None else (vertices,faces,twins)
     
     edge_vert = torch.zeros_like(splits, dtype=torch.long) #E
     edge_vert[splits] = torch.arange(V,V+S,dtype=torch.long,device=vertices.device) #E 0 for no split, sync
@@ -191,19 +282,60 @@ def split_edges(
     shrunk_faces = torch.where(side_split,side_vert,faces) #F,3 long, 0 for no split
     new_faces = side_split[:,:,None] * torch.stack((faces,side_vert,shrunk_faces.roll(1,dims=-1)),dim=-1) #F,N=3,C=3
     faces = torch.concat((shrunk_faces,new_faces.reshape(F*3,3))) #4F,3
+
+    if twins is not None:
+        twins = split_twins(twins,side_split)
+
     if pack_faces:
         mask = faces[:,0]!=0
         mask[0] = True
         faces = faces[mask] #F',3 sync
+        if twins is not None:
+            twins = pack_twins(twins,mask)
 
+    if twins is not None:
+        return vertices,faces,twins
     return vertices,faces
 
+def split_twins(
+        twins:torch.Tensor, #F*3 long, -1 for border
+        side_split:torch.Tensor, #F,3 bool
+        )->torch.Tensor: #4F*3
+    """
+    twins of the faces made by split_edges: shrunk faces S keep the face index f, new faces Ni get F+3f+i.
+    original side i is split into head c_i->s_i (side 0 of Ni) and tail s_i->c_i+1, the tail (or the whole
+    side if it is not split) is side 2 of Ni+1 if side i+1 is split, else side i of S
+    """
+    F = side_split.shape[0]
+    device = twins.device
+    f = torch.arange(0,F,device=device)[:,None] #F,1
+    i = torch.arange(0,3,device=device)[None] #1,3
+    split_next = side_split.roll(-1,1) #F,3 side i+1 split
+    new_face_he = lambda n,side: (F + 3*f + n)*3 + side #half-edge of new face Nn
+    head = new_face_he(i,0).expand(F,3) #F,3 valid where side_split
+    tail = torch.where(split_next,new_face_he((i+1)%3,2),3*f+i) #F,3
+
+    new_twins = torch.full((F*4*3,),-1,dtype=torch.long,device=device)
+    # across original edges, both faces of an edge see the same split
+    has_twin = twins.reshape(F,3)>=0
+    t = twins.clamp_min(0)
+    twin_head,twin_tail = head.reshape(-1)[t].reshape(F,3),tail.reshape(-1)[t].reshape(F,3)
+    new_twins[tail] = torch.where(has_twin,torch.where(side_split,twin_head,twin_tail),-1)
+    new_twins[head[side_split]] = torch.where(has_twin,twin_tail,-1)[side_split]
+    # inside the original face, side 1 of Ni and side i-1 of S
+    inner = new_face_he(i,1).expand(F,3)[side_split]
+    shrunk = (3*f+(i+2)%3).expand(F,3)[side_split]
+    new_twins[inner] = shrunk
+    new_twins[shrunk] = inner
+    return new_twins
+
 def collapse_edges(
         vertices:torch.Tensor, #V,3 first unused
         faces:torch.Tensor, #F,3 long 0 for unused
         edges:torch.Tensor, #E,2 long 0 for unused, lower vertex index first
         priorities:torch.Tensor, #E float
         stable:bool=False, #only for unit testing
+        twins:torch.Tensor=None, #F*3 long, optional half-edge twins, updated in place
         )->Tuple[torch.Tensor,torch.Tensor]: #(vertices,faces)
         
     V = vertices.shape[0]
@@ -235,9 +367,21 @@ def collapse_edges(
     # update faces
     dest = torch.arange(0,V,dtype=torch.long,device=vertices.device) #V
     dest[collapses[:,1]] = dest[collapses[:,0]]
+    used = faces[:,0]!=0
     faces = dest[faces] #F,3 
     c0,c1,c2 = faces.unbind(dim=-1)
     collapsed = (c0==c1).logical_or_(c1==c2).logical_or_(c0==c2)
+
+    if twins is not None:
+        # zip each collapsed face: the outer twins of its two remaining sides become twins of each other
+        collapsed_faces = collapsed.logical_and(used).nonzero()[:,0] #C
+        degenerate = (faces[collapsed_faces]==faces[collapsed_faces].roll(-1,1)).long().argmax(dim=-1) #C side
+        twin_a = twins[3*collapsed_faces+(degenerate+1)%3]
+        twin_b = twins[3*collapsed_faces+(degenerate+2)%3]
+        twins.reshape(-1,3)[collapsed_faces] = -1
+        twins[twin_a[twin_a>=0]] = twin_b[twin_a>=0]
+        twins[twin_b[twin_b>=0]] = twin_a[twin_b>=0]
+
     faces[collapsed] = 0
 
     return vertices,faces
@@ -295,6 +439,7 @@ def flip_edges(
         with_border:bool=True, #handle border edges (D=4 instead of D=6)
         with_normal_check:bool=True, #check face normal flips
         stable:bool=False, #only for unit testing
+        twins:torch.Tensor=None, #F*3 long, optional half-edge twins, updated in place
         ):
     V = vertices.shape[0]
     E = edges.shape[0]
@@ -358,3 +503,16 @@ def flip_edges(
     flip_edge_to_face = edge_to_face[candidates,:,0][flip] #E",2
     flip_faces = flip_edges_neighbors[:,[[0,3,2],[1,2,3]]] #E",2,3
     faces.scatter_(dim=0,index=flip_edge_to_face.reshape(-1,1).expand(-1,3),src=flip_faces.reshape(-1,3))
+
+    if twins is not None:
+        # outer sides move to their new slots: L=[e0,e1,cl] -> [e0,cr,cl], R=[e1,e0,cr] -> [e1,cl,cr]
+        flip_sides = edge_to_face[candidates][flip] #E",LR=2,[face,side]
+        fl,sl = flip_sides[:,0].unbind(dim=-1)
+        fr,sr = flip_sides[:,1].unbind(dim=-1)
+        old = torch.stack((3*fl+(sl+1)%3,3*fl+(sl+2)%3,3*fr+(sr+1)%3,3*fr+(sr+2)%3),dim=-1).reshape(-1) #e1-cl,cl-e0,e0-cr,cr-e1
+        new = torch.stack((3*fr,3*fl+2,3*fl,3*fr+2),dim=-1).reshape(-1)
+        outer = twins[old]
+        twins[new] = outer
+        twins[outer[outer>=0]] = new[outer>=0]
+        twins[3*fl+1] = 3*fr+1 #new edge cr-cl
+        twins[3*fr+1] = 3*fl+1
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Union
 import torch
 import numpy as np
 from PIL import Image
@@ -96,6 +96,19 @@ class Pix2FacesRenderer:
         pix_to_face = rast_out[..., -1].to(torch.int32) - 1
         return pix_to_face
 
+    def render_pix2faces_nvdiff_batch(self, meshes: Meshes, cameras_list: List[CamerasBase], H=512, W=512):
+        """Rasterize all views of one mesh in a single instanced call, returns pix_to_face of [N_views, H, W]"""
+        meshes = meshes.to(self.device)
+        vertices = [self.transform_vertices(meshes, cameras.to(self.device)) for cameras in cameras_list]
+        faces = meshes.faces_packed().to(torch.int32)
+        if any(v.shape[1] != vertices[0].shape[1] for v in vertices):
+            # near plane clipping dropped a different number of vertices per view, rasterize them one by one
+            rast_out = torch.cat([dr.rasterize(self._glctx, v, faces, resolution=(H, W), grad_db=False)[0] for v in vertices], dim=0)
+        else:
+            rast_out,_ = dr.rasterize(self._glctx, torch.cat(vertices, dim=0), faces, resolution=(H, W), grad_db=False) #N,H,W,4
+        pix_to_face = rast_out[..., -1].to(torch.int32) - 1
+        return pix_to_face
+
 pix2faces_renderer = Pix2FacesRenderer()
 
 def get_visible_faces(meshes: Meshes, cameras: CamerasBase, resolution=1024):
@@ -174,6 +187,162 @@ def project_color(meshes: Meshes, cameras: CamerasBase, pil_image: Image.Image,
         "cos_angles": cos_angles,
     }
 
+def images_to_tensor(image_list: List[Image.Image], device="cuda") -> torch.Tensor:
+    """Stack PIL images of the same size into a [N, 4, H, W] RGBA tensor in [0, 1.]"""
+    images = np.stack([np.array(pil_image.convert("RGBA")) for pil_image in image_list]) / 255.
+    return torch.from_numpy(images).permute((0, 3, 1, 2)).float().to(device)
+
+def get_visible_faces_mask(meshes: Meshes, cameras_list: List[CamerasBase], resolution=1024) -> torch.Tensor:
+    """Batched get_visible_faces, returns a [N_views, F] bool mask of the faces visible in each view"""
+    pix_to_face = pix2faces_renderer.render_pix2faces_nvdiff_batch(meshes, cameras_list, H=resolution, W=resolution)
+    num_views, num_faces = pix_to_face.shape[0], meshes.faces_packed().shape[0]
+    # empty pixels (-1) land in the first column
+    visible = torch.zeros((num_views, num_faces + 1), dtype=torch.bool, device=pix_to_face.device)
+    visible.scatter_(1, (pix_to_face.view(num_views, -1) + 1).long(), True)
+    return visible[:, 1:]
+
+def project_color_batch(meshes: Meshes, cameras_list: List[CamerasBase], images: torch.Tensor, use_alpha=True, eps=0.05, resolution=1024, device="cuda") -> dict:
+    """
+    Batched project_color: projects the colors of all views onto the vertices of a 3D mesh at once.
+
+    Args:
+        meshes (pytorch3d.structures.Meshes): The 3D mesh object, only one mesh.
+        cameras_list (list): List of N cameras.
+        images (Tensor of [N,4,H,W]): RGBA images in [0, 1.], see images_to_tensor.
+        use_alpha (bool, optional): Whether to use the alpha channel of the image. Defaults to True.
+        eps (float, optional): The threshold for selecting visible faces. Defaults to 0.05.
+        resolution (int, optional): The resolution of the projection. Defaults to 1024.
+        device (str, optional): The device to use for computation. Defaults to "cuda".
+
+    Returns:
+        dict: A dictionary containing the following keys:
+            - "valid_mask" (Tensor of [N,V]): Whether each vertex is projected in each view.
+            - "valid_colors" (Tensor of [N,V,3]): The interpolated colors, zero for vertices not projected.
+            - "valid_alpha" (Tensor of [N,V,1]): The interpolated alpha, zero for vertices not projected.
+            - "cos_angles" (Tensor of [N,V]): Cosine of the angle between vertex normals and view directions.
+    """
+    meshes = meshes.to(device)
+    cameras_list = [cameras.to(device) for cameras in cameras_list]
+    images = images.to(device)
+    num_views = len(cameras_list)
+    visible_faces = get_visible_faces_mask(meshes, cameras_list, resolution=resolution)   # [N, F]
+
+    verts_coordinates = meshes.verts_packed()   # [V, 3]
+    view_directions, pt_tensor = [], []
+    for cameras in cameras_list:
+        world_points = cameras.unproject_points(torch.tensor([[[0., 0., 0.1], [0., 0., 0.2]]]).to(device))[0]
+        view_directions.append(world_points[1] - world_points[0])
+        pt_tensor.append(cameras.transform_points(verts_coordinates)[..., :2])    # NDC space points
+    view_directions = torch.stack(view_directions)     # [N, 3]
+    view_directions = view_directions / view_directions.norm(dim=1, keepdim=True)
+    pt_tensor = torch.stack(pt_tensor)      # [N, V, 2]
+
+    # find invalid faces
+    faces_normals = meshes.faces_normals_packed()
+    faces_normals = faces_normals / faces_normals.norm(dim=1, keepdim=True)
+    cos_angles = faces_normals @ view_directions.T    # [F, N]
+    for i in range(num_views):
+        visible_cos_angles = cos_angles[visible_faces[i], i]
+        assert visible_cos_angles.mean() < 0, f"The view direction is not correct. cos_angles.mean()={visible_cos_angles.mean()}"
+    selected_faces = visible_faces & (cos_angles.T < -eps)    # [N, F]
+
+    # find verts
+    view_idx, face_idx = selected_faces.nonzero(as_tuple=True)
+    faces = meshes.faces_packed()
+    valid_mask = torch.zeros((num_views, verts_coordinates.shape[0]), dtype=torch.bool, device=device)
+    valid_mask[view_idx[:, None].expand(-1, 3), faces[face_idx]] = True
+    valid_mask &= ~((pt_tensor.isnan()|(pt_tensor<-1)|(1<pt_tensor)).any(dim=-1))
+
+    # compute color, sampling at -pt is the same as sampling the flipped image at pt
+    valid_pt = torch.where(valid_mask[..., None], -pt_tensor, torch.zeros_like(pt_tensor))
+    valid_color = torch.nn.functional.grid_sample(images, valid_pt[:, :, None, :], align_corners=False, padding_mode="reflection", mode="bilinear")[..., 0].permute(0, 2, 1).clamp(0, 1)   # [N, V, 4]
+    valid_color = valid_color * valid_mask[..., None]
+    alpha, valid_color = valid_color[..., 3:], valid_color[..., :3]
+    if not use_alpha:
+        alpha = valid_mask[..., None].to(alpha)
+
+    verts_normals = meshes.verts_normals_packed()
+    verts_normals = verts_normals / verts_normals.norm(dim=1, keepdim=True).clamp_min(0.001)
+    return {
+        "valid_mask": valid_mask,
+        "valid_colors": valid_color,
+        "valid_alpha": alpha,
+        "cos_angles": (verts_normals @ view_directions.T).T,
+    }
+
+def harmonic_fill_colors(colors: torch.Tensor, edges: torch.Tensor, valid_mask: torch.Tensor, max_iter=2000, tol=1e-4, regularization=1e-6) -> torch.Tensor:
+    """
+    Harmonic interpolation of vertex colors: solves the Dirichlet problem L_uu x_u = -L_uk x_k of the uniform graph laplacian
+    for the vertices outside valid_mask with Jacobi preconditioned conjugate gradient, on the device of colors.
+
+    Args:
+        colors (Tensor of [V,C]): vertex colors, the ones of valid vertices are kept fixed.
+        edges (Tensor of [E,2]): unique undirected edges.
+        valid_mask (Tensor of [V]): bool mask of the vertices whose colors are fixed.
+        max_iter (int, optional): bound on the number of CG iterations. Defaults to 2000.
+        tol (float, optional): stop once the residual norm of every channel is below tol times the norm of its right hand side. Defaults to 1e-4.
+        regularization (float, optional): pulls towards the current color, keeps the system definite for unseen parts not connected to any valid vertex. Defaults to 1e-6.
+
+    Returns:
+        Tensor of [V,C]: the completed colors
+    """
+    colors = colors.clone()
+    invalid_index = (~valid_mask).nonzero()[:, 0]
+    U = invalid_index.shape[0]
+    if U == 0:
+        return colors
+
+    src, dst = torch.cat([edges[:, 0], edges[:, 1]]), torch.cat([edges[:, 1], edges[:, 0]])
+    degree = torch.zeros_like(colors[:, 0]).index_add_(0, src, torch.ones_like(src, dtype=colors.dtype))
+    remap = torch.full_like(valid_mask, -1, dtype=torch.long)
+    remap[invalid_index] = torch.arange(U, device=colors.device)
+
+    # off diagonal part of L_uu, edges between two unseen vertices
+    uu = ~valid_mask[src] & ~valid_mask[dst]
+    L_uu = torch.sparse_coo_tensor(torch.stack([remap[src[uu]], remap[dst[uu]]]), -torch.ones_like(src[uu], dtype=colors.dtype), size=(U, U)).coalesce().to_sparse_csr()
+    diag = (degree[invalid_index] + regularization)[:, None]    # [U, 1]
+    # -L_uk x_k, colors of the valid neighbours
+    uk = ~valid_mask[src] & valid_mask[dst]
+    b = torch.zeros_like(colors[invalid_index]).index_add_(0, remap[src[uk]], colors[dst[uk]]) + regularization * colors[invalid_index]
+
+    def matvec(x):
+        return diag * x + L_uu @ x
+
+    x = colors[invalid_index]
+    r = b - matvec(x)
+    z = r / diag
+    p = z.clone()
+    rz = (r * z).sum(dim=0)
+    b_norm = b.norm(dim=0).clamp_min(1e-12)
+    for i in range(max_iter):
+        # checking every few iterations avoids a device sync per iteration
+        if i % 10 == 0 and (r.norm(dim=0) <= tol * b_norm).all():
+            break
+        Ap = matvec(p)
+        alpha = rz / (p * Ap).sum(dim=0).clamp_min(1e-30)
+        x = x + alpha * p
+        r = r - alpha * Ap
+        z = r / diag
+        rz_new = (r * z).sum(dim=0)
+        p = z + (rz_new / rz.clamp_min(1e-30)) * p
+        rz = rz_new
+
+    colors[invalid_index] = x
+    return colors
+
+def complete_unseen_vertex_color_harmonic(meshes: Meshes, valid_index: torch.Tensor, max_iter=2000, tol=1e-4) -> Meshes:
+    """
+    Same as complete_unseen_vertex_color, but fills the unseen vertices with a bounded sparse solve, see harmonic_fill_colors.
+    valid_index: the index of the valid vertices, where valid means colors are fixed. [V, 1]
+    """
+    colors = meshes.textures.verts_features_packed()    # [V, 3]
+    valid_mask = torch.zeros_like(colors[:, 0], dtype=torch.bool)
+    valid_mask[valid_index.to(meshes.device)] = True
+    colors = harmonic_fill_colors(colors, meshes.edges_packed(), valid_mask, max_iter=max_iter, tol=tol)
+    assert not torch.isnan(colors).any()
+    meshes.textures = TexturesVertex(verts_features=[colors])
+    return meshes
+
 def complete_unseen_vertex_color(meshes: Meshes, valid_index: torch.Tensor) -> dict:
     """
     meshes: the mesh with vertex color to be completed.
@@ -222,13 +391,13 @@ def complete_unseen_vertex_color(meshes: Meshes, valid_index: torch.Tensor) -> d
     meshes.textures = TexturesVertex(verts_features=[colors])
     return meshes
 
-def multiview_color_projection(meshes: Meshes, image_list: List[Image.Image], cameras_list: List[CamerasBase]=None, camera_focal: float = 2 / 1.35, weights=None, eps=0.05, resolution=1024, device="cuda", reweight_with_cosangle="square", use_alpha=True, confidence_threshold=0.1, complete_unseen=False, below_confidence_strategy="smooth") -> Meshes:
+def multiview_color_projection(meshes: Meshes, image_list: Union[List[Image.Image], torch.Tensor], cameras_list: List[CamerasBase]=None, camera_focal: float = 2 / 1.35, weights=None, eps=0.05, resolution=1024, device="cuda", reweight_with_cosangle="square", use_alpha=True, confidence_threshold=0.1, complete_unseen=False, below_confidence_strategy="smooth", complete_unseen_method="propagate") -> Meshes:
     """
     Projects color from a given image onto a 3D mesh.
 
     Args:
         meshes (pytorch3d.structures.Meshes): The 3D mesh object, only one mesh.
-        image_list (PIL.Image.Image): List of images.
+        image_list (PIL.Image.Image): List of images, or a [N,4,H,W] tensor from images_to_tensor to keep them resident across calls.
         cameras_list (list): List of cameras.
         camera_focal (float, optional): The focal length of the camera, if cameras_list is not passed. Defaults to 2 / 1.35.
         weights (list, optional): List of weights for each image, for ['front', 'front_right', 'right', 'back', 'left', 'front_left']. Defaults to None.
@@ -239,6 +408,7 @@ def multiview_color_projection(meshes: Meshes, image_list: List[Image.Image], ca
         use_alpha (bool, optional): Whether to use the alpha channel of the image. Defaults to True.
         confidence_threshold (float, optional): The threshold for the confidence of the projected color, if final projection weight is less than this, we will use the original color. Defaults to 0.1.
         complete_unseen (bool, optional): Whether to complete the unseen vertex color using laplacian. Defaults to False.
+        complete_unseen_method (str, optional): "harmonic" solves for the unseen colors directly (complete_unseen_vertex_color_harmonic), "propagate" spreads them ring by ring (complete_unseen_vertex_color). Defaults to "propagate".
 
     Returns:
         Meshes: the colored mesh
@@ -274,23 +444,21 @@ def multiview_color_projection(meshes: Meshes, image_list: List[Image.Image], ca
     assert len(cameras_list) == len(image_list) == len(weights)
     original_color = meshes.textures.verts_features_packed()
     assert not torch.isnan(original_color).any()
-    texture_counts = torch.zeros_like(original_color[..., :1])
-    texture_values = torch.zeros_like(original_color)
-    max_texture_counts = torch.zeros_like(original_color[..., :1])
-    max_texture_values = torch.zeros_like(original_color)
-    for camera, image, weight in zip(cameras_list, image_list, weights):
-        ret = project_color(meshes, camera, image, eps=eps, resolution=resolution, device=device, use_alpha=use_alpha)
-        if reweight_with_cosangle == "linear":
-            weight = (ret['cos_angles'].abs() * weight)[:, None]
-        elif reweight_with_cosangle == "square":
-            weight = (ret['cos_angles'].abs() ** 2 * weight)[:, None]
-        if use_alpha:
-            weight = weight * ret['valid_alpha']
-        assert weight.min() > -0.0001
-        texture_counts[ret['valid_verts']] += weight
-        texture_values[ret['valid_verts']] += ret['valid_colors'] * weight
-        max_texture_values[ret['valid_verts']] = torch.where(weight > max_texture_counts[ret['valid_verts']], ret['valid_colors'], max_texture_values[ret['valid_verts']])
-        max_texture_counts[ret['valid_verts']] = torch.max(max_texture_counts[ret['valid_verts']], weight)
+    if not isinstance(image_list, torch.Tensor):
+        image_list = images_to_tensor(image_list, device)
+    ret = project_color_batch(meshes, cameras_list, image_list, eps=eps, resolution=resolution, device=device, use_alpha=use_alpha)
+    weight = torch.tensor(weights, dtype=original_color.dtype, device=device)[:, None]    # [N, 1]
+    if reweight_with_cosangle == "linear":
+        weight = ret['cos_angles'].abs() * weight
+    elif reweight_with_cosangle == "square":
+        weight = ret['cos_angles'].abs() ** 2 * weight
+    weight = weight[..., None] * ret['valid_mask'][..., None]    # [N, V, 1]
+    if use_alpha:
+        weight = weight * ret['valid_alpha']
+    assert weight.min() > -0.0001
+    # accumulate all views at once
+    texture_counts = weight.sum(dim=0)
+    texture_values = (ret['valid_colors'] * weight).sum(dim=0)
 
     # Method2
     texture_values = torch.where(texture_counts > confidence_threshold, texture_values / texture_counts, texture_values)
@@ -304,7 +472,13 @@ def multiview_color_projection(meshes: Meshes, image_list: List[Image.Image], ca
     meshes.textures = TexturesVertex(verts_features=[texture_values])
     
     if complete_unseen:
-        meshes = complete_unseen_vertex_color(meshes, torch.arange(texture_values.shape[0]).to(device)[texture_counts[:, 0] >= confidence_threshold])
+        valid_index = torch.arange(texture_values.shape[0]).to(device)[texture_counts[:, 0] >= confidence_threshold]
+        if complete_unseen_method == "harmonic":
+            meshes = complete_unseen_vertex_color_harmonic(meshes, valid_index)
+        elif complete_unseen_method == "propagate":
+            meshes = complete_unseen_vertex_color(meshes, valid_index)
+        else:
+            raise ValueError(f"complete_unseen_method={complete_unseen_method} is not supported")
     ret_mesh = meshes.detach()
     del meshes
     return ret_mesh
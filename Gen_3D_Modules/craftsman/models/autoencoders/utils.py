@@ -13,10 +13,15 @@ from skimage import measure
 from craftsman.utils.base import BaseModule
 from craftsman.utils.typing import *
 from craftsman.utils.misc import get_world_size
-from craftsman.utils.ops import generate_dense_grid_points
+from shared_utils.log_utils import cstr
 
 VALID_EMBED_TYPES = ["identity", "fourier", "hashgrid", "sphere_harmonic", "triplane_fourier"]
 
+# Points per decoder query when it can't be sized from the free device memory
+DEFAULT_NUM_CHUNKS = 10000
+PROBE_NUM_POINTS = 4096
+MAX_NUM_CHUNKS = 1 << 20
+
 class FourierEmbedder(nn.Module):
     def __init__(self,
                  num_freqs: int = 6,
@@ -204,39 +209,116 @@ class AutoEncoder(BaseModule):
     def query(self, queries: torch.FloatTensor, latents: torch.FloatTensor) -> torch.FloatTensor:
         raise NotImplementedError
     
+    def _auto_num_chunks(self, latents: torch.FloatTensor, bbox_min: torch.FloatTensor) -> int:
+        """
+        Number of points per query, sized from the memory a probe query uses per point and the memory left free on the device
+        """
+        if latents.device.type != "cuda":
+            return DEFAULT_NUM_CHUNKS
+        
+        torch.cuda.synchronize(latents.device)
+        torch.cuda.reset_peak_memory_stats(latents.device)
+        baseline = torch.cuda.memory_allocated(latents.device)
+        probe_queries = bbox_min.to(latents).view(1, 1, 3).repeat(latents.shape[0], PROBE_NUM_POINTS, 1)
+        self.query(probe_queries, latents)
+        per_point = max(torch.cuda.max_memory_allocated(latents.device) - baseline, 1) / PROBE_NUM_POINTS
+        free, _ = torch.cuda.mem_get_info(latents.device)
+        return int(min(max(free * 0.5 // per_point, PROBE_NUM_POINTS), MAX_NUM_CHUNKS))
+
+    def _query_grid_points(self, ids: torch.LongTensor, latents: torch.FloatTensor, bbox_min: torch.FloatTensor, cell_size: torch.FloatTensor, num_chunks: int):
+        """Logits [B, N] of the lattice points at integer coordinates ids [N, 3], kept on device"""
+        logits = torch.empty((latents.shape[0], ids.shape[0]), dtype=torch.float, device=latents.device)
+        for start in range(0, ids.shape[0], num_chunks):
+            queries = (ids[start: start + num_chunks] * cell_size + bbox_min).to(latents)
+            batch_queries = repeat(queries, "p c -> b p c", b=latents.shape[0])
+            logits[:, start: start + num_chunks] = self.query(batch_queries, latents).reshape(latents.shape[0], -1).float()
+        return logits
+
+    def _octree_grid_logits(self, latents, grids_resolution, coarse_grids_resolution, bbox_min, cell_size, num_chunks):
+        """
+        Logits on the (grids_resolution+1)^3 lattice, queried level by level: the lattice is evaluated at about coarse_grids_resolution first,
+        then at each level only the cells whose corners change sign (dilated by one cell) are subdivided and their new points queried,
+        the other cells are trilinearly interpolated from their corners which lie on the same side of the surface.
+        """
+        device = latents.device
+        batch_size = latents.shape[0]
+        # largest power of two step dividing the resolution while keeping the coarse lattice at least coarse_grids_resolution
+        step = 1
+        while grids_resolution % (step * 2) == 0 and grids_resolution // (step * 2) >= coarse_grids_resolution:
+            step *= 2
+        res = grids_resolution // step
+        
+        coarse_ids = torch.stack(torch.meshgrid(*[torch.arange(res + 1, device=device)] * 3, indexing="ij"), dim=-1).view(-1, 3)
+        grid_logits = self._query_grid_points(coarse_ids * step, latents, bbox_min, cell_size, num_chunks).view(batch_size, res + 1, res + 1, res + 1)
+        num_queries = coarse_ids.shape[0] * batch_size
+        
+        while step > 1:
+            inside = (grid_logits > 0).float().unsqueeze(1)
+            crossing = F.max_pool3d(inside, 2, stride=1) * F.max_pool3d(1 - inside, 2, stride=1) # [B, 1, res, res, res]
+            # dilate by one cell, so a surface poking through a cell face between its corners is still refined
+            active_cells = F.max_pool3d(crossing, 3, stride=1, padding=1)
+            # a point of the finer lattice is queried if any of the finer cells around it lies in an active cell
+            active_points = F.max_pool3d(F.interpolate(active_cells, scale_factor=2, mode="nearest"), 2, stride=1, padding=1)[:, 0] > 0
+            active_points[:, ::2, ::2, ::2] = False # already known from the coarser lattice
+            
+            grid_logits = F.interpolate(grid_logits.unsqueeze(1), size=(2 * res + 1,) * 3, mode="trilinear", align_corners=True)[:, 0]
+            res *= 2
+            step //= 2
+            # each shape subdivides its own cells
+            for i in range(batch_size):
+                ids = active_points[i].nonzero()
+                grid_logits[i, ids[:, 0], ids[:, 1], ids[:, 2]] = self._query_grid_points(ids * step, latents[i:i+1], bbox_min, cell_size, num_chunks)[0]
+                num_queries += ids.shape[0]
+        
+        cstr(f"[extract_geometry] octree decoding queried {num_queries} points instead of {batch_size * (grids_resolution + 1) ** 3}").msg.print()
+        return grid_logits
+
     @torch.no_grad()
     def extract_geometry(self,
                          latents: torch.FloatTensor,
                          bounds: Union[Tuple[float], List[float], float] = (-1.05, -1.05, -1.05, 1.05, 1.05, 1.05),
                          grids_resolution: int = 256,
-                         num_chunks: int = 10000,
+                         num_chunks: Optional[int] = None,
+                         octree_depth: Optional[int] = None,
+                         coarse_grids_resolution: int = 0,
                          ):
-        
+        """
+        Args:
+            num_chunks (int, optional): number of points per query, None to size it from the memory left free on the device.
+            octree_depth (int, optional): if given, grids_resolution is 2^octree_depth.
+            coarse_grids_resolution (int, optional): if > 0, query the logits hierarchically starting from a lattice of about this resolution
+                (see _octree_grid_logits), so the number of queries grows with the surface area instead of the volume of the grid.
+                Surfaces stay identical to the dense evaluation as long as no feature is thinner than a coarse cell. 0 queries the dense lattice.
+        """
         if isinstance(bounds, float):
             bounds = [-bounds, -bounds, -bounds, bounds, bounds, bounds]
+        if octree_depth is not None:
+            grids_resolution = 2 ** octree_depth
 
         bbox_min = np.array(bounds[0:3])
         bbox_max = np.array(bounds[3:6])
         bbox_size = bbox_max - bbox_min
-
-        xyz_samples, grid_size, length = generate_dense_grid_points(
-            bbox_min=bbox_min,
-            bbox_max=bbox_max,
-            grids_resolution=grids_resolution,
-            indexing="ij"
-        )
-        xyz_samples = torch.FloatTensor(xyz_samples)
+        grid_size = [grids_resolution + 1] * 3
+        
+        device = latents.device
         batch_size = latents.shape[0]
+        bbox_min_pt = torch.tensor(bbox_min, dtype=torch.float, device=device)
+        cell_size = torch.tensor(bbox_size / grids_resolution, dtype=torch.float, device=device)
+        
+        if num_chunks is None:
+            num_chunks = self._auto_num_chunks(latents, bbox_min_pt)
 
-        batch_logits = []
-        for start in range(0, xyz_samples.shape[0], num_chunks):
-            queries = xyz_samples[start: start + num_chunks, :].to(latents)
-            batch_queries = repeat(queries, "p c -> b p c", b=batch_size)
-
-            logits = self.query(batch_queries, latents)
-            batch_logits.append(logits.cpu())
-
-        grid_logits = torch.cat(batch_logits, dim=1).view((batch_size, grid_size[0], grid_size[1], grid_size[2])).float().numpy()
+        # logits stay on device until marching cubes
+        if coarse_grids_resolution > 0 and coarse_grids_resolution < grids_resolution:
+            grid_logits = self._octree_grid_logits(latents, grids_resolution, coarse_grids_resolution, bbox_min_pt, cell_size, num_chunks)
+        else:
+            grid_logits = torch.empty((batch_size, grid_size[0] * grid_size[1] * grid_size[2]), dtype=torch.float, device=device)
+            for start in range(0, grid_logits.shape[1], num_chunks):
+                linear_ids = torch.arange(start, min(start + num_chunks, grid_logits.shape[1]), device=device)
+                ids = torch.stack([linear_ids // (grid_size[1] * grid_size[2]), (linear_ids // grid_size[2]) % grid_size[1], linear_ids % grid_size[2]], dim=-1)
+                grid_logits[:, start: start + num_chunks] = self._query_grid_points(ids, latents, bbox_min_pt, cell_size, num_chunks)
+        
+        grid_logits = grid_logits.view((batch_size, grid_size[0], grid_size[1], grid_size[2])).cpu().numpy()
 
         mesh_v_f = []
         has_surface = np.zeros((batch_size,), dtype=np.bool_)
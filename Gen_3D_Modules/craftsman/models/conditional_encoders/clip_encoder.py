@@ -97,11 +97,13 @@ class CLIPEmbedder(BaseEmbedder):
 
     def encode_image(self, images: Iterable[Optional[ImageType]], cameras: Optional[torch.Tensor] = None, force_none_camera_embeds: bool = False, return_dict: bool = False, **kwargs) -> torch.FloatTensor:
         camera_embeds = None
-        if isinstance(images, (np.ndarray, torch.Tensor)): # for training process
+        if isinstance(images, (np.ndarray, torch.Tensor)): # for training process, or inference on [N, H, W, C] image tensors
             assert images.min() >= 0.0 and images.max() <= 1.0, "The pixel values should be in the range of [0, 1]"
             do_rescale = False
             if self.cfg.encode_camera:
-                assert cameras is not None, "The cameras should be provided"
+                if cameras is None:
+                    bs = len(images) // self.cfg.n_views
+                    cameras = self.cameras[:self.cfg.n_views].repeat(bs, 1, 1).to(self.model.device)
                 camera_embeds = self.encode_camera(cameras)
             pixel_values = self.transform(images.permute(0, 3, 1, 2))
         else: # for inference process
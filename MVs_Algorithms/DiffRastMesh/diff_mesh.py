@@ -20,6 +20,10 @@ class DiffMeshCameraController(BaseCameraController):
     def get_render_result(self, render_pose, bg_color, **kwargs):
         ref_cam = (render_pose, self.cam.perspective)
         return self.renderer.render(*ref_cam, self.cam.H, self.cam.W, ssaa=1, bg_color=bg_color, **kwargs) #ssaa = min(2.0, max(0.125, 2 * np.random.random()))
+    
+    def get_batch_render_result(self, render_poses, bg_colors, **kwargs):
+        # nvdiffrast rasterizes all poses of the batch in one call
+        return self.renderer.render(render_poses, self.cam.perspective, self.cam.H, self.cam.W, ssaa=1, bg_color=bg_colors, **kwargs)
 
 class DiffMesh:
     
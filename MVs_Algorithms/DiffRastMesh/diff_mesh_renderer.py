@@ -71,6 +71,17 @@ class DiffRastRenderer(nn.Module):
     
     def render(self, pose, proj, h0, w0, ssaa=1, bg_color=1, texture_filter='linear', 
                optional_render_types=['depth', 'normal']):
+        """
+        Render the mesh from one pose, or from a batch of poses in a single rasterization
+
+        Args:
+            pose (NDArray[float32], shape: [4, 4] or [B, 4, 4]): pose (cam2world) matrix
+            proj (NDArray[float32], shape: [4, 4]): projection matrix
+            bg_color (float or Tensor[float32], shape: [3] or [B, 3]): background color
+
+        Returns:
+            dict: rendered maps of shape [H, W, C], or [B, H, W, C] when pose is batched
+        """
         
         # do super-sampling
         if ssaa != 1:
@@ -89,26 +100,31 @@ class DiffRastRenderer(nn.Module):
 
         pose = torch.from_numpy(pose.astype(np.float32)).to(v.device)
         proj = torch.from_numpy(proj.astype(np.float32)).to(v.device)
+        
+        batched = pose.dim() == 3
+        if not batched:
+            pose = pose.unsqueeze(0)
+        if torch.is_tensor(bg_color):
+            bg_color = bg_color.reshape(-1, 1, 1, 3)
 
         # get v_clip and render rgb
-        v_cam = torch.matmul(F.pad(v, pad=(0, 1), mode='constant', value=1.0), torch.inverse(pose).T).float().unsqueeze(0)
+        v_cam = torch.matmul(F.pad(v, pad=(0, 1), mode='constant', value=1.0), torch.inverse(pose).transpose(1, 2)).float() # [B, N, 4]
         v_clip = v_cam @ proj.T
 
         rast, rast_db = dr.rasterize(self.glctx, v_clip, self.mesh.f, (h, w))
 
-        #alpha = (rast[0, ..., 3:] > 0).float() # [H, W, 1]
-        alpha = torch.clamp(rast[..., -1:], 0, 1).contiguous() # [1, H, W, 1]
-        alpha = dr.antialias(alpha, rast, v_clip, self.mesh.f).clamp(0, 1).squeeze(0) # [H, W, 1] important to enable gradients!
+        #alpha = (rast[..., 3:] > 0).float() # [B, H, W, 1]
+        alpha = torch.clamp(rast[..., -1:], 0, 1).contiguous() # [B, H, W, 1]
+        alpha = dr.antialias(alpha, rast, v_clip, self.mesh.f).clamp(0, 1) # [B, H, W, 1] important to enable gradients!
             
-        # render albedo
+        # render albedo, attributes and texture of batch size 1 are broadcast over all poses
         texc, texc_db = dr.interpolate(self.mesh.vt.unsqueeze(0).contiguous(), rast, self.mesh.ft, rast_db=rast_db, diff_attrs='all')
-        albedo = dr.texture(self.raw_albedo.unsqueeze(0), texc, uv_da=texc_db, filter_mode=texture_filter) # [1, H, W, 3]
+        albedo = dr.texture(self.raw_albedo.unsqueeze(0), texc, uv_da=texc_db, filter_mode=texture_filter) # [B, H, W, 3]
         albedo = torch.sigmoid(albedo)
         
         # render depth
         if 'depth' in optional_render_types:
-            depth, _ = dr.interpolate(-v_cam[..., [2]], rast, self.mesh.f) # [1, H, W, 1]
-            depth = depth.squeeze(0) # [H, W, 1]
+            depth, _ = dr.interpolate(-v_cam[..., [2]], rast, self.mesh.f) # [B, H, W, 1]
 
         # get vn and render normal
         if 'normal' in optional_render_types:
@@ -129,24 +145,24 @@ class DiffRastRenderer(nn.Module):
                 vn = self.mesh.vn
             
             normal, _ = dr.interpolate(vn.unsqueeze(0).contiguous(), rast, self.mesh.fn)
-            normal = safe_normalize(normal[0])
+            normal = safe_normalize(normal) # [B, H, W, 3]
 
             # rotated normal (where [0, 0, 1] always faces camera)
-            viewcos = normal @ pose[:3, :3]
+            viewcos = normal @ pose[:, None, :3, :3]
 
         # antialias
-        albedo = dr.antialias(albedo, rast, v_clip, self.mesh.f).squeeze(0).contiguous() # [H, W, 3]
+        albedo = dr.antialias(albedo, rast, v_clip, self.mesh.f).contiguous() # [B, H, W, 3]
         albedo = alpha * albedo + (1 - alpha) * bg_color
 
         # ssaa
         if ssaa != 1:
-            albedo = scale_img_hwc(albedo, (h0, w0))
-            alpha = scale_img_hwc(alpha, (h0, w0))
+            albedo = scale_img_nhwc(albedo, (h0, w0))
+            alpha = scale_img_nhwc(alpha, (h0, w0))
             if 'depth' in optional_render_types:
-                depth = scale_img_hwc(depth, (h0, w0))
+                depth = scale_img_nhwc(depth, (h0, w0))
             if 'normal' in optional_render_types:
-                normal = scale_img_hwc(normal, (h0, w0))
-                viewcos = scale_img_hwc(viewcos, (h0, w0))
+                normal = scale_img_nhwc(normal, (h0, w0))
+                viewcos = scale_img_nhwc(viewcos, (h0, w0))
 
         results['image'] = albedo.clamp(0, 1)
         results['alpha'] = alpha
@@ -155,5 +171,8 @@ class DiffRastRenderer(nn.Module):
         if 'normal' in optional_render_types:
             results['normal'] = (normal + 1) / 2
             results['viewcos'] = (viewcos + 1) / 2
+            
+        if not batched:
+            results = {k: x.squeeze(0) for k, x in results.items()}
 
-        return results
\ No newline at end of file
+        return results
@@ -131,7 +131,7 @@ class FlexiCubes:
         return verts_unique - 0.5, cubes
 
     def __call__(self, x_nx3, s_n, cube_fx8, res, beta_fx12=None, alpha_fx8=None,
-                 gamma_f=None, training=False, output_tetmesh=False, grad_func=None):
+                 gamma_f=None, training=False, output_tetmesh=False, grad_func=None, cube_coords_fx3=None):
         r"""
         Main function for mesh extraction from scalar field using FlexiCubes. This function converts 
         discrete signed distance fields, encoded on voxel grids and additional per-cube parameters, 
@@ -173,6 +173,10 @@ class FlexiCubes:
             grad_func (callable, optional): A function to compute the surface gradient at specified 
                 3D positions (input: Nx3 positions). The function should return gradients as an Nx3 
                 tensor. If None, the original FlexiCubes algorithm is utilized. Defaults to None.
+            cube_coords_fx3 (torch.LongTensor, optional): Integer grid coordinates of each cube in cube_fx8, 
+                required when cube_fx8 only holds a subset of the cubes of the voxel grid (sparse grid). 
+                If None, cube_fx8 must hold every cube of the grid in the order of construct_voxel_grid. 
+                Defaults to None.
 
         Returns:
             (torch.Tensor, torch.LongTensor, torch.Tensor): Tuple containing:
@@ -199,7 +203,7 @@ class FlexiCubes:
                 device=self.device)
         beta_fx12, alpha_fx8, gamma_f = self._normalize_weights(beta_fx12, alpha_fx8, gamma_f, surf_cubes)
 
-        case_ids = self._get_case_id(occ_fx8, surf_cubes, res)
+        case_ids = self._get_case_id(occ_fx8, surf_cubes, res, cube_coords_fx3)
 
         surf_edges, idx_map, edge_counts, surf_edges_mask = self._identify_surf_edges(s_n, cube_fx8, surf_cubes)
 
@@ -249,11 +253,12 @@ class FlexiCubes:
         return beta_fx12[surf_cubes], alpha_fx8[surf_cubes], gamma_f[surf_cubes]
 
     @torch.no_grad()
-    def _get_case_id(self, occ_fx8, surf_cubes, res):
+    def _get_case_id(self, occ_fx8, surf_cubes, res, cube_coords_fx3=None):
         """
         Obtains the ID of topology cases based on cell corner occupancy. This function resolves the 
         ambiguity in the Dual Marching Cubes (DMC) configurations as described in Section 1.3 of the 
-        supplementary material. It should be noted that this function assumes a regular grid.
+        supplementary material. It should be noted that this function assumes a regular grid, 
+        of which cube_fx8 holds either every cube or the cubes at cube_coords_fx3.
         """
         case_ids = (occ_fx8[surf_cubes] * self.cube_corners_idx.to(self.device).unsqueeze(0)).sum(-1)
 
@@ -263,13 +268,16 @@ class FlexiCubes:
         if not isinstance(res, (list, tuple)):
             res = [res, res, res]
 
-        # The 'problematic_configs' only contain configurations for surface cubes. Next, we construct a 3D array,
-        # 'problem_config_full', to store configurations for all cubes (with default config for non-surface cubes).
-        # This allows efficient checking on adjacent cubes.
-        problem_config_full = torch.zeros(list(res) + [5], device=self.device, dtype=torch.long)
-        vol_idx = torch.nonzero(problem_config_full[..., 0] == 0)  # N, 3
-        vol_idx_problem = vol_idx[surf_cubes][to_check]
-        problem_config_full[vol_idx_problem[..., 0], vol_idx_problem[..., 1], vol_idx_problem[..., 2]] = problem_config
+        if cube_coords_fx3 is None:
+            # The 'problematic_configs' only contain configurations for surface cubes. Next, we construct a 3D array,
+            # 'problem_config_full', to store configurations for all cubes (with default config for non-surface cubes).
+            # This allows efficient checking on adjacent cubes.
+            problem_config_full = torch.zeros(list(res) + [5], device=self.device, dtype=torch.long)
+            vol_idx = torch.nonzero(problem_config_full[..., 0] == 0)  # N, 3
+            vol_idx_problem = vol_idx[surf_cubes][to_check]
+            problem_config_full[vol_idx_problem[..., 0], vol_idx_problem[..., 1], vol_idx_problem[..., 2]] = problem_config
+        else:
+            vol_idx_problem = cube_coords_fx3[surf_cubes][to_check]
         vol_idx_problem_adj = vol_idx_problem + problem_config[..., 1:4]
 
         within_range = (
@@ -283,10 +291,23 @@ class FlexiCubes:
         vol_idx_problem = vol_idx_problem[within_range]
         vol_idx_problem_adj = vol_idx_problem_adj[within_range]
         problem_config = problem_config[within_range]
-        problem_config_adj = problem_config_full[vol_idx_problem_adj[..., 0],
-                                                 vol_idx_problem_adj[..., 1], vol_idx_problem_adj[..., 2]]
-        # If two cubes with cases C16 and C19 share an ambiguous face, both cases are inverted.
-        to_invert = (problem_config_adj[..., 0] == 1)
+        if cube_coords_fx3 is None:
+            problem_config_adj = problem_config_full[vol_idx_problem_adj[..., 0],
+                                                     vol_idx_problem_adj[..., 1], vol_idx_problem_adj[..., 2]]
+            # If two cubes with cases C16 and C19 share an ambiguous face, both cases are inverted.
+            to_invert = (problem_config_adj[..., 0] == 1)
+        else:
+            # A dense volume of configurations doesn't fit sparse grids of high resolution, look up whether the 
+            # adjacent cube is problematic too in the sorted linear indices of the problematic cubes instead.
+            def linear_idx(idx):
+                return (idx[..., 0] * res[1] + idx[..., 1]) * res[2] + idx[..., 2]
+            problem_linear_idx = torch.sort(linear_idx(cube_coords_fx3[surf_cubes][to_check])).values
+            adj_linear_idx = linear_idx(vol_idx_problem_adj)
+            if problem_linear_idx.shape[0] > 0:
+                found = torch.searchsorted(problem_linear_idx, adj_linear_idx).clamp(max=problem_linear_idx.shape[0] - 1)
+                to_invert = problem_linear_idx[found] == adj_linear_idx
+            else:
+                to_invert = torch.zeros_like(adj_linear_idx, dtype=torch.bool)
         idx = torch.arange(case_ids.shape[0], device=self.device)[to_check][within_range][to_invert]
         case_ids.index_put_((idx,), problem_config[to_invert][..., -1])
         return case_ids
@@ -11,14 +11,28 @@ from .flexicubes_renderer import FlexiCubesRenderer
 from .flexicubes import FlexiCubes
 from .util import SimpleMesh
 from .loss import sdf_reg_loss
+from .sparse_grid import (
+    grid_linear_index,
+    lookup_sorted,
+    construct_sparse_voxel_grid,
+    unique_grid_edges,
+    surface_band_cubes,
+    upsample_sdf_grid,
+    upsample_cube_coords,
+    get_grid_growth_resolutions,
+)
 
 from shared_utils.camera_utils import OrbitCamera
+from shared_utils.log_utils import cstr
 from mesh_processer.mesh import Mesh
 
 
 def lr_schedule(iter):
     return max(0.0, 10**(-(iter)*0.0002)) # Exponential falloff from [1.0, 0.1] over 5k epochs. 
 
+# Sparse grids reach their final resolution at this fraction of the training iterations
+GRID_GROWTH_END = 0.6
+
 class FlexiCubesTrainer:
     
     def __init__(
@@ -36,17 +50,50 @@ class FlexiCubesTrainer:
             remove_floaters_weight=0.5,
             cube_stabilizer_weight=0.1,
             force_cuda_rast=False,
+            sparse_grid=False,
+            coarse_grids_resolution=64,
+            band_update_interval=100,
+            band_width=2,
             device='cuda'
         ):
+        """
+        Args:
+            sparse_grid (bool, optional): only keep the parameters of the cubes within band_width cubes of the surface, re-activating 
+                and pruning cubes every band_update_interval iterations, and grow the grid from coarse_grids_resolution 
+                to voxel_grids_resolution by doubling it. Memory and step time then scale with the surface instead of the volume. Defaults to False.
+            coarse_grids_resolution (int, optional): resolution of the dense grid sparse training starts from. Defaults to 64.
+            band_update_interval (int, optional): iterations between two updates of the active cubes of the sparse grid. Defaults to 100.
+            band_width (int, optional): cubes kept active on each side of the cubes crossed by the surface. Defaults to 2.
+        """
         self.device = torch.device(device)
         
         self.renderer = FlexiCubesRenderer(force_cuda_rast)
 
+        self.training_iterations = training_iterations
+
         #  Create and initialize FlexiCubes
-        self.voxel_grid_res = voxel_grids_resolution
         self.fc = FlexiCubes(self.device)
-        self.x_nx3, self.cube_fx8 = self.fc.construct_voxel_grid(self.voxel_grid_res)
-        self.x_nx3 *= 2 # scale up the grid so that it's larger than the target object
+        self.sparse_grid = sparse_grid
+        if sparse_grid:
+            self.band_update_interval = band_update_interval
+            self.band_width = band_width
+            grid_resolutions = get_grid_growth_resolutions(coarse_grids_resolution, voxel_grids_resolution)
+            # iteration at which each finer resolution starts
+            self.grid_growth_schedule = {
+                int(training_iterations * GRID_GROWTH_END * level / (len(grid_resolutions) - 1)): res for level, res in enumerate(grid_resolutions) if level > 0
+            }
+            
+            # the coarsest grid starts dense
+            self.voxel_grid_res = grid_resolutions[0]
+            res = self.voxel_grid_res
+            self.build_sparse_grid(torch.nonzero(torch.ones((res, res, res), dtype=torch.bool, device=self.device)))
+            # last known SDF of every vertex of the dense grid, used to initialize the SDF of re-activated cubes
+            self.sdf_grid = torch.zeros((res + 1,) * 3, dtype=torch.float, device=self.device)
+        else:
+            self.voxel_grid_res = voxel_grids_resolution
+            self.x_nx3, self.cube_fx8 = self.fc.construct_voxel_grid(self.voxel_grid_res)
+            self.x_nx3 *= 2 # scale up the grid so that it's larger than the target object
+            self.cube_coords = None
         
         self.sdf = torch.rand_like(self.x_nx3[:,0]) - 0.1 # randomly init SDF
         self.sdf    = torch.nn.Parameter(self.sdf.clone().detach(), requires_grad=True)
@@ -55,16 +102,20 @@ class FlexiCubesTrainer:
         self.weight    = torch.nn.Parameter(self.weight.clone().detach(), requires_grad=True)
         self.deform = torch.nn.Parameter(torch.zeros_like(self.x_nx3), requires_grad=True)
         
-        #  Retrieve all the edges of the voxel grid; these edges will be utilized to 
-        #  compute the regularization loss in subsequent steps of the process.    
-        all_edges = self.cube_fx8[:, self.fc.cube_edges].reshape(-1, 2)
-        self.grid_edges = torch.unique(all_edges, dim=0)
+        if not sparse_grid:
+            #  Retrieve all the edges of the voxel grid; these edges will be utilized to 
+            #  compute the regularization loss in subsequent steps of the process.    
+            all_edges = self.cube_fx8[:, self.fc.cube_edges].reshape(-1, 2)
+            self.grid_edges = torch.unique(all_edges, dim=0)
         
         #  Setup optimizer
-        self.optimizer = torch.optim.Adam([self.sdf, self.weight, self.deform], lr=learning_rate)
+        self.optimizer = torch.optim.Adam([
+            {'params': [self.sdf], 'name': 'sdf'},
+            {'params': [self.weight], 'name': 'weight'},
+            {'params': [self.deform], 'name': 'deform'},
+        ], lr=learning_rate)
         self.scheduler = torch.optim.lr_scheduler.LambdaLR(self.optimizer, lr_lambda=lambda x: lr_schedule(x)) 
         
-        self.training_iterations = training_iterations
         self.batch_size = batch_size
         
         self.depth_near = -depth_near
@@ -108,6 +159,99 @@ class FlexiCubesTrainer:
         self.mvp_all = torch.stack(mvp_all).to(self.device)
         self.camposes_len = len(self.all_ref_cam_poses)
     
+    def build_sparse_grid(self, cube_coords):
+        """Make the cubes at cube_coords (integer coordinates sorted by linear index) the active cubes of the sparse grid"""
+        self.cube_coords = cube_coords
+        x_nx3, self.cube_fx8, self.verts_linear_idx = construct_sparse_voxel_grid(cube_coords, self.voxel_grid_res, self.fc.cube_corners)
+        self.x_nx3 = x_nx3 * 2 # scale up the grid so that it's larger than the target object
+        self.grid_edges = unique_grid_edges(self.cube_fx8, self.fc.cube_edges, self.x_nx3.shape[0])
+    
+    def replace_tensors_to_optimizer(self, tensors_dict):
+        """
+        Replace the optimized tensors by the ones in tensors_dict, given as {group name: (tensor, index_map)}, 
+        carrying the Adam moments of every entry whose index_map (index into the replaced tensor) is not -1
+        """
+        optimizable_tensors = {}
+        for group in self.optimizer.param_groups:
+            tensor, index_map = tensors_dict[group["name"]]
+            kept = index_map >= 0
+            stored_state = self.optimizer.state.get(group['params'][0], None)
+            if stored_state is not None:
+                for moment_name in ["exp_avg", "exp_avg_sq"]:
+                    moment = torch.zeros_like(tensor)
+                    moment[kept] = stored_state[moment_name][index_map[kept]]
+                    stored_state[moment_name] = moment
+                
+                del self.optimizer.state[group['params'][0]]
+                group["params"][0] = torch.nn.Parameter(tensor.requires_grad_(True))
+                self.optimizer.state[group['params'][0]] = stored_state
+            else:
+                group["params"][0] = torch.nn.Parameter(tensor.requires_grad_(True))
+            
+            optimizable_tensors[group["name"]] = group["params"][0]
+        
+        self.sdf = optimizable_tensors["sdf"]
+        self.weight = optimizable_tensors["weight"]
+        self.deform = optimizable_tensors["deform"]
+    
+    @torch.no_grad()
+    def update_sparse_grid(self, step):
+        """Grow the sparse grid to its next resolution or update its active cubes when scheduled at this step"""
+        if step in self.grid_growth_schedule:
+            self.grow_sparse_grid(self.grid_growth_schedule[step])
+        elif step > 0 and step % self.band_update_interval == 0:
+            self.update_surface_band()
+    
+    @torch.no_grad()
+    def update_surface_band(self):
+        """Prune the cubes that left the band around the surface and activate the ones that entered it"""
+        self.sdf_grid.view(-1)[self.verts_linear_idx] = self.sdf.detach()
+        cube_coords = surface_band_cubes(self.sdf_grid, self.band_width)
+        if cube_coords.shape[0] == 0:
+            return # no surface yet, keep the current cubes
+        
+        res = self.voxel_grid_res
+        old_verts_linear_idx = self.verts_linear_idx
+        old_cubes_linear_idx = grid_linear_index(self.cube_coords, res)
+        old_weight, old_deform = self.weight.detach(), self.deform.detach()
+        
+        self.build_sparse_grid(cube_coords)
+        
+        verts_map = lookup_sorted(old_verts_linear_idx, self.verts_linear_idx)
+        cubes_map = lookup_sorted(old_cubes_linear_idx, grid_linear_index(self.cube_coords, res))
+        # kept vertices hold their current SDF in sdf_grid, re-activated ones their last known one
+        sdf = self.sdf_grid.view(-1)[self.verts_linear_idx]
+        deform = torch.zeros_like(self.x_nx3)
+        deform[verts_map >= 0] = old_deform[verts_map[verts_map >= 0]]
+        weight = torch.zeros((self.cube_fx8.shape[0], 21), dtype=torch.float, device=self.device)
+        weight[cubes_map >= 0] = old_weight[cubes_map[cubes_map >= 0]]
+        
+        self.replace_tensors_to_optimizer({"sdf": (sdf, verts_map), "weight": (weight, cubes_map), "deform": (deform, verts_map)})
+    
+    @torch.no_grad()
+    def grow_sparse_grid(self, res):
+        """
+        Upsample the sparse grid to resolution res: the SDF is trilinearly interpolated and only the cubes in the band 
+        around its surface are activated. Deformations and weights are relative to the cube size, so they start over from zeros.
+        """
+        self.sdf_grid.view(-1)[self.verts_linear_idx] = self.sdf.detach()
+        self.sdf_grid = upsample_sdf_grid(self.sdf_grid, res)
+        cube_coords = surface_band_cubes(self.sdf_grid, self.band_width)
+        if cube_coords.shape[0] == 0:
+            cube_coords = upsample_cube_coords(self.cube_coords, self.voxel_grid_res, res)
+        
+        self.voxel_grid_res = res
+        self.build_sparse_grid(cube_coords)
+        
+        sdf = self.sdf_grid.view(-1)[self.verts_linear_idx]
+        deform = torch.zeros_like(self.x_nx3)
+        weight = torch.zeros((self.cube_fx8.shape[0], 21), dtype=torch.float, device=self.device)
+        verts_map = torch.full_like(self.verts_linear_idx, -1)
+        cubes_map = torch.full((self.cube_fx8.shape[0],), -1, dtype=torch.long, device=self.device)
+        self.replace_tensors_to_optimizer({"sdf": (sdf, verts_map), "weight": (weight, cubes_map), "deform": (deform, verts_map)})
+        
+        cstr(f"[{self.__class__.__name__}] grid resolution {res}: {self.cube_fx8.shape[0]} active cubes ({self.cube_fx8.shape[0] / res**3 * 100:.2f}% of the dense grid)").msg.print()
+    
     def training(self):
         starter = torch.cuda.Event(enable_timing=True)
         ender = torch.cuda.Event(enable_timing=True)
@@ -121,6 +265,9 @@ class FlexiCubesTrainer:
             return_types = ["mask", "depth"]
         
         for step in tqdm.trange(self.training_iterations):
+            if self.sparse_grid:
+                self.update_sparse_grid(step)
+            
             # sample random render & camera pose from multi-views
             batch_index = np.random.randint(0, self.camposes_len, size=self.batch_size)
             mv = self.mv_all[batch_index, :, :]
@@ -132,7 +279,7 @@ class FlexiCubesTrainer:
             # extract and render FlexiCubes mesh
             grid_verts = self.x_nx3 + (2-1e-8) / (self.voxel_grid_res * 2) * torch.tanh(self.deform)
             vertices, faces, L_dev = self.fc(grid_verts, self.sdf, self.cube_fx8, self.voxel_grid_res, beta_fx12=self.weight[:,:12], alpha_fx8=self.weight[:,12:20],
-                gamma_f=self.weight[:,20], training=True)
+                gamma_f=self.weight[:,20], training=True, cube_coords_fx3=self.cube_coords)
             flexicubes_mesh = SimpleMesh(vertices, faces)
             if self.ref_normal_imgs_torch is not None:
                 flexicubes_mesh.auto_normals()
@@ -170,7 +317,7 @@ class FlexiCubesTrainer:
     def get_mesh(self):
         grid_verts = self.x_nx3 + (2-1e-8) / (self.voxel_grid_res * 2) * torch.tanh(self.deform)
         vertices, faces, L_dev = self.fc(grid_verts, self.sdf, self.cube_fx8, self.voxel_grid_res, beta_fx12=self.weight[:,:12], alpha_fx8=self.weight[:,12:20],
-            gamma_f=self.weight[:,20], training=False)
+            gamma_f=self.weight[:,20], training=False, cube_coords_fx3=self.cube_coords)
 
         v = vertices.detach().contiguous().float().to(self.device)
         f = faces.detach().contiguous().float().to(self.device)
@@ -191,7 +338,7 @@ class FlexiCubesTrainer:
             with torch.no_grad():
                 # extract mesh with training=False
                 vertices, faces, L_dev = self.fc(grid_verts, self.sdf, self.cube_fx8, self.voxel_grid_res, beta_fx12=self.weight[:,:12], alpha_fx8=self.weight[:,12:20],
-                gamma_f=self.weight[:,20], training=False)
+                gamma_f=self.weight[:,20], training=False, cube_coords_fx3=self.cube_coords)
                 flexicubes_mesh = SimpleMesh(vertices, faces)
                 flexicubes_mesh.auto_normals() # compute face normals for visualization
                 
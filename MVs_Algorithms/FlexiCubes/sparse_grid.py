@@ -0,0 +1,82 @@
+import torch
+import torch.nn.functional as F
+
+###############################################################################
+# Sparse voxel grids for FlexiCubes: only the cubes in a band around the
+# surface are kept, indexed by their integer coordinates in the dense grid
+###############################################################################
+
+def grid_linear_index(coords, res):
+    """Linear index of integer coordinates [..., 3] in a res^3 grid, ordered as torch.nonzero on the dense grid"""
+    return (coords[..., 0] * res + coords[..., 1]) * res + coords[..., 2]
+
+def grid_coords(linear_idx, res):
+    return torch.stack([linear_idx // (res * res), (linear_idx // res) % res, linear_idx % res], dim=-1)
+
+def lookup_sorted(sorted_keys, keys):
+    """Position of every key of keys in sorted_keys, -1 for the ones it doesn't contain"""
+    if sorted_keys.shape[0] == 0:
+        return torch.full_like(keys, -1)
+    pos = torch.searchsorted(sorted_keys, keys).clamp(max=sorted_keys.shape[0] - 1)
+    return torch.where(sorted_keys[pos] == keys, pos, -1)
+
+def construct_sparse_voxel_grid(cube_coords, res, cube_corners):
+    """
+    Same as FlexiCubes.construct_voxel_grid, for the cubes at cube_coords only.
+
+    Args:
+        cube_coords (torch.LongTensor): [C, 3] integer coordinates of the cubes, sorted by linear index
+        res (int): resolution of the dense voxel grid
+        cube_corners (torch.Tensor): [8, 3] FlexiCubes.cube_corners
+
+    Returns:
+        (torch.Tensor, torch.LongTensor, torch.LongTensor): vertices centered at the origin with the length of each dimension being one,
+            indices of the 8 cube corners into vertices, and linear index of each vertex in the (res+1)^3 grid of vertices (sorted)
+    """
+    corners = cube_coords.unsqueeze(1) + cube_corners.long().unsqueeze(0)  # C, 8, 3
+    corners_linear_idx = grid_linear_index(corners, res + 1).reshape(-1)
+    # sorted like the unique vertices of construct_voxel_grid, so a fully active sparse grid matches the dense one
+    verts_linear_idx, cubes = torch.unique(corners_linear_idx, return_inverse=True)
+    verts = grid_coords(verts_linear_idx, res + 1).float() / res - 0.5
+    return verts, cubes.reshape(-1, 8), verts_linear_idx
+
+def unique_grid_edges(cubes, cube_edges, num_verts):
+    """Same as torch.unique(cubes[:, cube_edges].reshape(-1, 2), dim=0), on 1D keys which is much faster on large grids"""
+    all_edges = cubes[:, cube_edges].reshape(-1, 2)
+    edges_key = torch.unique(all_edges[:, 0] * num_verts + all_edges[:, 1])
+    return torch.stack([edges_key // num_verts, edges_key % num_verts], dim=-1)
+
+@torch.no_grad()
+def surface_band_cubes(sdf_grid, band_width):
+    """
+    Integer coordinates of the cubes within band_width cubes of a cube crossed by the surface (corners of different signs).
+
+    Args:
+        sdf_grid (torch.Tensor): [res+1, res+1, res+1] scalar field on the vertices of the dense grid
+        band_width (int): number of cubes kept on each side of the surface cubes
+    """
+    occ = (sdf_grid < 0).float()[None, None]
+    surf = F.max_pool3d(occ, 2, stride=1) * F.max_pool3d(1 - occ, 2, stride=1)
+    if band_width > 0:
+        surf = F.max_pool3d(surf, 2 * band_width + 1, stride=1, padding=band_width)
+    return torch.nonzero(surf[0, 0] > 0)
+
+@torch.no_grad()
+def upsample_sdf_grid(sdf_grid, res):
+    """Trilinearly resample the scalar field on the vertices of a dense grid to the vertices of a res^3 grid"""
+    return F.interpolate(sdf_grid[None, None], size=(res + 1,) * 3, mode="trilinear", align_corners=True)[0, 0]
+
+@torch.no_grad()
+def upsample_cube_coords(cube_coords, res, new_res):
+    """Coordinates of the cubes of a new_res^3 grid covering the cubes at cube_coords of a res^3 grid"""
+    mask = torch.zeros((res, res, res), dtype=torch.float, device=cube_coords.device)
+    mask[cube_coords[:, 0], cube_coords[:, 1], cube_coords[:, 2]] = 1
+    mask = F.interpolate(mask[None, None], size=(new_res,) * 3, mode="nearest")[0, 0]
+    return torch.nonzero(mask > 0)
+
+def get_grid_growth_resolutions(coarse_res, res):
+    """Resolutions of coarse-to-fine training, doubling from coarse_res up to res"""
+    resolutions = [min(coarse_res, res)]
+    while resolutions[-1] < res:
+        resolutions.append(min(resolutions[-1] * 2, res))
+    return resolutions
@@ -9,8 +9,9 @@ import comfy.utils
 
 from .main_3DGS_renderer import GaussianSplattingRenderer
 
-from shared_utils.camera_utils import BaseCameraController, MiniCam, calculate_fovX, get_projection_matrix
+from shared_utils.camera_utils import BaseCameraController, MiniCam, calculate_fovX, get_projection_matrix, orbit_camera_poses
 from shared_utils.image_utils import prepare_torch_img
+from shared_utils.log_utils import record_time
 
 class GSParams:
     def __init__(
@@ -75,15 +76,37 @@ class GSParams:
         
 class GaussianSplattingCameraController(BaseCameraController):
     def get_render_result(self, render_pose, bg_color, **kwargs):
-        render_cam = MiniCam(render_pose, self.cam.W, self.cam.H, self.cam.fovy, self.cam.fovx, self.cam.near, self.cam.far, self.projection_matrix)
+        render_cam = self.get_mini_cam(render_pose)
         return self.renderer.render(render_cam, bg_color=bg_color, **kwargs)
     
+    def get_batch_render_result(self, render_poses, bg_colors, **kwargs):
+        render_cams = [self.get_mini_cam(render_pose) for render_pose in render_poses]
+        return self.renderer.render_batch(render_cams, bg_colors=bg_colors, **kwargs)
+    
     def post_init(self):
         self.projection_matrix = get_projection_matrix(self.cam.near, self.cam.far, self.cam.fovx, self.cam.fovy).transpose(0, 1).cuda()
+        self.fixed_cams = []
+        
+    def get_mini_cam(self, render_pose):
+        return MiniCam(render_pose, self.cam.W, self.cam.H, self.cam.fovy, self.cam.fovx, self.cam.near, self.cam.far, self.projection_matrix)
+        
+    def set_fixed_poses(self, all_cam_poses):
+        """Build the cameras of poses rendered repeatedly (e.g. reference views during training) once, their matrices stay on the device"""
+        self.fixed_cams = [self.get_mini_cam(render_pose) for render_pose in orbit_camera_poses(all_cam_poses)]
+        
+    def render_fixed_poses(self, pose_ids, **kwargs):
+        """
+        Render the fixed poses of indices pose_ids as one batch
+
+        Returns:
+            dict: outputs of the renderer stacked along the first dimension, see GaussianSplattingRenderer.render_batch
+        """
+        bg_colors = self.get_bg_colors(len(pose_ids))
+        return self.renderer.render_batch([self.fixed_cams[i] for i in pose_ids], bg_colors=bg_colors, **kwargs)
 
 class GaussianSplatting3D:
             
-    def __init__(self, gs_params=None, init_input=None, device='cuda'):
+    def __init__(self, gs_params=None, init_input=None, device='cuda', colors_from_mesh=False):
         self.device = torch.device(device)
         
         # prepare renderer for optimization
@@ -91,7 +114,7 @@ class GaussianSplatting3D:
             gs_params = GSParams()
             
         self.renderer = GaussianSplattingRenderer(sh_degree=gs_params.sh_degree)
-        self.renderer.initialize(init_input, num_pts=gs_params.num_pts)
+        self.renderer.initialize(init_input, num_pts=gs_params.num_pts, colors_from_mesh=colors_from_mesh)
 
         # setup training
         self.renderer.gaussians.training_setup(gs_params)
@@ -115,6 +138,7 @@ class GaussianSplatting3D:
         )
 
         self.all_ref_cam_poses = reference_orbit_camera_poses
+        self.cam_controller.set_fixed_poses(self.all_ref_cam_poses)
         
         # prepare reference images and masks
         ref_imgs_torch_list = []
@@ -126,27 +150,24 @@ class GaussianSplatting3D:
         self.ref_imgs_torch = torch.cat(ref_imgs_torch_list, dim=0)
         self.ref_masks_torch = torch.cat(ref_masks_torch_list, dim=0)
     
-    def training(self):
+    def training(self, profile=False):
+        """
+        Args:
+            profile (bool, optional): accumulate the seconds spent in each phase of an iteration (render, loss, backward, densify) in self.timings, 
+                                      synchronizes the device between phases so it slows down training a bit. Defaults to False.
+        """
+        self.timings = {} if profile else None
+        
         starter = torch.cuda.Event(enable_timing=True)
         ender = torch.cuda.Event(enable_timing=True)
         starter.record()
         
-        ref_imgs_masked = []
-        for i in range(self.ref_imgs_num):
-            ref_imgs_masked.append((self.ref_imgs_torch[i] * self.ref_masks_torch[i]).unsqueeze(0))
-            
-        ref_imgs_num_minus_1 = self.ref_imgs_num-1
+        ref_imgs_masked = self.ref_imgs_torch * self.ref_masks_torch
         
         comfy_pbar = comfy.utils.ProgressBar(self.gs_params.training_iterations)
 
         for step in tqdm.trange(self.gs_params.training_iterations):
-
-            ### calculate loss between reference and rendered image from known view
-            loss = 0
-            masked_rendered_img_batch = []
-            masked_ref_img_batch = []
-            masks_batch = []
-            ref_masks_batch = []
+            start = record_time(self.timings)
 
             step_ratio = min(1, step / self.gs_params.training_iterations)
 
@@ -155,28 +176,16 @@ class GaussianSplatting3D:
 
             loss = 0
 
-            for _ in range(self.gs_params.batch_size):
-                ### calculate loss between reference and rendered image from known view
-                    
-                i = random.randint(0, ref_imgs_num_minus_1)
-                
-                out = self.cam_controller.render_at_pose(self.all_ref_cam_poses[i])
-                
-                image = out["image"] # [3, H, W] in [0, 1]
-                mask = out["alpha"] # [1, H, W] in [0, 1]
-                
-                ref_mask = self.ref_masks_torch[i]
-                image_masked = (image * ref_mask).unsqueeze(0)
-                
-                masked_rendered_img_batch.append(image_masked)
-                masked_ref_img_batch.append(ref_imgs_masked[i])
-                masks_batch.append(mask.unsqueeze(0))
-                ref_masks_batch.append(ref_mask.unsqueeze(0))
+            ### calculate loss between reference and rendered images from known views, the whole batch is rendered at once
+            ref_ids = random.choices(range(self.ref_imgs_num), k=self.gs_params.batch_size)
+            out = self.cam_controller.render_fixed_poses(ref_ids)
+            start = record_time(self.timings, 'render', start)
             
-            masked_rendered_img_batch_torch = torch.cat(masked_rendered_img_batch, dim=0)
-            masked_ref_img_batch_torch = torch.cat(masked_ref_img_batch, dim=0)
-            masks_batch_torch = torch.cat(masks_batch, dim=0)
-            ref_masks_batch_torch = torch.cat(ref_masks_batch, dim=0)
+            ref_ids_torch = torch.tensor(ref_ids, device=self.device)
+            ref_masks_batch_torch = self.ref_masks_torch[ref_ids_torch]
+            masked_rendered_img_batch_torch = out["image"] * ref_masks_batch_torch # [B, 3, H, W] in [0, 1]
+            masked_ref_img_batch_torch = ref_imgs_masked[ref_ids_torch]
+            masks_batch_torch = out["alpha"] # [B, 1, H, W] in [0, 1]
                 
             #loss_scaler = self.gs_params.loss_scale * step_ratio
                 
@@ -199,17 +208,19 @@ class GaussianSplatting3D:
             if self.gs_params.lambda_offset_opacity > 0:
                 # Alpha penalty loss
                 loss += self.gs_params.lambda_offset_opacity * torch.mean(offset_norm.detach() * self.renderer.gaussians.get_opacity)
-
+            start = record_time(self.timings, 'loss', start)
 
             # optimize step
             loss.backward()
             self.optimizer.step()
             self.optimizer.zero_grad()
+            start = record_time(self.timings, 'backward', start)
 
             # densify and prune
             if step >= self.gs_params.density_start_iter and step <= self.gs_params.density_end_iter:
+                # statistics of every view in the batch, radii are 0 where gaussians are not visible
                 viewspace_point_tensor, visibility_filter, radii = out["viewspace_points"], out["visibility_filter"], out["radii"]
-                self.renderer.gaussians.max_radii2D[visibility_filter] = torch.max(self.renderer.gaussians.max_radii2D[visibility_filter], radii[visibility_filter])
+                self.renderer.gaussians.max_radii2D = torch.max(self.renderer.gaussians.max_radii2D, radii.amax(dim=0))
                 self.renderer.gaussians.add_densification_stats(viewspace_point_tensor, visibility_filter)
 
                 if step % self.gs_params.densification_interval == 0:
@@ -222,11 +233,12 @@ class GaussianSplatting3D:
                 
                 if step % self.gs_params.opacity_reset_interval == 0:
                     self.renderer.gaussians.reset_opacity()
+            start = record_time(self.timings, 'densify', start)
                     
             comfy_pbar.update_absolute(step + 1)
 
         ender.record()
         torch.cuda.synchronize()
-        #t = starter.elapsed_time(ender)
+        self.training_seconds = starter.elapsed_time(ender) / 1000
 
         self.need_update = True
\ No newline at end of file
@@ -1,5 +1,4 @@
 import math
-import random
 import numpy as np
 from torchtyping import TensorType
 from plyfile import PlyData, PlyElement
@@ -16,7 +15,7 @@ from kiui.op import inverse_sigmoid
 
 from shared_utils.sh_utils import eval_sh, SH2RGB, RGB2SH
 from mesh_processer.mesh import Mesh, PointCloud
-from mesh_processer.mesh_utils import construct_list_of_gs_attributes, write_gs_ply, read_gs_ply, K_nearest_neighbors_func
+from mesh_processer.mesh_utils import GaussianSplattingPly, read_gs_ply, K_nearest_neighbors_func, sample_points
 
 def get_expon_lr_func(
     lr_init, lr_final, lr_delay_steps=0, lr_delay_mult=1.0, max_steps=1000000
@@ -44,7 +43,7 @@ def get_expon_lr_func(
 
 
 def strip_lowerdiag(L):
-    uncertainty = torch.zeros((L.shape[0], 6), dtype=torch.float, device="cuda")
+    uncertainty = torch.zeros((L.shape[0], 6), dtype=torch.float, device=L.device)
 
     uncertainty[:, 0] = L[:, 0, 0]
     uncertainty[:, 1] = L[:, 0, 1]
@@ -60,8 +59,9 @@ def strip_symmetric(sym):
 def gaussian_3d_coeff(xyzs, covs):
     # xyzs: [N, 3]
     # covs: [N, 6]
-    x, y, z = xyzs[:, 0], xyzs[:, 1], xyzs[:, 2]
-    a, b, c, d, e, f = covs[:, 0], covs[:, 1], covs[:, 2], covs[:, 3], covs[:, 4], covs[:, 5]
+    # any leading dimensions broadcastable between xyzs and covs also work, e.g. xyzs [P, C, 3] with covs [P, 1, 6]
+    x, y, z = xyzs[..., 0], xyzs[..., 1], xyzs[..., 2]
+    a, b, c, d, e, f = covs[..., 0], covs[..., 1], covs[..., 2], covs[..., 3], covs[..., 4], covs[..., 5]
 
     # eps must be small enough !!!
     inv_det = 1 / (a * d * f + 2 * e * c * b - e**2 * a - c**2 * d - b**2 * f + 1e-24)
@@ -83,7 +83,7 @@ def build_rotation(r):
 
     q = r / norm[:, None]
 
-    R = torch.zeros((q.size(0), 3, 3), device='cuda')
+    R = torch.zeros((q.size(0), 3, 3), device=q.device)
 
     r = q[:, 0]
     x = q[:, 1]
@@ -102,7 +102,7 @@ def build_rotation(r):
     return R
 
 def build_scaling_rotation(s, r):
-    L = torch.zeros((s.shape[0], 3, 3), dtype=torch.float, device="cuda")
+    L = torch.zeros((s.shape[0], 3, 3), dtype=torch.float, device=s.device)
     R = build_rotation(r)
 
     L[:,0,0] = s[:,0]
@@ -112,20 +112,6 @@ def build_scaling_rotation(s, r):
     L = R @ L
     return L
 
-def random_point_in_triangle(v0, v1, v2):
-    """
-    Given three vertices v0, v1, v2, sample a point uniformly in the triangle
-    Algorithm Reference:
-    https://math.stackexchange.com/questions/538458/how-to-sample-points-on-a-triangle-surface-in-3d
-    https://stackoverflow.com/questions/47410054/generate-random-locations-within-a-triangular-domain
-    """
-    
-    r1 = random.random()
-    r2 = random.random()
-
-    s1 = math.sqrt(r1)
-    return v0 * (1.0 - s1) + v1 * (1.0 - r2) * s1 + v2 * r2 * s1#
-
 def find_points_within_radius(query_points, vertex_points, d):
     """
     Finds vertex points within a given radius for each query point.
@@ -321,20 +307,27 @@ class GaussianModel:
         return self.opacity_activation(self._opacity)
 
     @torch.no_grad()
-    def extract_fields(self, resolution=128, num_blocks=16, relax_ratio=1.5):
-        # resolution: resolution of field
+    def extract_fields(self, resolution=128, cell_size=4, sigma_cutoff=3.0, max_batch_points=2**24):
+        """
+        Splat gaussians into a [resolution]^3 density field over [-1, 1]^3 (after normalizing gaussians into it).
         
-        block_size = 2 / num_blocks
-
-        assert resolution % block_size == 0
-        split_size = resolution // num_blocks
-
+        A uniform grid of cells (cell_size^3 voxels each) is built once over the sigma_cutoff bounding boxes of all gaussians, 
+        then every (cell, gaussian) pair is evaluated only on the voxels of that cell inside the gaussian's bounding box,
+        so the cost is bounded by the touched cells instead of tiles x gaussians.
+        Works on whichever device the gaussians are on.
+
+        Args:
+            resolution (int): resolution of field
+            cell_size (int): number of voxels of a grid cell along each axis, should be around the footprint of a typical gaussian
+            sigma_cutoff (float): gaussians are truncated outside of the axis aligned box of sigma_cutoff standard deviations along each world axis
+            max_batch_points (int): maximum number of (voxel, gaussian) pairs evaluated at once, bounds the memory usage
+        """
         opacities = self.get_opacity
 
         # pre-filter low opacity gaussians to save computation
         mask = (opacities > 0.005).squeeze(1)
 
-        opacities = opacities[mask]
+        opacities = opacities[mask].squeeze(1)
         xyzs = self.get_xyz[mask]
         stds = self.get_scaling[mask]
         
@@ -348,51 +341,47 @@ class GaussianModel:
 
         covs = self.covariance_activation(stds, 1, self._rotation[mask])
 
-        # tile
         device = opacities.device
-        occ = torch.zeros([resolution] * 3, dtype=torch.float32, device=device)
-
-        X = torch.linspace(-1, 1, resolution).split(split_size)
-        Y = torch.linspace(-1, 1, resolution).split(split_size)
-        Z = torch.linspace(-1, 1, resolution).split(split_size)
-
-
-        # loop blocks (assume max size of gaussian is small than relax_ratio * block_size !!!)
-        for xi, xs in enumerate(X):
-            for yi, ys in enumerate(Y):
-                for zi, zs in enumerate(Z):
-                    xx, yy, zz = torch.meshgrid(xs, ys, zs)
-                    # sample points [M, 3]
-                    pts = torch.cat([xx.reshape(-1, 1), yy.reshape(-1, 1), zz.reshape(-1, 1)], dim=-1).to(device)
-                    # in-tile gaussians mask
-                    vmin, vmax = pts.amin(0), pts.amax(0)
-                    vmin -= block_size * relax_ratio
-                    vmax += block_size * relax_ratio
-                    mask = (xyzs < vmax).all(-1) & (xyzs > vmin).all(-1)
-                    # if hit no gaussian, continue to next block
-                    if not mask.any():
-                        continue
-                    mask_xyzs = xyzs[mask] # [L, 3]
-                    mask_covs = covs[mask] # [L, 6]
-                    mask_opas = opacities[mask].view(1, -1) # [L, 1] --> [1, L]
-
-                    # query per point-gaussian pair.
-                    g_pts = pts.unsqueeze(1).repeat(1, mask_covs.shape[0], 1) - mask_xyzs.unsqueeze(0) # [M, L, 3]
-                    g_covs = mask_covs.unsqueeze(0).repeat(pts.shape[0], 1, 1) # [M, L, 6]
-
-                    # batch on gaussian to avoid OOM
-                    batch_g = 1024
-                    val = 0
-                    for start in range(0, g_covs.shape[1], batch_g):
-                        end = min(start + batch_g, g_covs.shape[1])
-                        w = gaussian_3d_coeff(g_pts[:, start:end].reshape(-1, 3), g_covs[:, start:end].reshape(-1, 6)).reshape(pts.shape[0], -1) # [M, l]
-                        val += (mask_opas[:, start:end] * w).sum(-1)
-                
-                    occ[xi * split_size: xi * split_size + len(xs), 
-                        yi * split_size: yi * split_size + len(ys), 
-                        zi * split_size: zi * split_size + len(zs)] = val.reshape(len(xs), len(ys), len(zs)) 
-
-        return occ
+        occ = torch.zeros(resolution ** 3, dtype=torch.float32, device=device)
+
+        # voxel range covered by the axis aligned bounding box of each gaussian, voxel i is at -1 + i * voxel_step
+        voxel_step = 2 / max(resolution - 1, 1)
+        half_extents = sigma_cutoff * torch.sqrt(covs[:, [0, 3, 5]].clamp(min=0))
+        voxel_min = torch.ceil((xyzs - half_extents + 1) / voxel_step).clamp(0, resolution - 1).long()
+        voxel_max = torch.floor((xyzs + half_extents + 1) / voxel_step).clamp(0, resolution - 1).long()
+        cell_min = voxel_min // cell_size
+        cell_extents = (voxel_max // cell_size - cell_min + 1) * (voxel_max >= voxel_min)
+
+        # build the (cell, gaussian) pairs once, sorted by gaussian
+        pairs_per_gaussian = cell_extents.prod(-1)
+        gaussian_ids = torch.repeat_interleave(torch.arange(xyzs.shape[0], device=device), pairs_per_gaussian)
+        local_ids = torch.arange(gaussian_ids.shape[0], device=device) - torch.repeat_interleave(torch.cumsum(pairs_per_gaussian, 0) - pairs_per_gaussian, pairs_per_gaussian)
+        extents = cell_extents[gaussian_ids]
+        cell_ids = cell_min[gaussian_ids] + torch.stack([
+            local_ids // (extents[:, 1] * extents[:, 2]),
+            (local_ids // extents[:, 2]) % extents[:, 1],
+            local_ids % extents[:, 2],
+        ], dim=-1)
+
+        # voxel offsets inside a cell
+        local = torch.arange(cell_size, device=device)
+        local_x, local_y, local_z = torch.meshgrid(local, local, local, indexing='ij')
+        cell_voxels = torch.stack([local_x.reshape(-1), local_y.reshape(-1), local_z.reshape(-1)], dim=-1) # [C, 3]
+
+        pairs_per_batch = max(1, max_batch_points // cell_voxels.shape[0])
+        for start in range(0, gaussian_ids.shape[0], pairs_per_batch):
+            batch_gaussians = gaussian_ids[start:start + pairs_per_batch] # [P]
+            voxels = cell_ids[start:start + pairs_per_batch, None, :] * cell_size + cell_voxels[None] # [P, C, 3]
+            # cells overlap the bounding box only partly, skip their voxels outside of it (this also drops voxels past the grid)
+            valid = ((voxels >= voxel_min[batch_gaussians, None, :]) & (voxels <= voxel_max[batch_gaussians, None, :])).all(-1)
+            # broadcast the gaussian parameters against the voxels of its cell instead of repeating them
+            d = voxels.float() * voxel_step - 1 - xyzs[batch_gaussians, None, :] # [P, C, 3]
+            w = gaussian_3d_coeff(d, covs[batch_gaussians, None, :]) # [P, C]
+            val = opacities[batch_gaussians, None] * w
+            flat_ids = (voxels[..., 0] * resolution + voxels[..., 1]) * resolution + voxels[..., 2]
+            occ.index_add_(0, flat_ids[valid], val[valid])
+
+        return occ.reshape(resolution, resolution, resolution)
     
     def get_covariance(self, scaling_modifier = 1, gaussain_idx = None):
         if gaussain_idx is None:
@@ -473,15 +462,15 @@ class GaussianModel:
         return pcd
 
     def to_ply(self):
-        xyz = self._xyz.detach().cpu().numpy()
-        normals = np.zeros_like(xyz)
-        f_dc = self._features_dc.detach().transpose(1, 2).flatten(start_dim=1).contiguous().cpu().numpy()
-        f_rest = self._features_rest.detach().transpose(1, 2).flatten(start_dim=1).contiguous().cpu().numpy()
-        opacities = self._opacity.detach().cpu().numpy()
-        scale = self._scaling.detach().cpu().numpy()
-        rotation = self._rotation.detach().cpu().numpy()
-        
-        return write_gs_ply(xyz, normals, f_dc, f_rest, opacities, scale, rotation, construct_list_of_gs_attributes(self._features_dc, self._features_rest, self._scaling, self._rotation))
+        # keep the trained gaussians as device tensors, they are only encoded to ply when a node needs the file
+        return GaussianSplattingPly.from_attributes(
+            self._xyz.detach(),
+            self._features_dc.detach().transpose(1, 2).contiguous(),
+            self._features_rest.detach().transpose(1, 2).contiguous(),
+            self._opacity.detach(),
+            self._scaling.detach(),
+            self._rotation.detach(),
+        )
 
     def create_from_ply(self, plydata):
         xyz, features_dc, features_extra, opacities, scales, rots = read_gs_ply(plydata)
@@ -497,29 +486,37 @@ class GaussianModel:
 
         self.active_sh_degree = self.max_sh_degree
         
-    def create_from_mesh(self, mesh, num_pts):
+    def create_from_mesh(self, mesh, num_pts, colors_from_mesh=False):
         """
-            Sample gaussians uniformly for each face, this method can capture the structure of the 3D meshes well even for the fine structure e.g. fingers
+            Sample gaussians uniformly over the mesh surface, faces are picked proportionally to their area and all points are sampled in one batch on the mesh device
+
+            Args:
+                mesh (Mesh): mesh to initialize from
+                num_pts (int): number of gaussians
+                colors_from_mesh (bool, optional): initialize gaussians colors from the mesh vertex colors, or its albedo texture if it has no vertex color. Defaults to False.
         """
-        # In .obj file, first index is 1 instead of zero
-        vertices = np.concatenate([[[0., 0., 0.]], mesh.v.detach().cpu().numpy()]) 
-        #normals = np.concatenate([[[0., 0., 0.]], mesh.n.detach().cpu().numpy()]) 
-        
-        all_points = []
-        num_pts_per_face = math.ceil(num_pts / mesh.f.shape[0])
-        for triangle_face in mesh.f.detach().cpu().numpy():
-            v0 = vertices[triangle_face[0]]
-            v1 = vertices[triangle_face[1]]
-            v2 = vertices[triangle_face[2]]
-            for i in range(num_pts_per_face):
-                all_points.append(random_point_in_triangle(v0, v1, v2))
-                
-        num_pts = len(all_points)
-                
-        xyz = np.array(all_points)
-        shs = np.random.random((num_pts, 3)) / 255.0
+        faces = mesh.f.long()
+        face_features = None
+        if colors_from_mesh:
+            if mesh.vc is not None:
+                face_features = mesh.vc[faces][..., :3].float()
+            elif mesh.albedo is not None and mesh.vt is not None:
+                face_features = mesh.vt[mesh.ft.long()].float()
+        
+        sampled = sample_points(mesh.v.float().unsqueeze(0), faces, num_pts, face_features=None if face_features is None else face_features.unsqueeze(0))
+        xyz = sampled[0][0]
+        if face_features is None:
+            colors = SH2RGB(torch.rand((num_pts, 3), device=xyz.device) / 255.0)
+        elif mesh.vc is not None:
+            colors = sampled[2][0]
+        else:
+            # uv of the sampled points to texture colors, uv (0, 0) is the first texel of albedo
+            uv_grid = (sampled[2] * 2.0 - 1.0).unsqueeze(0) # [1, 1, num_pts, 2]
+            albedo = mesh.albedo.permute(2, 0, 1).unsqueeze(0).float() # [1, 3, H, W]
+            colors = F.grid_sample(albedo, uv_grid, mode="bilinear", padding_mode="border", align_corners=False)[0, :, 0].transpose(0, 1)
+        
         pcd = PointCloud(
-            points=xyz, colors=SH2RGB(shs), normals=np.zeros((num_pts, 3))
+            points=xyz.cpu().numpy(), colors=colors.clamp(0, 1).cpu().numpy(), normals=np.zeros((num_pts, 3))
         )
         self.create_from_pcd(pcd, 10)
         
@@ -765,8 +762,14 @@ class GaussianModel:
         self.prune(min_opacity, extent, max_screen_size)
 
     def add_densification_stats(self, viewspace_point_tensor, update_filter):
-        self.xyz_gradient_accum[update_filter] += torch.norm(viewspace_point_tensor.grad[update_filter,:2], dim=-1, keepdim=True)
-        self.denom[update_filter] += 1
+        # batched renders give [B, N, 3] gradients and [B, N] filters, every view counts as one update
+        grads = viewspace_point_tensor.grad
+        if grads.dim() == 2:
+            self.xyz_gradient_accum[update_filter] += torch.norm(grads[update_filter,:2], dim=-1, keepdim=True)
+            self.denom[update_filter] += 1
+        else:
+            self.xyz_gradient_accum += (torch.norm(grads[..., :2], dim=-1) * update_filter).sum(dim=0).unsqueeze(-1)
+            self.denom += update_filter.sum(dim=0).unsqueeze(-1)
         
     def prune(self, min_opacity, extent, max_screen_size, max_offset=0):
         prune_mask = (self.get_opacity < min_opacity).squeeze()
@@ -795,12 +798,12 @@ class GaussianSplattingRenderer:
             device="cuda",
         )
     
-    def initialize(self, input=None, num_pts=5000, radius=0.5):
+    def initialize(self, input=None, num_pts=5000, radius=0.5, colors_from_mesh=False):
         # load checkpoint
         if isinstance(input, Mesh):
             # load from 3D mesh
-            self.gaussians.create_from_mesh(input, num_pts)
-        elif isinstance(input, PlyData):
+            self.gaussians.create_from_mesh(input, num_pts, colors_from_mesh=colors_from_mesh)
+        elif isinstance(input, (PlyData, GaussianSplattingPly)):
             self.gaussians.create_from_ply(input)
         elif isinstance(input, PointCloud):
             # load from a provided pcd
@@ -827,14 +830,46 @@ class GaussianSplattingRenderer:
         else:
             self.gaussians.create_from_uv_data(input)
 
-    def render(
+    def get_render_gaussians(self, scaling_modifier=1.0, gaussain_idx=None, compute_cov3D_python=False):
+        """
+        Activated attributes of the gaussians fed to the rasterizer, shared by all views of a batch
+
+        Returns:
+            tuple: means3D, shs, opacities, scales, rotations, cov3D_precomp (scales and rotations are None if cov3D_precomp is computed in python)
+        """
+        gaussians_xyz = self.gaussians.get_xyz
+        gaussians_features = self.gaussians.get_features
+        gaussians_opacity = self.gaussians.get_opacity
+        
+        # If precomputed 3d covariance is provided, use it. If not, then it will be computed from
+        # scaling / rotation by the rasterizer.
+        gaussians_scales = None
+        gaussians_rotations = None
+        cov3D_precomp = None
+        if compute_cov3D_python:
+            cov3D_precomp = self.gaussians.get_covariance(scaling_modifier, gaussain_idx)
+        else:
+            gaussians_scales = self.gaussians.get_scaling
+            gaussians_rotations = self.gaussians.get_rotation
+            
+        if gaussain_idx is not None:
+            gaussians_xyz = gaussians_xyz[gaussain_idx]
+            gaussians_features = gaussians_features[gaussain_idx]
+            gaussians_opacity = gaussians_opacity[gaussain_idx]
+            if cov3D_precomp is None:
+                gaussians_scales = gaussians_scales[gaussain_idx]
+                gaussians_rotations = gaussians_rotations[gaussain_idx]
+                
+        return gaussians_xyz, gaussians_features, gaussians_opacity, gaussians_scales, gaussians_rotations, cov3D_precomp
+    
+    def rasterize_view(
         self,
         viewpoint_camera,
+        render_gaussians,
+        screenspace_points,
         scaling_modifier=1.0,
-        gaussain_idx=None,
         bg_color=None,
         override_color=None,
-        compute_cov3D_python=False,
         convert_SHs_python=False,
     ):
         from diff_gaussian_rasterization import (
@@ -842,6 +877,8 @@ class GaussianSplattingRenderer:
             GaussianRasterizer,
         )
         
+        gaussians_xyz, gaussians_features, gaussians_opacity, gaussians_scales, gaussians_rotations, cov3D_precomp = render_gaussians
+        
         # Set up rasterization configuration
         tanfovx = math.tan(viewpoint_camera.FoVx * 0.5)
         tanfovy = math.tan(viewpoint_camera.FoVy * 0.5)
@@ -862,44 +899,6 @@ class GaussianSplattingRenderer:
         )
 
         rasterizer = GaussianRasterizer(raster_settings=raster_settings)
-        
-        gaussians_xyz = self.gaussians.get_xyz
-        gaussians_features = self.gaussians.get_features
-        gaussians_opacity = self.gaussians.get_opacity
-        
-        # If precomputed 3d covariance is provided, use it. If not, then it will be computed from
-        # scaling / rotation by the rasterizer.
-        gaussians_scales = None
-        gaussians_rotations = None
-        cov3D_precomp = None
-        if compute_cov3D_python:
-            cov3D_precomp = self.gaussians.get_covariance(scaling_modifier, gaussain_idx)
-        else:
-            gaussians_scales = self.gaussians.get_scaling
-            gaussians_rotations = self.gaussians.get_rotation
-            
-        if gaussain_idx is not None:
-            gaussians_xyz = gaussians_xyz[gaussain_idx]
-            gaussians_features = gaussians_features[gaussain_idx]
-            gaussians_opacity = gaussians_opacity[gaussain_idx]
-            if cov3D_precomp is None:
-                gaussians_scales = gaussians_scales[gaussain_idx]
-                gaussians_rotations = gaussians_rotations[gaussain_idx]
-        
-        # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
-        screenspace_points = (
-            torch.zeros_like(
-                gaussians_xyz,
-                dtype=gaussians_xyz.dtype,
-                requires_grad=True,
-                device="cuda",
-            )
-            + 0
-        )
-        try:
-            screenspace_points.retain_grad()
-        except:
-            pass
 
         # If precomputed colors are provided, use them. Otherwise, if it is desired to precompute colors
         # from SHs in Python, do it. If not, then SH -> RGB conversion will be done by rasterizer.
@@ -907,7 +906,7 @@ class GaussianSplattingRenderer:
         colors_precomp = None
         if override_color is None:
             if convert_SHs_python:
-                shs_view = self.gaussians_features.transpose(1, 2).view(
+                shs_view = gaussians_features.transpose(1, 2).view(
                     -1, 3, (self.gaussians.max_sh_degree + 1) ** 2
                 )
                 dir_pp = gaussians_xyz - viewpoint_camera.camera_center.repeat(
@@ -934,8 +933,39 @@ class GaussianSplattingRenderer:
             rotations=gaussians_rotations,
             cov3D_precomp=cov3D_precomp,
         )
+        
+        return rendered_image.clamp(0, 1), radii, rendered_depth, rendered_alpha
 
-        rendered_image = rendered_image.clamp(0, 1)
+    def render(
+        self,
+        viewpoint_camera,
+        scaling_modifier=1.0,
+        gaussain_idx=None,
+        bg_color=None,
+        override_color=None,
+        compute_cov3D_python=False,
+        convert_SHs_python=False,
+    ):
+        render_gaussians = self.get_render_gaussians(scaling_modifier, gaussain_idx, compute_cov3D_python)
+        
+        # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
+        screenspace_points = (
+            torch.zeros_like(
+                render_gaussians[0],
+                dtype=render_gaussians[0].dtype,
+                requires_grad=True,
+                device="cuda",
+            )
+            + 0
+        )
+        try:
+            screenspace_points.retain_grad()
+        except:
+            pass
+        
+        rendered_image, radii, rendered_depth, rendered_alpha = self.rasterize_view(
+            viewpoint_camera, render_gaussians, screenspace_points, scaling_modifier, bg_color, override_color, convert_SHs_python
+        )
 
         # Those Gaussians that were frustum culled or had a radius of 0 were not visible.
         # They will be excluded from value updates used in the splitting criteria.
@@ -946,4 +976,56 @@ class GaussianSplattingRenderer:
             "viewspace_points": screenspace_points,
             "visibility_filter": radii > 0,
             "radii": radii,
-        }
\ No newline at end of file
+        }
+    
+    def render_batch(
+        self,
+        viewpoint_cameras,
+        scaling_modifier=1.0,
+        gaussain_idx=None,
+        bg_colors=None,
+        override_color=None,
+        compute_cov3D_python=False,
+        convert_SHs_python=False,
+    ):
+        """
+        Render several views, the gaussian activations and the screen-space means are shared by all of them
+
+        Args:
+            viewpoint_cameras (list of MiniCam): cameras of the B views
+            bg_colors (Tensor[float32], shape: [B, 3], optional): background color of each view. Defaults to self.bg_color.
+
+        Returns:
+            dict: outputs of render stacked along a new first dimension of size B, 
+                  viewspace_points is a single [B, N, 3] tensor whose grad holds the screen-space gradients of every view
+        """
+        render_gaussians = self.get_render_gaussians(scaling_modifier, gaussain_idx, compute_cov3D_python)
+        
+        gaussians_xyz = render_gaussians[0]
+        screenspace_points = (
+            torch.zeros(
+                (len(viewpoint_cameras), *gaussians_xyz.shape),
+                dtype=gaussians_xyz.dtype,
+                requires_grad=True,
+                device="cuda",
+            )
+            + 0
+        )
+        try:
+            screenspace_points.retain_grad()
+        except:
+            pass
+        
+        batch_outputs = {}
+        for i, viewpoint_camera in enumerate(viewpoint_cameras):
+            bg_color = None if bg_colors is None else bg_colors[i]
+            outputs = self.rasterize_view(
+                viewpoint_camera, render_gaussians, screenspace_points[i], scaling_modifier, bg_color, override_color, convert_SHs_python
+            )
+            for k, output in zip(("image", "radii", "depth", "alpha"), outputs):
+                batch_outputs.setdefault(k, []).append(output)
+                
+        batch_outputs = {k: torch.stack(v, dim=0) for k, v in batch_outputs.items()}
+        batch_outputs["viewspace_points"] = screenspace_points
+        batch_outputs["visibility_filter"] = batch_outputs["radii"] > 0
+        return batch_outputs
\ No newline at end of file
@@ -17,6 +17,9 @@ import __main__
 import importlib
 import inspect
 from .webserver.server import server, set_web_conf
+from .shared_utils.model_residency import set_model_residency_conf
+from .shared_utils.checkpoint_manifest import set_checkpoint_manifest_conf, get_checkpoint_manifest
+from .shared_utils.safetensors_utils import set_safetensors_conversion_conf
 from .shared_utils.log_utils import setup_logger
 
 # Common formatter for simplicity, adjust as needed
@@ -39,6 +42,11 @@ f.close()
 sys_conf = ConfigFactory.parse_string(conf_text)
 
 set_web_conf(sys_conf['web'])
+set_model_residency_conf(sys_conf.get('model_residency', None))
+set_checkpoint_manifest_conf(sys_conf.get('checkpoint_manifest', None))
+set_safetensors_conversion_conf(sys_conf.get('safetensors_conversion', None))
+# Load the checkpoint manifest, recorded checkpoints get verified in the background if verify_on_startup is set
+get_checkpoint_manifest()
 
 # Log into huggingface if given user specificed token
 hf_token = sys_conf['huggingface.token']
@@ -1,4 +1,5 @@
 import os
+import warnings
 import cv2
 from typing import NamedTuple
 import torch
@@ -10,6 +11,241 @@ from kiui.typing import *
 
 from shared_utils.sh_utils import SH2RGB
 from shared_utils.image_utils import prepare_torch_img
+from shared_utils.log_utils import cstr
+from .uv_cache import get_uv_atlas_cache
+
+
+OBJ_CHUNK_SIZE = 1 << 24 # bytes read per chunk when parsing obj files
+XATLAS_CHART_OPTIONS = {} # e.g. {"max_iterations": 4}, also part of the uv atlas cache key
+UV_BACKENDS = ["xatlas", "auto", "box"]
+BOX_UV_ISLAND_PADDING = 0.02
+AUTO_UV_BOX_MIN_FACES = 100000 # "auto" backend uses box projection from this many faces on, xatlas time grows superlinearly
+
+_OBJ_ATTRIBUTE_NAMES = ("v", "vt", "vn", "f", "ft", "fn")
+_IS_ASCII_WHITESPACE = np.zeros(256, dtype=bool)
+_IS_ASCII_WHITESPACE[[ord(" "), ord("\t"), ord("\r"), ord("\n")]] = True
+_SLASH_TO_SPACE = bytes.maketrans(b"/", b" ")
+
+def _read_obj_chunks(f, chunk_size):
+    # yield blocks of complete lines from a binary file object, each block ends with a newline
+    remainder = b""
+    while True:
+        block = f.read(chunk_size)
+        if not block:
+            break
+        block = remainder + block
+        last_newline = block.rfind(b"\n")
+        if last_newline < 0:
+            remainder = block
+            continue
+        remainder = block[last_newline + 1:]
+        yield block[:last_newline + 1]
+    if remainder.strip():
+        yield remainder + b"\n"
+
+def _concat_obj_attribute(arrays, dtype, num_columns):
+    if len(arrays) == 0:
+        return np.zeros((0, num_columns), dtype=dtype)
+    return np.ascontiguousarray(np.concatenate(arrays, axis=0), dtype=dtype)
+
+def _parse_numbers(data, dtype):
+    # parse whitespace separated numbers in C, return None if data contains anything else
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        try:
+            return np.fromstring(data, dtype=dtype, sep=" ")
+        except (ValueError, DeprecationWarning):
+            return None
+
+def _triangulate_obj_faces(corners, corners_per_face):
+    """Fan-triangulate faces given all their corners in order.
+
+    Args:
+        corners (np.ndarray): int [C, 3], (v, vt, vn) indices of all face corners, -1 if not provided.
+        corners_per_face (np.ndarray): int [F], number of corners of each face, sum to C.
+
+    Returns:
+        Tuple[np.ndarray]: faces, tfaces, nfaces, int [M, 3] each.
+    """
+    if np.all(corners_per_face == 3):
+        # fixed-width fast path, corners already are triangles
+        triangles = corners.reshape(-1, 3, 3)
+    else:
+        # assume vertices are ordered, face with n corners becomes (n - 2) triangles sharing its first corner
+        triangles_per_face = np.maximum(corners_per_face - 2, 0)
+        face_offsets = np.cumsum(corners_per_face) - corners_per_face
+        face_ids = np.repeat(np.arange(len(corners_per_face)), triangles_per_face)
+        local_ids = np.arange(len(face_ids)) - np.repeat(np.cumsum(triangles_per_face) - triangles_per_face, triangles_per_face)
+        first = face_offsets[face_ids]
+        triangles = corners[np.stack([first, first + local_ids + 1, first + local_ids + 2], axis=-1)]
+    return triangles[..., 0], triangles[..., 1], triangles[..., 2]
+
+def _parse_obj_lines(lines):
+    # reference per-line parser, used for chunks that do not fit the vectorized path
+    def parse_f_v(fv):
+        # pass in a vertex term of a face, return {v, vt, vn} (-1 if not provided)
+        # supported forms:
+        # f v1 v2 v3
+        # f v1/vt1 v2/vt2 v3/vt3
+        # f v1/vt1/vn1 v2/vt2/vn2 v3/vt3/vn3
+        # f v1//vn1 v2//vn2 v3//vn3
+        xs = [int(x) - 1 if x != "" else -1 for x in fv.split("/")]
+        xs.extend([-1] * (3 - len(xs)))
+        return xs[0], xs[1], xs[2]
+
+    vertices, texcoords, normals = [], [], []
+    corners, corners_per_face = [], []
+    mtl_path = None
+
+    for line in lines:
+        split_line = line.split()
+        # empty line
+        if len(split_line) == 0:
+            continue
+        prefix = split_line[0].lower()
+        # mtllib
+        if prefix == "mtllib":
+            mtl_path = split_line[1]
+        # usemtl
+        elif prefix == "usemtl":
+            pass # ignored
+        # v/vn/vt
+        elif prefix == "v":
+            vertices.append([float(v) for v in split_line[1:]])
+        elif prefix == "vn":
+            normals.append([float(v) for v in split_line[1:]])
+        elif prefix == "vt":
+            val = [float(v) for v in split_line[1:]]
+            texcoords.append([val[0], 1.0 - val[1]])
+        elif prefix == "f":
+            vs = split_line[1:]
+            corners.extend(parse_f_v(fv) for fv in vs)
+            corners_per_face.append(len(vs))
+
+    faces, tfaces, nfaces = _triangulate_obj_faces(
+        np.array(corners, dtype=np.int64).reshape(-1, 3), np.array(corners_per_face, dtype=np.int64)
+    )
+    parsed = {
+        "v": np.array(vertices, dtype=np.float32),
+        "vt": np.array(texcoords, dtype=np.float32).reshape(-1, 2),
+        "vn": np.array(normals, dtype=np.float32).reshape(-1, 3),
+        "f": faces,
+        "ft": tfaces,
+        "fn": nfaces,
+    }
+    return parsed, mtl_path
+
+def _parse_obj_chunk(chunk):
+    """Parse a block of complete obj lines with numpy, without splitting lines in python.
+
+    Lines are classified by their prefix bytes, the runs of lines of each kind are joined into one buffer
+    and converted by ``np.fromstring``. Chunks with irregular content (mixed column counts, mixed face
+    corner forms, leading whitespaces...) fall back to the per-line parser.
+
+    Args:
+        chunk (bytes): obj content, ends with a newline.
+
+    Returns:
+        Tuple[dict, Optional[str]]: parsed v/vt/vn/f/ft/fn arrays and mtllib path if found in this chunk.
+    """
+    buf = np.frombuffer(chunk, dtype=np.uint8)
+    is_newline = buf == ord("\n")
+    line_ends = np.flatnonzero(is_newline)
+    line_starts = np.concatenate([[0], line_ends[:-1] + 1])
+
+    # count whitespace separated tokens per line, every line ends with a newline so no token spans two lines
+    is_whitespace = _IS_ASCII_WHITESPACE[buf]
+    token_starts = ~is_whitespace
+    token_starts[1:] &= is_whitespace[:-1]
+    token_count = np.cumsum(token_starts, dtype=np.int32)
+    tokens_per_line = token_count[line_ends] - token_count[line_starts] + token_starts[line_starts]
+
+    # lower-cased first three bytes of every line, padded so short lines can be indexed safely
+    padded = np.concatenate([buf, np.full(3, ord("\n"), dtype=np.uint8)])
+    heads = np.stack([padded[line_starts], padded[line_starts + 1], padded[line_starts + 2]], axis=-1)
+    heads = np.where((heads >= ord("A")) & (heads <= ord("Z")), heads + 32, heads)
+    head_is_whitespace = _IS_ASCII_WHITESPACE[heads]
+
+    # data line with leading whitespaces, let the per-line parser deal with it
+    if np.any(head_is_whitespace[:, 0] & (tokens_per_line > 0)):
+        return _parse_obj_lines(chunk.decode().splitlines())
+
+    line_kinds = {
+        "v": (heads[:, 0] == ord("v")) & head_is_whitespace[:, 1],
+        "vt": (heads[:, 0] == ord("v")) & (heads[:, 1] == ord("t")) & head_is_whitespace[:, 2],
+        "vn": (heads[:, 0] == ord("v")) & (heads[:, 1] == ord("n")) & head_is_whitespace[:, 2],
+        "f": (heads[:, 0] == ord("f")) & head_is_whitespace[:, 1],
+    }
+
+    def gather_lines(kind, prefix_letters):
+        # concatenated bytes of all lines of a kind with their prefix letters removed, and their token counts
+        # lines of a kind are usually stored contiguously, so only a handful of slices are copied
+        selected = line_kinds[kind]
+        edges = np.flatnonzero(np.diff(np.concatenate([[0], selected.view(np.int8), [0]])))
+        data = b"".join(chunk[line_starts[first]:line_ends[last - 1] + 1] for first, last in zip(edges[0::2], edges[1::2]))
+        # prefix letters never appear in decimal numbers, except in nan/inf which then go to the per-line parser
+        data = data.translate(None, prefix_letters + prefix_letters.upper())
+        return data, tokens_per_line[selected] - 1
+
+    def parse_columns(kind, prefix_letters, min_columns):
+        data, columns = gather_lines(kind, prefix_letters)
+        if len(columns) == 0:
+            return np.zeros((0, min_columns), dtype=np.float64)
+        num_columns = columns[0]
+        if num_columns < min_columns or np.any(columns != num_columns):
+            return None
+        values = _parse_numbers(data, np.float64)
+        if values is None or values.size != len(columns) * num_columns:
+            return None
+        return values.reshape(-1, num_columns)
+
+    vertices = parse_columns("v", b"v", 3)
+    texcoords = parse_columns("vt", b"vt", 2)
+    normals = parse_columns("vn", b"vn", 3)
+    if vertices is None or texcoords is None or normals is None:
+        return _parse_obj_lines(chunk.decode().splitlines())
+    texcoords = texcoords[:, :2].copy()
+    texcoords[:, 1] = 1.0 - texcoords[:, 1]
+
+    # faces, every corner is v, v/vt, v/vt/vn or v//vn, all corners in a chunk must have the same form
+    data, corners_per_face = gather_lines("f", b"f")
+    num_corners = int(corners_per_face.sum())
+    if num_corners > 0:
+        first_face = np.flatnonzero(line_kinds["f"])[np.flatnonzero(corners_per_face)[0]]
+        first_corner = chunk[line_starts[first_face]:line_ends[first_face]].split()[1]
+        num_fields = first_corner.count(b"/") + 1
+        if num_fields > 3 or data.count(b"/") != num_corners * (num_fields - 1):
+            return _parse_obj_lines(chunk.decode().splitlines())
+        # empty fields become 0, so they are -1 after converting to 0-based indices, same as the per-line parser
+        for empty_field in (b"//", b"/ ", b"/\t", b"/\r", b"/\n"):
+            if empty_field in data:
+                data = data.replace(empty_field, empty_field[:1] + b"0" + empty_field[1:])
+        data = data.translate(_SLASH_TO_SPACE)
+        indices = _parse_numbers(data, np.int64)
+        if indices is None or indices.size != num_corners * num_fields:
+            return _parse_obj_lines(chunk.decode().splitlines())
+        corners = np.full((num_corners, 3), -1, dtype=np.int64)
+        corners[:, :num_fields] = indices.reshape(num_corners, num_fields) - 1
+    else:
+        corners = np.zeros((0, 3), dtype=np.int64)
+    faces, tfaces, nfaces = _triangulate_obj_faces(corners, corners_per_face)
+
+    # mtllib is rare, parse those few lines in python
+    mtl_path = None
+    for start, end in zip(line_starts[heads[:, 0] == ord("m")], line_ends[heads[:, 0] == ord("m")]):
+        split_line = chunk[start:end].decode().split()
+        if split_line[0].lower() == "mtllib":
+            mtl_path = split_line[1]
+
+    parsed = {
+        "v": vertices.astype(np.float32),
+        "vt": texcoords.astype(np.float32),
+        "vn": normals.astype(np.float32),
+        "f": faces,
+        "ft": tfaces,
+        "fn": nfaces,
+    }
+    return parsed, mtl_path
 
 
 class Mesh:
@@ -143,13 +379,14 @@ class Mesh:
 
     # load from obj file
     @classmethod
-    def load_obj(cls, path, albedo_path=None, device=None):
+    def load_obj(cls, path, albedo_path=None, device=None, chunk_size=OBJ_CHUNK_SIZE):
         """load an ``obj`` mesh.
 
         Args:
             path (str): path to mesh.
             albedo_path (str, optional): path to the albedo texture image, will overwrite the existing texture path if specified in mtl. Defaults to None.
             device (torch.device, optional): torch device. Defaults to None.
+            chunk_size (int, optional): number of bytes read and parsed at once, bounds the transient memory used by the parser. Defaults to OBJ_CHUNK_SIZE.
         
         Note: 
             We will try to read `mtl` path from `obj`, else we assume the file name is the same as `obj` but with `mtl` extension.
@@ -168,76 +405,45 @@ class Mesh:
 
         mesh.device = device
 
-        # load obj
-        with open(path, "r") as f:
-            lines = f.readlines()
-
-        def parse_f_v(fv):
-            # pass in a vertex term of a face, return {v, vt, vn} (-1 if not provided)
-            # supported forms:
-            # f v1 v2 v3
-            # f v1/vt1 v2/vt2 v3/vt3
-            # f v1/vt1/vn1 v2/vt2/vn2 v3/vt3/vn3
-            # f v1//vn1 v2//vn2 v3//vn3
-            xs = [int(x) - 1 if x != "" else -1 for x in fv.split("/")]
-            xs.extend([-1] * (3 - len(xs)))
-            return xs[0], xs[1], xs[2]
-
-        vertices, texcoords, normals = [], [], []
-        faces, tfaces, nfaces = [], [], []
+        # load obj, parse it chunk by chunk so we never hold all lines of a large file as python strings
+        parsed = {name: [] for name in _OBJ_ATTRIBUTE_NAMES}
         mtl_path = None
-
-        for line in lines:
-            split_line = line.split()
-            # empty line
-            if len(split_line) == 0:
-                continue
-            prefix = split_line[0].lower()
-            # mtllib
-            if prefix == "mtllib":
-                mtl_path = split_line[1]
-            # usemtl
-            elif prefix == "usemtl":
-                pass # ignored
-            # v/vn/vt
-            elif prefix == "v":
-                vertices.append([float(v) for v in split_line[1:]])
-            elif prefix == "vn":
-                normals.append([float(v) for v in split_line[1:]])
-            elif prefix == "vt":
-                val = [float(v) for v in split_line[1:]]
-                texcoords.append([val[0], 1.0 - val[1]])
-            elif prefix == "f":
-                vs = split_line[1:]
-                nv = len(vs)
-                v0, t0, n0 = parse_f_v(vs[0])
-                for i in range(nv - 2):  # triangulate (assume vertices are ordered)
-                    v1, t1, n1 = parse_f_v(vs[i + 1])
-                    v2, t2, n2 = parse_f_v(vs[i + 2])
-                    faces.append([v0, v1, v2])
-                    tfaces.append([t0, t1, t2])
-                    nfaces.append([n0, n1, n2])
-
-        mesh.v = torch.tensor(vertices, dtype=torch.float32, device=device)
+        with open(path, "rb") as f:
+            for chunk in _read_obj_chunks(f, chunk_size):
+                chunk_parsed, chunk_mtl_path = _parse_obj_chunk(chunk)
+                for name, value in chunk_parsed.items():
+                    if value is not None and len(value) > 0:
+                        parsed[name].append(value)
+                if chunk_mtl_path is not None:
+                    mtl_path = chunk_mtl_path
+
+        vertices = _concat_obj_attribute(parsed["v"], np.float32, 3)
+        texcoords = _concat_obj_attribute(parsed["vt"], np.float32, 2)
+        normals = _concat_obj_attribute(parsed["vn"], np.float32, 3)
+        faces = _concat_obj_attribute(parsed["f"], np.int32, 3)
+        tfaces = _concat_obj_attribute(parsed["ft"], np.int32, 3)
+        nfaces = _concat_obj_attribute(parsed["fn"], np.int32, 3)
+
+        mesh.v = torch.from_numpy(vertices).to(device)
         mesh.vt = (
-            torch.tensor(texcoords, dtype=torch.float32, device=device)
+            torch.from_numpy(texcoords).to(device)
             if len(texcoords) > 0
             else None
         )
         mesh.vn = (
-            torch.tensor(normals, dtype=torch.float32, device=device)
+            torch.from_numpy(normals).to(device)
             if len(normals) > 0
             else None
         )
 
-        mesh.f = torch.tensor(faces, dtype=torch.int32, device=device)
+        mesh.f = torch.from_numpy(faces).to(device)
         mesh.ft = (
-            torch.tensor(tfaces, dtype=torch.int32, device=device)
+            torch.from_numpy(tfaces).to(device)
             if len(texcoords) > 0
             else None
         )
         mesh.fn = (
-            torch.tensor(nfaces, dtype=torch.int32, device=device)
+            torch.from_numpy(nfaces).to(device)
             if len(normals) > 0
             else None
         )
@@ -471,6 +677,11 @@ class Mesh:
     def auto_normal(self):
         """auto calculate the vertex normals.
         """
+        self.vn = self.calc_vertex_normals()
+        self.fn = self.f
+
+    def calc_vertex_normals(self):
+        """area weighted vertex normals of v/f, without modifying the mesh."""
         i0, i1, i2 = self.f[:, 0].long(), self.f[:, 1].long(), self.f[:, 2].long()
         v0, v1, v2 = self.v[i0, :], self.v[i1, :], self.v[i2, :]
 
@@ -490,38 +701,92 @@ class Mesh:
         )
         vn = safe_normalize(vn)
 
-        self.vn = vn
-        self.fn = self.f
+        return vn
+
+    def resolve_uv_backend(self, backend="auto"):
+        """pick the uv unwrap backend for "auto": xatlas charts are tighter, box projection is much faster on dense meshes."""
+        if backend != "auto":
+            return backend
+        try:
+            import xatlas
+        except ImportError:
+            return "box"
+        return "box" if self.f.shape[0] >= AUTO_UV_BOX_MIN_FACES else "xatlas"
+
+    def box_uv_unwrap(self, island_padding=BOX_UV_ISLAND_PADDING):
+        """xatlas-free uv unwrap by box projection (from StableFast3D), runs on the mesh device.
 
-    def auto_uv(self, cache_path=None, vmap=True):
+        Returns:
+            Tuple[np.ndarray]: vt [N, 2], ft [M, 3] and vmapping [N] from vt to v, same as xatlas.
+        """
+        from StableFast3D.sf3d.box_uv_unwrap import box_projection_uv_unwrap
+
+        f = self.f.long()
+        vn = self.vn if self.vn is not None and self.fn is not None and torch.equal(self.fn, self.f) else self.calc_vertex_normals()
+        with torch.no_grad():
+            vt, ft = box_projection_uv_unwrap(self.v.float(), vn.float(), f, island_padding)
+        vmapping = torch.zeros(vt.shape[0], dtype=torch.long, device=vt.device)
+        vmapping[ft.reshape(-1).long()] = f.reshape(-1)
+        return vt.cpu().numpy(), ft.cpu().numpy(), vmapping.cpu().numpy()
+
+    def auto_uv(self, cache_path=None, vmap=True, use_atlas_cache=True, backend="xatlas"):
         """auto calculate the uv coordinates.
 
         Args:
             cache_path (str, optional): path to save/load the uv cache as a npz file, this can avoid calculating uv every time when loading the same mesh, which is time-consuming. Defaults to None.
             vmap (bool, optional): remap vertices based on uv coordinates, so each v correspond to a unique vt (necessary for formats like gltf). 
                 Usually this will duplicate the vertices on the edge of uv atlas. Defaults to True.
+            use_atlas_cache (bool, optional): when cache_path is not given, look up / store the result in the shared content-addressed uv atlas cache, 
+                keyed by the hash of v & f, so the same mesh is never unwrapped twice. Defaults to True.
+            backend (str, optional): one of UV_BACKENDS, "xatlas" charts, "box" projection or "auto" to pick by face count. Defaults to "xatlas".
         """
+        backend = self.resolve_uv_backend(backend)
+        if backend == "xatlas":
+            cache_suffix, chart_options = "_uv.npz", XATLAS_CHART_OPTIONS
+        elif backend == "box":
+            cache_suffix, chart_options = "_box_uv.npz", {"backend": "box", "island_padding": BOX_UV_ISLAND_PADDING}
+        else:
+            raise ValueError(f"[Mesh auto_uv] unknown uv backend {backend}, should be one of {UV_BACKENDS}")
+
         # try to load cache
         if cache_path is not None:
-            cache_path = os.path.splitext(cache_path)[0] + "_uv.npz"
+            cache_path = os.path.splitext(cache_path)[0] + cache_suffix
+
+        v_np = self.v.detach().cpu().numpy()
+        f_np = self.f.detach().int().cpu().numpy()
+        atlas_cache = atlas_cache_key = None
+        cached = None
         if cache_path is not None and os.path.exists(cache_path):
             data = np.load(cache_path)
-            vt_np, ft_np, vmapping = data["vt"], data["ft"], data["vmapping"]
+            cached = data["vt"], data["ft"], data["vmapping"]
+        elif cache_path is None and use_atlas_cache:
+            atlas_cache = get_uv_atlas_cache()
+            atlas_cache_key = atlas_cache.make_key(v_np, f_np, chart_options)
+            cached = atlas_cache.load(atlas_cache_key)
+            if cached is None:
+                cstr(f"[Mesh auto_uv] uv atlas cache miss, unwrapping {f_np.shape[0]} faces with {backend}: {atlas_cache.stats()}").msg.print()
+
+        if cached is not None:
+            vt_np, ft_np, vmapping = cached
+        elif backend == "box":
+            vt_np, ft_np, vmapping = self.box_uv_unwrap()
         else:
             import xatlas
 
-            v_np = self.v.detach().cpu().numpy()
-            f_np = self.f.detach().int().cpu().numpy()
             atlas = xatlas.Atlas()
             atlas.add_mesh(v_np, f_np)
-            chart_options = xatlas.ChartOptions()
-            # chart_options.max_iterations = 4
-            atlas.generate(chart_options=chart_options)
+            xatlas_chart_options = xatlas.ChartOptions()
+            for option_name, option_value in chart_options.items():
+                setattr(xatlas_chart_options, option_name, option_value)
+            atlas.generate(chart_options=xatlas_chart_options)
             vmapping, ft_np, vt_np = atlas[0]  # [N], [M, 3], [N, 2]
 
+        if cached is None:
             # save to cache
             if cache_path is not None:
                 np.savez(cache_path, vt=vt_np, ft=ft_np, vmapping=vmapping)
+            elif atlas_cache is not None:
+                atlas_cache.save(atlas_cache_key, vt_np, ft_np, vmapping)
         
         vt = torch.from_numpy(vt_np.astype(np.float32)).to(self.device)
         ft = torch.from_numpy(ft_np.astype(np.int32)).to(self.device)
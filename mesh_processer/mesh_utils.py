@@ -1,3 +1,4 @@
+import math
 import torch
 import numpy as np
 from kornia.geometry.conversions import (
@@ -5,6 +6,7 @@ from kornia.geometry.conversions import (
     axis_angle_to_quaternion,
 )
 import pymeshlab as pml
+from numpy.lib.recfunctions import structured_to_unstructured
 from plyfile import PlyData, PlyElement
 
 from typing import Optional
@@ -18,6 +20,7 @@ except ImportError:
 
 from .mesh import PointCloud
 from shared_utils.sh_utils import SH2RGB, RGB2SH
+from shared_utils.log_utils import cstr
 
 def _base_face_areas(face_vertices_0, face_vertices_1, face_vertices_2):
     """Base function to compute the face areas."""
@@ -329,51 +332,207 @@ def construct_list_of_gs_attributes(features_dc, features_rest, scaling, rotatio
     return l
 
 def calculate_max_sh_degree_from_gs_ply(plydata):
+    if isinstance(plydata, GaussianSplattingPly):
+        return plydata.max_sh_degree, plydata.extra_f_names
     extra_f_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("f_rest_")]
     #assert len(extra_f_names)!=3*(max_sh_degree + 1) ** 2 - 3:
     max_sh_degree = int(((len(extra_f_names) + 3) / 3) ** 0.5 - 1)
     return max_sh_degree, extra_f_names
 
-def write_gs_ply(xyz, normals, f_dc, f_rest, opacities, scale, rotation, list_of_attributes):
-    dtype_full = [(attribute, 'f4') for attribute in list_of_attributes]
+def gs_ply_vertex_dtype(list_of_attributes):
+    return np.dtype([(attribute, 'f4') for attribute in list_of_attributes])
+
+def load_gs_ply(gs_file_path):
+    # binary vertex block is memory-mapped (copy-on-write), nothing is decoded until attributes are read
+    return PlyData.read(gs_file_path, mmap='c')
 
-    elements = np.empty(xyz.shape[0], dtype=dtype_full)
-    attributes = np.concatenate((xyz, normals, f_dc, f_rest, opacities, scale, rotation), axis=1)
-    elements[:] = list(map(tuple, attributes))
+def write_gs_ply(xyz, normals, f_dc, f_rest, opacities, scale, rotation, list_of_attributes):
+    # pack every attribute into one contiguous float32 block and reinterpret it as the vertex record type,
+    # so no per-gaussian python object is created and plyfile writes the block with a single buffer write
+    attributes = np.concatenate((xyz, normals, f_dc, f_rest, opacities, scale, rotation), axis=1, dtype=np.float32)
+    elements = np.ascontiguousarray(attributes).view(gs_ply_vertex_dtype(list_of_attributes)).reshape(-1)
     el = PlyElement.describe(elements, 'vertex')
     return PlyData([el])
 
+def read_gs_ply_attributes(plydata, attribute_names):
+    """Gather scalar vertex properties of a 3DGS ply into one float32 [N, len(attribute_names)] array.
+
+    The vertex data is a (possibly memory-mapped) structured array, selecting several fields gives a strided view of it,
+    so the whole group is converted with one copy instead of one copy per property.
+    """
+    vertex_data = plydata.elements[0].data
+    if len(attribute_names) == 0:
+        return np.zeros((len(vertex_data), 0), dtype=np.float32)
+    attributes = structured_to_unstructured(vertex_data[list(attribute_names)], dtype=np.float32)
+    return np.ascontiguousarray(attributes).reshape(len(vertex_data), len(attribute_names))
+
 def read_gs_ply(plydata):
-    xyz = np.stack((np.asarray(plydata.elements[0]["x"]),
-                    np.asarray(plydata.elements[0]["y"]),
-                    np.asarray(plydata.elements[0]["z"])),  axis=1)
-    opacities = np.asarray(plydata.elements[0]["opacity"])[..., np.newaxis]
+    if isinstance(plydata, GaussianSplattingPly):
+        return plydata.attributes()
+
+    property_names = [p.name for p in plydata.elements[0].properties]
 
-    features_dc = np.zeros((xyz.shape[0], 3, 1))
-    features_dc[:, 0, 0] = np.asarray(plydata.elements[0]["f_dc_0"])
-    features_dc[:, 1, 0] = np.asarray(plydata.elements[0]["f_dc_1"])
-    features_dc[:, 2, 0] = np.asarray(plydata.elements[0]["f_dc_2"])
+    xyz = read_gs_ply_attributes(plydata, ["x", "y", "z"])
+    opacities = read_gs_ply_attributes(plydata, ["opacity"])
+
+    features_dc = read_gs_ply_attributes(plydata, ["f_dc_0", "f_dc_1", "f_dc_2"])[..., np.newaxis]
 
     max_sh_degree, extra_f_names = calculate_max_sh_degree_from_gs_ply(plydata)
 
-    features_extra = np.zeros((xyz.shape[0], len(extra_f_names)))
-    for idx, attr_name in enumerate(extra_f_names):
-        features_extra[:, idx] = np.asarray(plydata.elements[0][attr_name])
+    features_extra = read_gs_ply_attributes(plydata, extra_f_names)
     # Reshape (P,F*SH_coeffs) to (P, F, SH_coeffs except DC)
     features_extra = features_extra.reshape((features_extra.shape[0], 3, (max_sh_degree + 1) ** 2 - 1))
 
-    scale_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("scale_")]
-    scales = np.zeros((xyz.shape[0], len(scale_names)))
-    for idx, attr_name in enumerate(scale_names):
-        scales[:, idx] = np.asarray(plydata.elements[0][attr_name])
+    scale_names = [name for name in property_names if name.startswith("scale_")]
+    scales = read_gs_ply_attributes(plydata, scale_names)
 
-    rot_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("rot")]
-    rots = np.zeros((xyz.shape[0], len(rot_names)))
-    for idx, attr_name in enumerate(rot_names):
-        rots[:, idx] = np.asarray(plydata.elements[0][attr_name])
+    rot_names = [name for name in property_names if name.startswith("rot")]
+    rots = read_gs_ply_attributes(plydata, rot_names)
         
     return xyz, features_dc, features_extra, opacities, scales, rots
 
+# Compact .splat layout read by gsplat.js / antimatter15 splat viewers, 32 bytes per gaussian (vs 248 bytes of a SH degree 3 ply)
+splat_vertex_dtype = np.dtype([
+    ('position', '<f4', 3),
+    ('scale', '<f4', 3),
+    ('color', 'u1', 4),
+    ('rotation', 'u1', 4),
+])
+
+def encode_gs_splat(xyz, features_dc, opacities, scales, rots):
+    """
+    Quantize 3DGS attributes into .splat records, view dependent SH bands are dropped (only DC color is kept).
+    Records are sorted by importance (volume * opacity, descending) so any prefix of the file is a usable level of detail.
+
+    Returns:
+        NDArray[splat_vertex_dtype], shape: [N]
+    """
+    opacities = 1 / (1 + np.exp(-opacities[:, 0]))
+    order = np.argsort(-np.exp(scales.sum(axis=1)) * opacities, kind='stable')
+    
+    rots = rots[order]
+    rots = rots / np.maximum(np.linalg.norm(rots, axis=1, keepdims=True), 1e-12)
+    
+    splat = np.empty(len(order), dtype=splat_vertex_dtype)
+    splat['position'] = xyz[order]
+    splat['scale'] = np.exp(scales[order])
+    # round before the uint8 cast, which would truncate and bias every channel down
+    splat['color'][:, :3] = np.clip(np.round(SH2RGB(features_dc[order, :, 0]) * 255), 0, 255)
+    splat['color'][:, 3] = np.clip(np.round(opacities[order] * 255), 0, 255)
+    splat['rotation'] = np.clip(np.round(rots * 128 + 128), 0, 255)
+    return splat
+
+def decode_gs_splat(splat):
+    """
+    Inverse of encode_gs_splat, returns attributes in the same layout as read_gs_ply with no view dependent SH bands.
+    """
+    xyz = splat['position'].astype(np.float32)
+    scales = np.log(np.maximum(splat['scale'], 1e-12)).astype(np.float32)
+    
+    color = splat['color'].astype(np.float32) / 255
+    features_dc = RGB2SH(color[:, :3])[..., np.newaxis].astype(np.float32)
+    features_extra = np.zeros((len(splat), 3, 0), dtype=np.float32)
+    alpha = np.clip(color[:, 3:], 1 / 512, 1 - 1 / 512)
+    opacities = np.log(alpha / (1 - alpha)).astype(np.float32)
+    
+    rots = (splat['rotation'].astype(np.float32) - 128) / 128
+    return xyz, features_dc, features_extra, opacities, scales, rots
+
+class GaussianSplattingPly:
+    """
+    Lightweight handle of 3DGS passed between GS_PLY nodes, holds either a (memory-mapped) PlyData or decoded attributes (numpy arrays or device tensors).
+
+    Attributes are decoded at most once and cached, PlyData is only built when a node really needs the file layout (e.g. saving),
+    so a large splat can go through a workflow without repeated decode/encode cycles.
+    For compatibility it also exposes ``elements`` and ``write`` like a PlyData.
+    """
+    def __init__(self, plydata=None, attributes=None):
+        """
+        Args:
+            plydata (PlyData, optional): 3DGS ply data. Defaults to None.
+            attributes (tuple, optional): xyz [N, 3], features_dc [N, 3, 1], features_extra [N, 3, SH_coeffs except DC], opacities [N, 1], scales [N, 3], rots [N, 4],
+                either all numpy arrays or all torch tensors. Defaults to None.
+        """
+        assert plydata is not None or attributes is not None, "Either plydata or attributes must be given"
+        self._plydata = plydata
+        self._attributes = None
+        self._tensors = {}
+        if attributes is not None:
+            if isinstance(attributes[0], torch.Tensor):
+                attributes = tuple(attr.detach() for attr in attributes)
+                self._tensors[attributes[0].device] = attributes
+            else:
+                self._attributes = attributes
+
+    @classmethod
+    def from_file(cls, gs_file_path):
+        if gs_file_path.lower().endswith('.splat'):
+            return cls(attributes=decode_gs_splat(np.fromfile(gs_file_path, dtype=splat_vertex_dtype)))
+        return cls(plydata=load_gs_ply(gs_file_path))
+
+    @classmethod
+    def from_attributes(cls, xyz, features_dc, features_extra, opacities, scales, rots):
+        return cls(attributes=(xyz, features_dc, features_extra, opacities, scales, rots))
+
+    @property
+    def num_gaussians(self):
+        if self._plydata is not None:
+            return self._plydata.elements[0].count
+        return len(self.attributes()[0]) if len(self._tensors) == 0 else len(next(iter(self._tensors.values()))[0])
+
+    @property
+    def max_sh_degree(self):
+        if self._plydata is not None and self._attributes is None:
+            return calculate_max_sh_degree_from_gs_ply(self._plydata)[0]
+        features_extra = self._attributes[2] if self._attributes is not None else next(iter(self._tensors.values()))[2]
+        return int(round((features_extra.shape[2] + 1) ** 0.5)) - 1
+
+    @property
+    def extra_f_names(self):
+        return ['f_rest_{}'.format(i) for i in range(3 * ((self.max_sh_degree + 1) ** 2 - 1))]
+
+    def attributes(self):
+        """Decoded numpy attributes in the same layout as ``read_gs_ply``, cached after the first call."""
+        if self._attributes is None:
+            if self._plydata is not None:
+                self._attributes = read_gs_ply(self._plydata)
+            else:
+                self._attributes = tuple(attr.float().cpu().numpy() for attr in next(iter(self._tensors.values())))
+        return self._attributes
+
+    def tensors(self, device):
+        """Decoded attributes as float32 tensors on device, cached per device."""
+        device = torch.device(device)
+        if device.type == "cuda" and device.index is None:
+            device = torch.device("cuda", torch.cuda.current_device())
+        if device not in self._tensors:
+            self._tensors[device] = tuple(torch.from_numpy(attr).to(device) for attr in self.attributes())
+        return self._tensors[device]
+
+    def to_plydata(self):
+        if self._plydata is None:
+            xyz, features_dc, features_extra, opacities, scales, rots = self.attributes()
+            normals = np.zeros_like(xyz)
+            features_dc_2d = features_dc.reshape(features_dc.shape[0], features_dc.shape[1]*features_dc.shape[2])
+            features_extra_2d = features_extra.reshape(features_extra.shape[0], features_extra.shape[1]*features_extra.shape[2])
+            self._plydata = write_gs_ply(xyz, normals, features_dc_2d, features_extra_2d, opacities, scales, rots, construct_list_of_gs_attributes(features_dc, features_extra, scales, rots))
+        return self._plydata
+
+    @property
+    def elements(self):
+        return self.to_plydata().elements
+
+    def to_splat(self):
+        xyz, features_dc, features_extra, opacities, scales, rots = self.attributes()
+        return encode_gs_splat(xyz, features_dc, opacities, scales, rots)
+
+    def write(self, path):
+        # format follows file extension, .splat is the compact lossy preview format, anything else is a full precision ply
+        if path.lower().endswith('.splat'):
+            self.to_splat().tofile(path)
+        else:
+            self.to_plydata().write(path)
+
 def ply_to_points_cloud(plydata):
     xyz, features_dc, features_extra, opacities, scales, rots = read_gs_ply(plydata)
     
@@ -435,16 +594,14 @@ def switch_ply_axis_and_scale(plydata, target_axis, target_scale, coordinate_inv
         target_scale (array): shape (3)
     """
     xyz, features_dc, features_extra, opacities, scales, rots = read_gs_ply(plydata)
-    normals = np.zeros_like(xyz)
-    features_dc_2d = features_dc.reshape(features_dc.shape[0], features_dc.shape[1]*features_dc.shape[2])
-    features_extra_2d = features_extra.reshape(features_extra.shape[0], features_extra.shape[1]*features_extra.shape[2])
     
-    target_scale = torch.tensor(target_scale).float().cuda()
-    xyz = switch_vector_axis(torch.tensor(xyz).float().cuda() * target_scale, target_axis).detach().cpu().numpy()
-    scales = switch_vector_axis(torch.tensor(scales).float().cuda(), target_axis).detach().cpu().numpy()
+    # positions and scales only need a column permutation, do it on copies of the (possibly cached) decoded float32 arrays
+    xyz = switch_vector_axis(xyz * np.asarray(target_scale, dtype=np.float32), target_axis)
+    scales = switch_vector_axis(scales.copy(), target_axis)
     
     # change rotation representation from quaternion (w, x, y, z) to axis angle vector (x, y, z) to make swich axis easier
-    rots_axis_angle = quaternion_to_axis_angle(torch.tensor(rots).float().cuda())
+    target_scale = torch.tensor(target_scale).float().cuda()
+    rots_axis_angle = quaternion_to_axis_angle(torch.from_numpy(rots).cuda())
     rots_axis_angle = switch_vector_axis(rots_axis_angle * target_scale, target_axis)
     """
     Since axis–angle vector is composed of axis (unit vector/direction) and clockwise radians angle (vector magnitude),
@@ -454,7 +611,8 @@ def switch_ply_axis_and_scale(plydata, target_axis, target_scale, coordinate_inv
         rots_axis_angle = -rots_axis_angle
     rots = axis_angle_to_quaternion(rots_axis_angle).detach().cpu().numpy()
     
-    return write_gs_ply(xyz, normals, features_dc_2d, features_extra_2d, opacities, scales, rots, construct_list_of_gs_attributes(features_dc, features_extra, scales, rots))
+    # hand the decoded attributes to the next node, they are only encoded back to ply when it is actually saved
+    return GaussianSplattingPly.from_attributes(xyz, features_dc, features_extra, opacities, scales, rots)
     
 def switch_mesh_axis_and_scale(mesh, target_axis, target_scale, flip_normal=False):
     """
@@ -470,24 +628,109 @@ def switch_mesh_axis_and_scale(mesh, target_axis, target_scale, flip_normal=Fals
     return mesh
 
 
-def marching_cubes_density_to_mesh(get_density_func, grid_size=256, S=128, density_thresh=10, decimate_target=5e4):
+def _density_to_host_async(val):
+    # start copying a block of densities back to host without waiting, caller must wait on the returned event before reading it
+    val = val.detach().reshape(-1)
+    if val.is_cuda:
+        host_val = val.to("cpu", non_blocking=True)
+        copy_done = torch.cuda.Event()
+        copy_done.record()
+        return host_val, copy_done
+    return val.cpu(), None
+
+@torch.no_grad()
+def narrow_band_density_grid(get_density_func, grid_size=256, S=128, density_thresh=10, coarse_block_size=8):
+    """
+    Evaluate a density field on a [grid_size]^3 lattice in [-1, 1]^3, coarse-to-fine:
+    the density is first queried on a coarse lattice every coarse_block_size grid points, then only blocks whose coarse corners cross density_thresh
+    (dilated by one block) are queried at full resolution, other blocks are filled with the mean of their coarse corners which lies on the same side of the threshold.
+    Surfaces stay identical to the dense evaluation as long as no feature is thinner than a block and lies entirely between its coarse samples.
+    
+    Args:
+        S (int): maximum number of points per query is S^3
+    
+    Returns:
+        np.ndarray: float32 [grid_size, grid_size, grid_size] density grid
+    """
+    block_size = max(1, int(coarse_block_size))
+    max_batch_points = S ** 3
+    coords = torch.linspace(-1, 1, grid_size)
+    
+    # coarse lattice, corners of every block lie on the fine lattice
+    num_blocks = max(1, math.ceil((grid_size - 1) / block_size))
+    coarse_ids = torch.clamp(torch.arange(num_blocks + 1) * block_size, max=grid_size - 1)
+    xx, yy, zz = torch.meshgrid(coords[coarse_ids], coords[coarse_ids], coords[coarse_ids], indexing='ij')
+    coarse_pts = torch.stack([xx.reshape(-1), yy.reshape(-1), zz.reshape(-1)], dim=-1)
+    coarse_sigmas = torch.cat([get_density_func(pts).detach().reshape(-1).float().cpu() for pts in coarse_pts.split(max_batch_points)])
+    coarse_sigmas = coarse_sigmas.reshape(num_blocks + 1, num_blocks + 1, num_blocks + 1)
+    
+    # a block needs refinement when its 8 coarse corners are not on the same side of the threshold
+    corners = torch.stack([
+        coarse_sigmas[dx:dx + num_blocks, dy:dy + num_blocks, dz:dz + num_blocks] 
+        for dx in (0, 1) for dy in (0, 1) for dz in (0, 1)
+    ], dim=0) # [8, n, n, n]
+    corners_above = corners > density_thresh
+    crossing = corners_above.any(dim=0) & ~corners_above.all(dim=0)
+    # dilate by one block, so a surface poking through a block face between coarse samples is still refined
+    active = torch.nn.functional.max_pool3d(crossing.float()[None, None], kernel_size=3, stride=1, padding=1)[0, 0] > 0
+    active_blocks = active.nonzero() # [K, 3]
+    
+    # fill every fine grid point with the mean corner density of its block
+    block_of_point = torch.clamp(torch.arange(grid_size) // block_size, max=num_blocks - 1).numpy()
+    block_mean = corners.mean(dim=0).numpy()
+    sigmas = block_mean[np.ix_(block_of_point, block_of_point, block_of_point)]
+    
+    cstr(f"[narrow_band_density_grid] refine {active_blocks.shape[0]} / {num_blocks ** 3} blocks of size {block_size}").msg.print()
+    
+    # query active blocks at full resolution, in batches of whole blocks (block corners included so shared faces are exact)
+    local = torch.arange(block_size + 1)
+    local_x, local_y, local_z = torch.meshgrid(local, local, local, indexing='ij')
+    local_ids = torch.stack([local_x.reshape(-1), local_y.reshape(-1), local_z.reshape(-1)], dim=-1) # [(B+1)^3, 3]
+    blocks_per_batch = max(1, max_batch_points // local_ids.shape[0])
+    
+    pending = None
+    for batch_blocks in active_blocks.split(blocks_per_batch):
+        ids = torch.clamp(batch_blocks[:, None, :] * block_size + local_ids[None], max=grid_size - 1).reshape(-1, 3)
+        val = get_density_func(coords[ids])
+        # write back the previous batch while this one is being copied, so host transfers overlap with density queries
+        if pending is not None:
+            _write_density_batch(sigmas, *pending)
+        pending = (ids.numpy(), *_density_to_host_async(val))
+    if pending is not None:
+        _write_density_batch(sigmas, *pending)
+    
+    return sigmas
+
+def _write_density_batch(sigmas, ids, host_val, copy_done):
+    if copy_done is not None:
+        copy_done.synchronize()
+    sigmas[ids[:, 0], ids[:, 1], ids[:, 2]] = host_val.float().numpy()
+
+def marching_cubes_density_to_mesh(get_density_func, grid_size=256, S=128, density_thresh=10, decimate_target=5e4, coarse_block_size=0):
+    """
+    Args:
+        coarse_block_size (int): if > 0, evaluate the density coarse-to-fine with narrow_band_density_grid using blocks of this size, 
+            otherwise evaluate the full dense grid. Defaults to 0.
+    """
     from mcubes import marching_cubes
     from kiui.mesh_utils import clean_mesh, decimate_mesh
     
-    
-    sigmas = np.zeros([grid_size, grid_size, grid_size], dtype=np.float32)
+    if coarse_block_size > 0:
+        sigmas = narrow_band_density_grid(get_density_func, grid_size, S, density_thresh, coarse_block_size)
+    else:
+        sigmas = np.zeros([grid_size, grid_size, grid_size], dtype=np.float32)
 
-    X = torch.linspace(-1, 1, grid_size).split(S)
-    Y = torch.linspace(-1, 1, grid_size).split(S)
-    Z = torch.linspace(-1, 1, grid_size).split(S)
+        X = torch.linspace(-1, 1, grid_size).split(S)
+        Y = torch.linspace(-1, 1, grid_size).split(S)
+        Z = torch.linspace(-1, 1, grid_size).split(S)
 
-    for xi, xs in enumerate(X):
-        for yi, ys in enumerate(Y):
-            for zi, zs in enumerate(Z):
-                xx, yy, zz = torch.meshgrid(xs, ys, zs, indexing='ij')
-                pts = torch.cat([xx.reshape(-1, 1), yy.reshape(-1, 1), zz.reshape(-1, 1)], dim=-1) # [S, 3]
-                val = get_density_func(pts)
-                sigmas[xi * S: xi * S + len(xs), yi * S: yi * S + len(ys), zi * S: zi * S + len(zs)] = val.reshape(len(xs), len(ys), len(zs)).detach().cpu().numpy() # [S, 1] --> [x, y, z]
+        for xi, xs in enumerate(X):
+            for yi, ys in enumerate(Y):
+                for zi, zs in enumerate(Z):
+                    xx, yy, zz = torch.meshgrid(xs, ys, zs, indexing='ij')
+                    pts = torch.cat([xx.reshape(-1, 1), yy.reshape(-1, 1), zz.reshape(-1, 1)], dim=-1) # [S, 3]
+                    val = get_density_func(pts)
+                    sigmas[xi * S: xi * S + len(xs), yi * S: yi * S + len(ys), zi * S: zi * S + len(zs)] = val.reshape(len(xs), len(ys), len(zs)).detach().cpu().numpy() # [S, 1] --> [x, y, z]
 
     print(f'[INFO] marching cubes thresh: {density_thresh} ({sigmas.min()} ~ {sigmas.max()})')
 
@@ -503,7 +746,7 @@ def marching_cubes_density_to_mesh(get_density_func, grid_size=256, S=128, densi
     
     return vertices, triangles
 
-def color_func_to_albedo(mesh, get_rgb_func, texture_resolution=1024, padding=2, batch_size=640000, device="cuda", force_cuda_rast=False, glctx=None):
+def color_func_to_albedo(mesh, get_rgb_func, texture_resolution=1024, padding=2, batch_size=640000, device="cuda", force_cuda_rast=False, glctx=None, uv_backend="xatlas"):
     import nvdiffrast.torch as dr
     from kiui.op import uv_padding
     
@@ -516,7 +759,7 @@ def color_func_to_albedo(mesh, get_rgb_func, texture_resolution=1024, padding=2,
     # render uv maps
     h = w = texture_resolution
     if mesh.vt is None:
-        mesh.auto_uv()
+        mesh.auto_uv(backend=uv_backend)
 
     uv = mesh.vt * 2.0 - 1.0 # uvs to range [-1, 1]
     uv = torch.cat((uv, torch.zeros_like(uv[..., :1]), torch.ones_like(uv[..., :1])), dim=-1) # [N, 4]
@@ -583,16 +826,83 @@ def K_nearest_neighbors_func(
         else:
             return nn[0, :, :, :], idx[0, :, :], dist[0, :, :]
 
-def interpolate_texture_map_attr(mesh, texture_size: int = 256, batch_size: int = 64, interpolate_color=True, interpolate_position=False):
+def rasterize_uv_faces(verts_uvs, faces, texture_size, max_candidates=1 << 22):
+    """
+    Rasterize faces in texture space on any device, without nvdiffrast.
+
+    Every face is tested only against the texels inside its bounding box, faces are expanded to those texels once and
+    processed in chunks of at most max_candidates texels. Where faces overlap the lowest face index wins.
+
+    Args:
+        verts_uvs (torch.Tensor): [Nt, 2] uv coordinates in texel units, i.e. in [0, texture_size - 1]
+        faces (torch.Tensor): [M, 3] uv indices of faces
+        texture_size (int): width and height of the texture
+        max_candidates (int, optional): texels tested at once, bounds the memory used. Defaults to 1 << 22.
+
+    Returns:
+        texels (torch.Tensor): [K, 2] long (x, y) of the covered texels
+        face_ids (torch.Tensor): [K] long index of the face covering each texel
+        barycentrics (torch.Tensor): [K, 3] weights of the three face vertices at each texel
+    """
+    device = verts_uvs.device
+    uvs = verts_uvs[faces] # [M, 3, 2]
+    v0, v1, v2 = uvs[:, 0], uvs[:, 1], uvs[:, 2]
+    denom = (v1[:, 1] - v2[:, 1]) * (v0[:, 0] - v2[:, 0]) + (v2[:, 0] - v1[:, 0]) * (v0[:, 1] - v2[:, 1])
+
+    # texel bounding box of every face, degenerate faces and faces outside of the texture are skipped
+    bbox_min = uvs.amin(dim=1).ceil().clamp(min=0).long()
+    bbox_max = uvs.amax(dim=1).floor().clamp(max=texture_size - 1).long()
+    bbox_size = (bbox_max - bbox_min + 1).clamp(min=0)
+    counts = bbox_size[:, 0] * bbox_size[:, 1]
+    counts[denom == 0] = 0
+    face_ids = counts.nonzero().squeeze(-1)
+    counts = counts[face_ids]
+
+    # first pass: lowest face index covering each texel
+    winner = torch.full((texture_size * texture_size,), faces.shape[0], dtype=torch.long, device=device)
+    cum_counts = torch.cumsum(counts, dim=0)
+    head = 0
+    while head < face_ids.shape[0]:
+        # at least one face per chunk, even if its bounding box alone exceeds max_candidates
+        chunk_start = cum_counts[head] - counts[head]
+        tail = max(int(torch.searchsorted(cum_counts, chunk_start + max_candidates, right=True)), head + 1)
+        chunk_faces = face_ids[head:tail]
+        chunk_counts = counts[head:tail]
+        head = tail
+
+        # expand faces to the texels of their bounding box
+        candidate_faces = torch.repeat_interleave(chunk_faces, chunk_counts)
+        offsets = torch.cumsum(chunk_counts, dim=0) - chunk_counts
+        local = torch.arange(candidate_faces.shape[0], device=device) - torch.repeat_interleave(offsets, chunk_counts)
+        width = bbox_size[candidate_faces, 0]
+        x = bbox_min[candidate_faces, 0] + local % width
+        y = bbox_min[candidate_faces, 1] + local // width
+
+        a, b, c = _uv_barycentrics(x.to(verts_uvs.dtype), y.to(verts_uvs.dtype), v0[candidate_faces], v1[candidate_faces], v2[candidate_faces], denom[candidate_faces])
+        inside = (a >= 0) & (b >= 0) & (c >= 0)
+        winner.scatter_reduce_(0, (y * texture_size + x)[inside], candidate_faces[inside], reduce="amin")
+
+    # second pass: barycentrics of the winning faces only
+    texel_ids = (winner < faces.shape[0]).nonzero().squeeze(-1)
+    face_ids = winner[texel_ids]
+    x, y = texel_ids % texture_size, texel_ids // texture_size
+    a, b, c = _uv_barycentrics(x.to(verts_uvs.dtype), y.to(verts_uvs.dtype), v0[face_ids], v1[face_ids], v2[face_ids], denom[face_ids])
+    return torch.stack([x, y], dim=-1), face_ids, torch.stack([a, b, c], dim=-1)
+
+def _uv_barycentrics(x, y, v0, v1, v2, denom):
+    a = ((v1[:, 1] - v2[:, 1]) * (x - v2[:, 0]) + (v2[:, 0] - v1[:, 0]) * (y - v2[:, 1])) / denom
+    b = ((v2[:, 1] - v0[:, 1]) * (x - v2[:, 0]) + (v0[:, 0] - v2[:, 0]) * (y - v2[:, 1])) / denom
+    return a, b, 1 - a - b
+
+def interpolate_texture_map_attr(mesh, texture_size: int = 256, batch_size: int = 64, interpolate_color=True, interpolate_position=False, uv_backend="xatlas"):
     # Get UV coordinates and faces
     if mesh.vt is None:
-        mesh.auto_uv()
+        mesh.auto_uv(backend=uv_backend)
         
     # Get Faces on UV
     texture_size_minus_one = texture_size - 1
     faces = mesh.ft
     verts_uvs = mesh.vt * texture_size_minus_one
-    verts_uvs_idx = verts_uvs.to(torch.long)
 
     vmapping = mesh.get_default_vt_to_v_mapping()
     # Get vertex colors
@@ -607,60 +917,17 @@ def interpolate_texture_map_attr(mesh, texture_size: int = 256, batch_size: int
     position_map = None
     if interpolate_position:
         verts_positions = mesh.v[vmapping]
-        position_map = torch.zeros((texture_size, texture_size, 3), device=verts_colors.device)
-    
-    # Create a grid of UV coordinates
-    grid_x, grid_y = torch.meshgrid(torch.linspace(0, texture_size_minus_one, texture_size, dtype=verts_uvs.dtype, device=verts_colors.device), torch.linspace(0, texture_size_minus_one, texture_size, dtype=verts_uvs.dtype, device=verts_colors.device))
-    grid = torch.stack([grid_x, grid_y], dim=-1)
+        position_map = torch.zeros((texture_size, texture_size, 3), device=verts_positions.device)
     
-    batch_idx_range = torch.arange(0, batch_size**2, 1, device=verts_colors.device, dtype=torch.long)
+    # batch_size used to be the edge of the square tiles rasterized at once, keep a comparable memory bound
+    texels, face_ids, barycentrics = rasterize_uv_faces(verts_uvs, faces, texture_size, max_candidates=max(batch_size, 16) ** 2 * 256)
+    face_verts = faces[face_ids]
     
-    all_face_verts = verts_uvs_idx[faces]
-    for uv_i in range(0, texture_size_minus_one, batch_size):
-        for uv_j in range(0, texture_size_minus_one, batch_size):
-            # Divide faces into squre batchs
-            faces_mask = (uv_i <= all_face_verts[:, :, 0]) & (all_face_verts[:, :, 0] <= uv_i + batch_size) & (uv_j <= all_face_verts[:, :, 1]) & (all_face_verts[:, :, 1] <= uv_j + batch_size)
-            faces_mask, _ = torch.max(faces_mask, dim=1)
-            faces_mask = faces_mask.nonzero().squeeze(-1)
-            batch_faces = faces[faces_mask]
-            
-            uvs = verts_uvs[batch_faces]
-            if interpolate_color:
-                colors = verts_colors[batch_faces]
-            if interpolate_position:
-                positions = verts_positions[batch_faces]
-                        
-            v0, v1, v2 = uvs[:, 0], uvs[:, 1], uvs[:, 2]
-            v0_0, v0_1 = v0[:, 0], v0[:, 1]
-            v1_0, v1_1 = v1[:, 0], v1[:, 1]
-            v2_0, v2_1 = v2[:, 0], v2[:, 1]
-            
-            sub_grid = grid[uv_i:uv_i + batch_size, uv_j:uv_j + batch_size].reshape(-1, 2).unsqueeze(1)
-                        
-            # Compute barycentric coordinates for the batch of faces
-            denom = (v1_1 - v2_1) * (v0_0 - v2_0) + (v2_0 - v1_0) * (v0_1 - v2_1)
-            a = ((v1_1 - v2_1) * (sub_grid[:, :, 0] - v2_0) + (v2_0 - v1_0) * (sub_grid[:, :, 1] - v2_1)) / denom
-            b = ((v2_1 - v0_1) * (sub_grid[:, :, 0] - v2_0) + (v0_0 - v2_0) * (sub_grid[:, :, 1] - v2_1)) / denom
-            c = 1 - a - b
-            
-            # Mask for points inside the triangle
-            mask = (a >= 0) & (b >= 0) & (c >= 0)
-            mask, mask_idx = torch.max(mask, dim=1)
-            
-            # Get texture coordinates
-            sub_grid = sub_grid.squeeze(1)
-            uv_coords = sub_grid[mask].to(torch.long)
-            
-            # Interpolate colors
-            a, b, c = a[batch_idx_range, mask_idx][mask], b[batch_idx_range, mask_idx][mask], c[batch_idx_range, mask_idx][mask]
-            
-            if interpolate_color:
-                colors = colors[mask_idx][mask]
-                interpolated_colors = (a[:, None] * colors[:, 0] + (b[:, None] * colors[:, 1]) + (c[:, None] * colors[:, 2]))
-                texture_map[uv_coords[:, 1], uv_coords[:, 0]] = interpolated_colors
-            if interpolate_position:
-                positions = positions[mask_idx][mask]
-                interpolated_positions = (a[:, None] * positions[:, 0] + (b[:, None] * positions[:, 1]) + (c[:, None] * positions[:, 2]))
-                position_map[uv_coords[:, 1], uv_coords[:, 0]] = interpolated_positions
+    if interpolate_color:
+        interpolated_colors = (barycentrics[:, :, None] * verts_colors[face_verts]).sum(dim=1)
+        texture_map[texels[:, 1], texels[:, 0]] = interpolated_colors
+    if interpolate_position:
+        interpolated_positions = (barycentrics[:, :, None] * verts_positions[face_verts]).sum(dim=1)
+        position_map[texels[:, 1], texels[:, 0]] = interpolated_positions
             
-    return texture_map, position_map
\ No newline at end of file
+    return texture_map, position_map
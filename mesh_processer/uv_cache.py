@@ -0,0 +1,94 @@
+import os
+import hashlib
+import threading
+import numpy as np
+
+from shared_utils.common_utils import get_persistent_directory
+
+UV_CACHE_FOLDER_NAME = os.path.join("comfy3d", "uv_atlas_cache")
+UV_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+class UVAtlasCache:
+    """
+    Content-addressed on-disk cache of xatlas results, keyed by the hash of mesh vertices & faces bytes plus chart options.
+    Entries are ``.npz`` files holding vt, ft and vmapping, least-recently-used entries are evicted when the cache grows over max_bytes.
+    """
+    def __init__(self, cache_dir=None, max_bytes=UV_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir if cache_dir is not None else get_persistent_directory(UV_CACHE_FOLDER_NAME)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(v_np, f_np, chart_options=None):
+        hasher = hashlib.blake2b(digest_size=20)
+        for array in (v_np, f_np):
+            array = np.ascontiguousarray(array)
+            hasher.update(f"{array.dtype.str}{array.shape}".encode())
+            hasher.update(array.data)
+        hasher.update(repr(sorted((chart_options or {}).items())).encode())
+        return hasher.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def load(self, key):
+        """Return (vt, ft, vmapping) numpy arrays if key is cached, otherwise None."""
+        path = self._entry_path(key)
+        try:
+            with np.load(path) as data:
+                entry = data["vt"], data["ft"], data["vmapping"]
+            # last access time drives LRU eviction, mtime is used because atime is often disabled
+            os.utime(path)
+        except (OSError, KeyError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def save(self, key, vt, ft, vmapping):
+        path = self._entry_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, vt=vt, ft=ft, vmapping=vmapping)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(".npz"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, filename))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, filename in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, filename))
+            except OSError:
+                continue
+            total_bytes -= size
+            with self._lock:
+                self.evictions += 1
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+_uv_atlas_cache = None
+
+def get_uv_atlas_cache():
+    global _uv_atlas_cache
+    if _uv_atlas_cache is None:
+        _uv_atlas_cache = UVAtlasCache()
+    return _uv_atlas_cache
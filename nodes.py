@@ -9,11 +9,11 @@ from omegaconf import OmegaConf
 import json
 
 import torch
+import torch.nn.functional as F
 from torch.utils.data import DataLoader
 from torchvision.transforms import v2
 import torchvision.transforms.functional as TF
 import numpy as np
-from safetensors.torch import load_file
 from einops import rearrange
 
 from diffusers import (
@@ -30,13 +30,11 @@ from diffusers import (
     KDPM2AncestralDiscreteScheduler,
     KDPM2DiscreteScheduler,
 )
-from huggingface_hub import snapshot_download
 
-from plyfile import PlyData
-from PIL import Image
 
-from .mesh_processer.mesh import Mesh
+from .mesh_processer.mesh import Mesh, UV_BACKENDS
 from .mesh_processer.mesh_utils import (
+    GaussianSplattingPly,
     ply_to_points_cloud, 
     get_target_axis_and_scale, 
     switch_ply_axis_and_scale, 
@@ -93,14 +91,17 @@ from CRM_T2I_V3.model.crm.sampler import CRMSamplerV3
 
 from .shared_utils.image_utils import (
     prepare_torch_img, torch_imgs_to_pils, troch_image_dilate, 
-    pils_rgba_to_rgb, pil_make_image_grid, pil_split_image, pils_to_torch_imgs, pils_resize_foreground
+    pils_rgba_to_rgb, pils_to_torch_imgs,
+    torch_imgs_to_rgba, torch_imgs_add_bg, torch_imgs_pad_to_square, torch_imgs_resize_foreground, torch_make_image_grid, torch_split_image
 )
 from .shared_utils.camera_utils import (
     ORBITPOSE_PRESET_DICT, ELEVATION_MIN, ELEVATION_MAX, AZIMUTH_MIN, AZIMUTH_MAX, 
     compose_orbit_camposes
 )
 from .shared_utils.log_utils import cstr
-from .shared_utils.common_utils import parse_save_filename, get_list_filenames, resume_or_download_model_from_hf
+from .shared_utils.common_utils import parse_save_filename, get_list_filenames, resume_or_download_model_from_hf, resume_or_download_snapshot_from_hf
+from .shared_utils.model_residency import ManagedModel, ConfiguredModel, get_model_residency_manager, use_model
+from .shared_utils.safetensors_utils import load_checkpoint_into_model
 
 DIFFUSERS_PIPE_DICT = OrderedDict([
     ("MVDreamPipeline", MVDreamPipeline),
@@ -146,6 +147,7 @@ SUPPORTED_3D_EXTENSIONS = (
 
 SUPPORTED_3DGS_EXTENSIONS = (
     '.ply',
+    '.splat',
 )
 
 SUPPORTED_CHECKPOINTS_EXTENSIONS = (
@@ -295,7 +297,7 @@ class Load_3DGS:
         if os.path.exists(gs_file_path):
             folder, filename = os.path.split(gs_file_path)
             if filename.lower().endswith(SUPPORTED_3DGS_EXTENSIONS):
-                gs_ply = PlyData.read(gs_file_path)
+                gs_ply = GaussianSplattingPly.from_file(gs_file_path)
             else:
                 cstr(f"[{self.__class__.__name__}] File name {filename} does not end with supported 3DGS file extensions: {SUPPORTED_3DGS_EXTENSIONS}").error.print()
         else:        
@@ -320,16 +322,30 @@ class Save_3D_Mesh:
     RETURN_NAMES = (
         "save_path",
     )
+    # receives every mesh of a list (e.g. from a TripoSR batch) in one call, so they don't overwrite each other
+    INPUT_IS_LIST = True
+    OUTPUT_IS_LIST = (
+        True,
+    )
     FUNCTION = "save_mesh"
     CATEGORY = "Comfy3D/Import|Export"
     
     def save_mesh(self, mesh, save_path):
-        save_path = parse_save_filename(save_path, comfy_paths.output_directory, SUPPORTED_3D_EXTENSIONS, self.__class__.__name__)
-        
-        if save_path is not None:
-            mesh.write(save_path)
+        save_path = save_path[0]
+        save_paths = []
+        for i, single_mesh in enumerate(mesh):
+            mesh_save_path = save_path
+            if len(mesh) > 1:
+                # index suffix per mesh, before the extension
+                root, file_extension = os.path.splitext(save_path)
+                mesh_save_path = f"{root}_{i:03d}{file_extension}"
+            mesh_save_path = parse_save_filename(mesh_save_path, comfy_paths.output_directory, SUPPORTED_3D_EXTENSIONS, self.__class__.__name__)
+            
+            if mesh_save_path is not None:
+                single_mesh.write(mesh_save_path)
+            save_paths.append(mesh_save_path)
 
-        return (save_path, )
+        return (save_paths, )
     
 class Save_3DGS:
 
@@ -357,6 +373,9 @@ class Save_3DGS:
         save_path = parse_save_filename(save_path, comfy_paths.output_directory, SUPPORTED_3DGS_EXTENSIONS, self.__class__.__name__)
         
         if save_path is not None:
+            # TGS and LGM output raw PlyData, which would write ply bytes into a .splat file
+            if not isinstance(gs_ply, GaussianSplattingPly):
+                gs_ply = GaussianSplattingPly(plydata=gs_ply)
             gs_ply.write(save_path)
         
         return (save_path, )
@@ -393,10 +412,7 @@ class Image_Add_Pure_Color_Background:
         image = inv_bg_mask * image + bg_mask * color_bg
         """
 
-        image_pils = torch_imgs_to_pils(images, masks)
-        image_pils = pils_rgba_to_rgb(image_pils, (R, G, B))
-
-        images = pils_to_torch_imgs(image_pils, images.dtype, images.device)
+        images = torch_imgs_add_bg(images, masks, (R / 255, G / 255, B / 255))
         return (images,)
     
 class Resize_Image_Foreground:
@@ -423,11 +439,7 @@ class Resize_Image_Foreground:
     CATEGORY = "Comfy3D/Preprocessor"
 
     def resize_img_foreground(self, images, masks, foreground_ratio):
-        image_pils = torch_imgs_to_pils(images, masks)
-        image_pils = pils_resize_foreground(image_pils, foreground_ratio)
-        
-        images = pils_to_torch_imgs(image_pils, images.dtype, images.device, force_rgb=False)
-        images, masks = images[:, :, :, 0:-1], images[:, :, :, -1]
+        images, masks = torch_imgs_resize_foreground(images, masks, foreground_ratio)
         return (images, masks,)
     
 class Make_Image_Grid:
@@ -452,8 +464,6 @@ class Make_Image_Grid:
     CATEGORY = "Comfy3D/Preprocessor"
     
     def make_image_grid(self, images, grid_side_num, use_rows):
-        pil_image_list = torch_imgs_to_pils(images)
-
         if use_rows:
             rows = grid_side_num
             clos = None
@@ -461,9 +471,7 @@ class Make_Image_Grid:
             clos = grid_side_num
             rows = None
 
-        image_grid = pil_make_image_grid(pil_image_list, rows, clos)
-
-        image_grid = TF.to_tensor(image_grid).permute(1, 2, 0).unsqueeze(0)  # [1, H, W, 3]
+        image_grid = torch_make_image_grid(images, rows, clos)  # [1, H, W, 3]
 
         return (image_grid,)
 
@@ -489,21 +497,14 @@ class Split_Image_Grid:
     CATEGORY = "Comfy3D/Preprocessor"
     
     def split_image_grid(self, image, grid_side_num, use_rows):
-        images = []
-        for image_pil in torch_imgs_to_pils(image):
-
-            if use_rows:
-                rows = grid_side_num
-                clos = None
-            else:
-                clos = grid_side_num
-                rows = None
-
-            image_pils = pil_split_image(image_pil, rows, clos)
+        if use_rows:
+            rows = grid_side_num
+            clos = None
+        else:
+            clos = grid_side_num
+            rows = None
 
-            images.append(pils_to_torch_imgs(image_pils, image.dtype, image.device))
-            
-        images = torch.cat(images, dim=0)
+        images = torch_split_image(image, rows, clos)
         return (images,)
 
 class Get_Masks_From_Normal_Maps:
@@ -658,6 +659,39 @@ class Switch_Mesh_Axis:
         
         return (switched_mesh, )
     
+class Unwrap_Mesh_UV:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "mesh": ("MESH",),
+                "uv_backend": (UV_BACKENDS,),
+                "replace_existing_uv": ("BOOLEAN", {"default": False},),
+            },
+        }
+
+    RETURN_TYPES = (
+        "MESH",
+    )
+    RETURN_NAMES = (
+        "mesh",
+    )
+    FUNCTION = "unwrap_uv"
+    CATEGORY = "Comfy3D/Preprocessor"
+    
+    def unwrap_uv(self, mesh, uv_backend, replace_existing_uv):
+        
+        if mesh.vt is None or replace_existing_uv:
+            if mesh.vn is None:
+                mesh.auto_normal()
+            backend = mesh.resolve_uv_backend(uv_backend)
+            cstr(f"[{self.__class__.__name__}] unwrapping {mesh.f.shape[0]} faces with {backend} backend").msg.print()
+            mesh.auto_uv(backend=backend)
+        else:
+            cstr(f"[{self.__class__.__name__}] skip this node since mesh already has uv, enable replace_existing_uv to unwrap again").msg.print()
+        
+        return (mesh, )
+    
 class Convert_3DGS_To_Pointcloud:
 
     @classmethod
@@ -1121,6 +1155,8 @@ class Gaussian_Splatting_3D:
                 "points_cloud_to_initialize_gaussian": ("POINTCLOUD",),
                 "ply_to_initialize_gaussian": ("GS_PLY",),
                 "mesh_to_initialize_gaussian": ("MESH",),
+                "print_phase_timings": ("BOOLEAN", {"default": False},),
+                "initialize_colors_from_mesh": ("BOOLEAN", {"default": False},),    # seed gaussian colors from mesh_to_initialize_gaussian's vertex colors or albedo
             }
         }
 
@@ -1166,6 +1202,8 @@ class Gaussian_Splatting_3D:
         points_cloud_to_initialize_gaussian=None,
         ply_to_initialize_gaussian=None,
         mesh_to_initialize_gaussian=None,
+        print_phase_timings=False,
+        initialize_colors_from_mesh=False,
     ):
         
         gs_ply = None
@@ -1218,9 +1256,15 @@ class Gaussian_Splatting_3D:
                     else:
                         gs_init_input = mesh_to_initialize_gaussian
                     
-                    gs = GaussianSplatting3D(gs_params, gs_init_input)
+                    gs = GaussianSplatting3D(gs_params, gs_init_input, colors_from_mesh=initialize_colors_from_mesh)
                     gs.prepare_training(reference_images, reference_masks, reference_orbit_camera_poses, reference_orbit_camera_fovy)
-                    gs.training()
+                    gs.training(profile=print_phase_timings)
+                    
+                    iterations_per_second = training_iterations / gs.training_seconds
+                    cstr(f"[{self.__class__.__name__}] {training_iterations} iterations with batch size {batch_size} in {gs.training_seconds:.2f}s, {iterations_per_second:.2f} it/s").msg.print()
+                    if print_phase_timings:
+                        phase_timings = ", ".join(f"{phase} {seconds:.2f}s ({seconds / gs.training_seconds:.0%})" for phase, seconds in gs.timings.items())
+                        cstr(f"[{self.__class__.__name__}] time per phase: {phase_timings}").msg.print()
 
                     gs_ply = gs.renderer.gaussians.to_ply()
                 
@@ -1375,7 +1419,9 @@ class Load_Triplane_Gaussian_Transformers:
         ckpt_path = resume_or_download_model_from_hf(self.checkpoints_dir_abs, self.default_repo_id, model_name, self.__class__.__name__)
             
         cfg.system.weights=ckpt_path
-        tgs_model = TGS(cfg=cfg.system).to(device)
+        tgs_model = get_model_residency_manager().load(
+            (self.__class__.__name__, ckpt_path), lambda: TGS(cfg=cfg.system).to(device), size_hint=os.path.getsize(ckpt_path)
+        )
         
         cstr(f"[{self.__class__.__name__}] loaded model ckpt from {ckpt_path}").msg.print()
 
@@ -1407,24 +1453,25 @@ class Triplane_Gaussian_Transformers:
     CATEGORY = "Comfy3D/Algorithm"
     
     def run_TGS(self, reference_image, reference_mask, tgs_model, cam_dist):        
-        cfg: ExperimentConfigTGS = load_config_tgs(self.config_path_abs)
-
-        cfg.data.cond_camera_distance = cam_dist
-        cfg.data.eval_camera_distance = cam_dist
-        dataset = CustomImageOrbitDataset(reference_image, reference_mask, cfg.data)
-        dataloader = DataLoader(
-            dataset,
-            batch_size=cfg.data.eval_batch_size, 
-            shuffle=False,
-            collate_fn=dataset.collate
-        )
+        with use_model(tgs_model) as tgs_model:
+            cfg: ExperimentConfigTGS = load_config_tgs(self.config_path_abs)
+
+            cfg.data.cond_camera_distance = cam_dist
+            cfg.data.eval_camera_distance = cam_dist
+            dataset = CustomImageOrbitDataset(reference_image, reference_mask, cfg.data)
+            dataloader = DataLoader(
+                dataset,
+                batch_size=cfg.data.eval_batch_size, 
+                shuffle=False,
+                collate_fn=dataset.collate
+            )
 
-        gs_ply = []
-        for batch in dataloader:
-            batch = todevice(batch)
-            gs_ply.extend(tgs_model(batch))
+            gs_ply = []
+            for batch in dataloader:
+                batch = todevice(batch)
+                gs_ply.extend(tgs_model(batch))
         
-        return (gs_ply[0], )
+            return (gs_ply[0], )
     
 class Load_Diffusers_Pipeline:
     
@@ -1455,7 +1502,7 @@ class Load_Diffusers_Pipeline:
         
         # resume download pretrained checkpoint
         ckpt_download_dir = os.path.join(CKPT_DIFFUSERS_PATH, repo_id)
-        snapshot_download(repo_id=repo_id, local_dir=ckpt_download_dir, force_download=force_download, repo_type="model", ignore_patterns=["*.json", "*.py"])
+        resume_or_download_snapshot_from_hf(ckpt_download_dir, repo_id, self.__class__.__name__, force_download=force_download, ignore_patterns=["*.json", "*.py"])
         
         diffusers_pipeline_class = DIFFUSERS_PIPE_DICT[diffusers_pipeline_name]
         
@@ -1464,13 +1511,20 @@ class Load_Diffusers_Pipeline:
             custom_pipeline = None
             
         ckpt_path = ckpt_download_dir if not checkpoint_sub_dir else os.path.join(ckpt_download_dir, checkpoint_sub_dir)
-        pipe = diffusers_pipeline_class.from_pretrained(
-            ckpt_path,
-            torch_dtype=WEIGHT_DTYPE,
-            custom_pipeline=custom_pipeline,
-        ).to(DEVICE)
         
-        pipe.enable_xformers_memory_efficient_attention()
+        def load_pipe():
+            pipe = diffusers_pipeline_class.from_pretrained(
+                ckpt_path,
+                torch_dtype=WEIGHT_DTYPE,
+                custom_pipeline=custom_pipeline,
+            ).to(DEVICE)
+            
+            pipe.enable_xformers_memory_efficient_attention()
+            return pipe
+        
+        pipe = get_model_residency_manager().load(
+            (self.__class__.__name__, diffusers_pipeline_name, ckpt_path, custom_pipeline), load_pipe
+        )
         
         return (pipe, )
     
@@ -1497,9 +1551,16 @@ class Set_Diffusers_Pipeline_Scheduler:
 
         diffusers_scheduler_class = DIFFUSERS_SCHEDULER_DICT[diffusers_scheduler_name]
 
-        pipe.scheduler = diffusers_scheduler_class.from_config(
-            pipe.scheduler.config, timestep_spacing='trailing'
-        )
+        def set_scheduler(pipe):
+            pipe.scheduler = diffusers_scheduler_class.from_config(
+                pipe.scheduler.config, timestep_spacing='trailing'
+            )
+
+        # same as Set_Diffusers_Pipeline_State_Dict, the loaded pipe is shared so the scheduler is set on a copy of a managed pipe
+        if isinstance(pipe, ManagedModel):
+            pipe = pipe.derive((self.__class__.__name__, diffusers_scheduler_name), set_scheduler)
+        else:
+            set_scheduler(pipe)
         return (pipe, )
 
 class Set_Diffusers_Pipeline_State_Dict:
@@ -1528,10 +1589,20 @@ class Set_Diffusers_Pipeline_State_Dict:
         checkpoints_dir_abs = os.path.join(CKPT_DIFFUSERS_PATH, repo_id)
         ckpt_path = resume_or_download_model_from_hf(checkpoints_dir_abs, repo_id, model_name, self.__class__.__name__)
 
-        state_dict = torch.load(ckpt_path, map_location='cpu')
-        pipe.unet.load_state_dict(state_dict, strict=True)
-        pipe.enable_xformers_memory_efficient_attention()
-        pipe = pipe.to(DEVICE)
+        def load_unet_state_dict(pipe):
+            # into a new unet, the copy of a managed pipe shares the other components with the loaded pipe,
+            # its parameters are only placeholders replaced by the loaded tensors
+            memo = {id(param): torch.nn.Parameter(torch.empty_like(param, device="meta"), param.requires_grad) for param in pipe.unet.parameters()}
+            unet = copy.deepcopy(pipe.unet, memo)
+            load_checkpoint_into_model(unet, ckpt_path, device=pipe.unet.device, strict=True, class_name=self.__class__.__name__)
+            pipe.unet = unet
+
+        # the weights go into a copy of a managed pipe registered under its own key: the loaded pipe is shared by every workflow
+        # using the same loader inputs, and the copy replays the load whenever it is reloaded from its checkpoint
+        if isinstance(pipe, ManagedModel):
+            pipe = pipe.derive((self.__class__.__name__, ckpt_path), load_unet_state_dict)
+        else:
+            load_unet_state_dict(pipe)
 
         return (pipe, )
 
@@ -1578,51 +1649,52 @@ class Wonder3D_MVDiffusion_Model:
         num_inference_steps, 
     ):
 
-        cfg = load_config_wonder3d(self.config_path_abs)
+        with use_model(mvdiffusion_pipe) as mvdiffusion_pipe:
+            cfg = load_config_wonder3d(self.config_path_abs)
 
-        batch = self.prepare_data(reference_image, reference_mask)
+            batch = self.prepare_data(reference_image, reference_mask)
 
-        mvdiffusion_pipe.set_progress_bar_config(disable=True)
-        seed = int(seed)
-        generator = torch.Generator(device=mvdiffusion_pipe.unet.device).manual_seed(seed)
+            mvdiffusion_pipe.set_progress_bar_config(disable=True)
+            seed = int(seed)
+            generator = torch.Generator(device=mvdiffusion_pipe.unet.device).manual_seed(seed)
 
-        # repeat  (2B, Nv, 3, H, W)
-        imgs_in = torch.cat([batch['imgs_in']] * 2, dim=0).to(WEIGHT_DTYPE)
+            # repeat  (2B, Nv, 3, H, W)
+            imgs_in = torch.cat([batch['imgs_in']] * 2, dim=0).to(WEIGHT_DTYPE)
 
-        # (2B, Nv, Nce)
-        camera_embeddings = torch.cat([batch['camera_embeddings']] * 2, dim=0).to(WEIGHT_DTYPE)
+            # (2B, Nv, Nce)
+            camera_embeddings = torch.cat([batch['camera_embeddings']] * 2, dim=0).to(WEIGHT_DTYPE)
 
-        task_embeddings = torch.cat([batch['normal_task_embeddings'], batch['color_task_embeddings']], dim=0).to(WEIGHT_DTYPE)
+            task_embeddings = torch.cat([batch['normal_task_embeddings'], batch['color_task_embeddings']], dim=0).to(WEIGHT_DTYPE)
 
-        camera_embeddings = torch.cat([camera_embeddings, task_embeddings], dim=-1).to(WEIGHT_DTYPE)
+            camera_embeddings = torch.cat([camera_embeddings, task_embeddings], dim=-1).to(WEIGHT_DTYPE)
 
-        # (B*Nv, 3, H, W)
-        imgs_in = rearrange(imgs_in, "Nv C H W -> (Nv) C H W")
-        # (B*Nv, Nce)
-        # camera_embeddings = rearrange(camera_embeddings, "B Nv Nce -> (B Nv) Nce")
+            # (B*Nv, 3, H, W)
+            imgs_in = rearrange(imgs_in, "Nv C H W -> (Nv) C H W")
+            # (B*Nv, Nce)
+            # camera_embeddings = rearrange(camera_embeddings, "B Nv Nce -> (B Nv) Nce")
 
-        out = mvdiffusion_pipe(
-            imgs_in,
-            # camera_embeddings,
-            generator=generator,
-            guidance_scale=mv_guidance_scale,
-            num_inference_steps=num_inference_steps,
-            output_type='pt',
-            num_images_per_prompt=1,
-            **cfg.pipe_validation_kwargs,
-        ).images
+            out = mvdiffusion_pipe(
+                imgs_in,
+                # camera_embeddings,
+                generator=generator,
+                guidance_scale=mv_guidance_scale,
+                num_inference_steps=num_inference_steps,
+                output_type='pt',
+                num_images_per_prompt=1,
+                **cfg.pipe_validation_kwargs,
+            ).images
 
-        num_views = out.shape[0] // 2
-        # [N, 3, H, W] -> [N, H, W, 3]
-        mv_images = out[num_views:].permute(0, 2, 3, 1)
-        mv_normals = out[:num_views].permute(0, 2, 3, 1)
+            num_views = out.shape[0] // 2
+            # [N, 3, H, W] -> [N, H, W, 3]
+            mv_images = out[num_views:].permute(0, 2, 3, 1)
+            mv_normals = out[:num_views].permute(0, 2, 3, 1)
         
-        orbit_radius = [4.0] * 6
-        orbit_center = [0.0] * 6
-        orbit_elevations, orbit_azimuths = ORBITPOSE_PRESET_DICT["Wonder3D(6)"]
-        orbit_camposes = compose_orbit_camposes(orbit_radius, orbit_elevations, orbit_azimuths, orbit_center, orbit_center, orbit_center)
+            orbit_radius = [4.0] * 6
+            orbit_center = [0.0] * 6
+            orbit_elevations, orbit_azimuths = ORBITPOSE_PRESET_DICT["Wonder3D(6)"]
+            orbit_camposes = compose_orbit_camposes(orbit_radius, orbit_elevations, orbit_azimuths, orbit_center, orbit_center, orbit_center)
     
-        return (mv_images, mv_normals, orbit_camposes)
+            return (mv_images, mv_normals, orbit_camposes)
     
     def prepare_data(self, ref_image, ref_mask):
         single_image = torch_imgs_to_pils(ref_image, ref_mask)[0]
@@ -1676,27 +1748,28 @@ class MVDream_Model:
         num_inference_steps, 
         elevation,
     ):
-        if len(reference_image.shape) == 4:
-            reference_image = reference_image.squeeze(0)
-        if len(reference_mask.shape) == 3:
-            reference_mask = reference_mask.squeeze(0)
+        with use_model(mvdream_pipe) as mvdream_pipe:
+            if len(reference_image.shape) == 4:
+                reference_image = reference_image.squeeze(0)
+            if len(reference_mask.shape) == 3:
+                reference_mask = reference_mask.squeeze(0)
             
-        generator = torch.manual_seed(seed)
+            generator = torch.manual_seed(seed)
             
-        reference_mask = reference_mask.unsqueeze(2)
-        # give the white background to reference_image
-        reference_image = (reference_image * reference_mask + (1 - reference_mask)).detach().cpu().numpy()
+            reference_mask = reference_mask.unsqueeze(2)
+            # give the white background to reference_image
+            reference_image = (reference_image * reference_mask + (1 - reference_mask)).detach().cpu().numpy()
 
-        # generate multi-view images
-        mv_images = mvdream_pipe(prompt, reference_image, generator=generator, negative_prompt=prompt_neg, guidance_scale=mv_guidance_scale, num_inference_steps=num_inference_steps, elevation=elevation)
-        mv_images = torch.from_numpy(np.stack([mv_images[1], mv_images[2], mv_images[3], mv_images[0]], axis=0)).float() # [4, H, W, 3], float32
+            # generate multi-view images
+            mv_images = mvdream_pipe(prompt, reference_image, generator=generator, negative_prompt=prompt_neg, guidance_scale=mv_guidance_scale, num_inference_steps=num_inference_steps, elevation=elevation)
+            mv_images = torch.from_numpy(np.stack([mv_images[1], mv_images[2], mv_images[3], mv_images[0]], axis=0)).float() # [4, H, W, 3], float32
 
-        orbit_radius = [4.0] * 4
-        orbit_center = [0.0] * 4
-        orbit_elevations, orbit_azimuths = ORBITPOSE_PRESET_DICT["MVDream(4)"]
-        orbit_camposes = compose_orbit_camposes(orbit_radius, orbit_elevations, orbit_azimuths, orbit_center, orbit_center, orbit_center)
+            orbit_radius = [4.0] * 4
+            orbit_center = [0.0] * 4
+            orbit_elevations, orbit_azimuths = ORBITPOSE_PRESET_DICT["MVDream(4)"]
+            orbit_camposes = compose_orbit_camposes(orbit_radius, orbit_elevations, orbit_azimuths, orbit_center, orbit_center, orbit_center)
 
-        return (mv_images, orbit_camposes)
+            return (mv_images, orbit_camposes)
     
 class Load_Large_Multiview_Gaussian_Model:
     
@@ -1728,20 +1801,21 @@ class Load_Large_Multiview_Gaussian_Model:
     CATEGORY = "Comfy3D/Import|Export"
     
     def load_LGM(self, model_name, lgb_config):
-
-        lgm_model = LargeMultiviewGaussianModel(config_defaults[lgb_config])
         
         ckpt_path = resume_or_download_model_from_hf(self.checkpoints_dir_abs, self.default_repo_id, model_name, self.__class__.__name__)
-            
-        if ckpt_path.endswith('safetensors'):
-            ckpt = load_file(ckpt_path, device='cpu')
-        else:
-            ckpt = torch.load(ckpt_path, map_location='cpu')
-
-        lgm_model.load_state_dict(ckpt, strict=False)
+        
+        def load_model():
+            lgm_model = LargeMultiviewGaussianModel(config_defaults[lgb_config])
+                
+            load_checkpoint_into_model(lgm_model, ckpt_path, device=DEVICE, dtype=torch.float16, strict=False, class_name=self.__class__.__name__)
 
-        lgm_model = lgm_model.half().to(DEVICE)
-        lgm_model.eval()
+            lgm_model = lgm_model.half().to(DEVICE)
+            lgm_model.eval()
+            return lgm_model
+        
+        lgm_model = get_model_residency_manager().load(
+            (self.__class__.__name__, ckpt_path, lgb_config), load_model, size_hint=os.path.getsize(ckpt_path)
+        )
         
         cstr(f"[{self.__class__.__name__}] loaded model ckpt from {ckpt_path}").msg.print()
         
@@ -1772,19 +1846,20 @@ class Large_Multiview_Gaussian_Model:
     
     @torch.no_grad()
     def run_LGM(self, multiview_images, lgm_model):
-        ref_image_torch = prepare_torch_img(multiview_images, lgm_model.opt.input_size, lgm_model.opt.input_size, DEVICE_STR) # [4, 3, 256, 256]
-        ref_image_torch = TF.normalize(ref_image_torch, IMAGENET_DEFAULT_MEAN, IMAGENET_DEFAULT_STD)
-        rays_embeddings = lgm_model.prepare_default_rays(DEVICE_STR)
-        ref_image_torch = torch.cat([ref_image_torch, rays_embeddings], dim=1).unsqueeze(0) # [1, 4, 9, 256, 256]
-        
-        with torch.autocast(device_type=DEVICE_STR, dtype=WEIGHT_DTYPE):
-            # generate gaussians
-            gaussians = lgm_model.forward_gaussians(ref_image_torch)
-        
-        # convert gaussians to ply
-        gs_ply = lgm_model.gs.to_ply(gaussians)
+        with use_model(lgm_model) as lgm_model:
+            ref_image_torch = prepare_torch_img(multiview_images, lgm_model.opt.input_size, lgm_model.opt.input_size, DEVICE_STR) # [4, 3, 256, 256]
+            ref_image_torch = TF.normalize(ref_image_torch, IMAGENET_DEFAULT_MEAN, IMAGENET_DEFAULT_STD)
+            rays_embeddings = lgm_model.prepare_default_rays(DEVICE_STR)
+            ref_image_torch = torch.cat([ref_image_torch, rays_embeddings], dim=1).unsqueeze(0) # [1, 4, 9, 256, 256]
+        
+            with torch.autocast(device_type=DEVICE_STR, dtype=WEIGHT_DTYPE):
+                # generate gaussians
+                gaussians = lgm_model.forward_gaussians(ref_image_torch)
+        
+            # convert gaussians to ply
+            gs_ply = lgm_model.gs.to_ply(gaussians)
             
-        return (gs_ply, )
+            return (gs_ply, )
     
 class Convert_3DGS_to_Mesh_with_NeRF_and_Marching_Cubes:
 
@@ -1807,6 +1882,9 @@ class Convert_3DGS_to_Mesh_with_NeRF_and_Marching_Cubes:
                 "texture_resolution": ("INT", {"default": 1024, "min": 128, "max": 8192}),
                 "force_cuda_rast": ("BOOLEAN", {"default": False}),
             },
+            "optional": {
+                "marching_cude_coarse_block_size": ("INT", {"default": 0, "min": 0, "max": 64}),  # 0: query the dense grid
+            }
         }
 
     RETURN_TYPES = (
@@ -1838,6 +1916,7 @@ class Convert_3DGS_to_Mesh_with_NeRF_and_Marching_Cubes:
         training_albedo_resolution,
         texture_resolution,
         force_cuda_rast,
+        marching_cude_coarse_block_size=0,
     ):
         with torch.inference_mode(False):
             chosen_config = config_defaults[gs_config]
@@ -1846,7 +1925,8 @@ class Convert_3DGS_to_Mesh_with_NeRF_and_Marching_Cubes:
             imgs, alphas = converter.fit_nerf(training_nerf_iterations, training_nerf_resolution)
             converter.fit_mesh(
                 training_mesh_iterations, remesh_after_n_iteration, training_mesh_resolution, 
-                marching_cude_grids_resolution, marching_cude_grids_batch_size, marching_cude_threshold
+                marching_cude_grids_resolution, marching_cude_grids_batch_size, marching_cude_threshold, 
+                coarse_block_size=marching_cude_coarse_block_size
             )
             converter.fit_mesh_uv(training_albedo_iterations, training_albedo_resolution, texture_resolution)
         
@@ -1886,13 +1966,20 @@ class Load_TripoSR_Model:
         
         ckpt_path = resume_or_download_model_from_hf(self.checkpoints_dir_abs, self.default_repo_id, model_name, self.__class__.__name__)
 
-        tsr_model = TSR.from_pretrained(
-            weight_path=ckpt_path,
-            config_path=self.config_path_abs
-        )
+        def load_model():
+            tsr_model = TSR.from_pretrained(
+                weight_path=ckpt_path,
+                config_path=self.config_path_abs
+            )
+            
+            tsr_model.to(DEVICE)
+            return tsr_model
         
-        tsr_model.renderer.set_chunk_size(chunk_size)
-        tsr_model.to(DEVICE)
+        tsr_model = get_model_residency_manager().load(
+            (self.__class__.__name__, ckpt_path), load_model, size_hint=os.path.getsize(ckpt_path)
+        )
+        # the chunk size only changes how the renderer batches its queries, loaders with any chunk size share the model
+        tsr_model = ConfiguredModel(tsr_model, lambda tsr_model: tsr_model.renderer.set_chunk_size(chunk_size))
         
         cstr(f"[{self.__class__.__name__}] loaded model ckpt from {ckpt_path}").msg.print()
         
@@ -1909,6 +1996,11 @@ class TripoSR:
                 "reference_mask": ("MASK",),
                 "geometry_extract_resolution": ("INT", {"default": 256, "min": 1, "max": 0xffffffffffffffff}),
                 "marching_cude_threshold": ("FLOAT", {"default": 25.0, "min": 0.0, "step": 0.01}),
+            },
+            "optional": {
+                "micro_batch_size": ("INT", {"default": 0, "min": 0, "max": 256}),  # 0: sized from free GPU memory
+                "marching_cubes_workers": ("INT", {"default": 0, "min": 0, "max": 32}),  # 0: run marching cubes in-process, otherwise worker processes forked from a fork server, which imports ComfyUI's main.py once (linux/macOS only)
+                "marching_cude_coarse_block_size": ("INT", {"default": 0, "min": 0, "max": 64}),  # 0: query the dense grid
             }
         }
 
@@ -1918,34 +2010,37 @@ class TripoSR:
     RETURN_NAMES = (
         "mesh",
     )
+    OUTPUT_IS_LIST = (
+        True,
+    )
     
     FUNCTION = "run_TSR"
     CATEGORY = "Comfy3D/Algorithm"
 
     @torch.no_grad()
-    def run_TSR(self, tsr_model, reference_image, reference_mask, geometry_extract_resolution, marching_cude_threshold):
-        mesh = None
-        
-        image = reference_image[0]
-        mask = reference_mask[0].unsqueeze(2)
-        image = torch.cat((image, mask), dim=2).detach().cpu().numpy()
-        
-        image = Image.fromarray(np.clip(255. * image, 0, 255).astype(np.uint8))
-        image = self.fill_background(image)
-        image = image.convert('RGB')
-        
-        scene_codes = tsr_model([image], DEVICE)
-        meshes = tsr_model.extract_mesh(scene_codes, resolution=geometry_extract_resolution, threshold=marching_cude_threshold)
-        mesh = Mesh.load_trimesh(given_mesh=meshes[0])
+    def run_TSR(self, tsr_model, reference_image, reference_mask, geometry_extract_resolution, marching_cude_threshold, micro_batch_size=0, marching_cubes_workers=0, marching_cude_coarse_block_size=0):
+        with use_model(tsr_model) as tsr_model:
+            # one mesh per image of the batch, a single mask is shared by all images
+            if reference_mask.shape[0] != reference_image.shape[0]:
+                reference_mask = reference_mask[:1].expand(reference_image.shape[0], -1, -1)
+            images = self.fill_background(reference_image, reference_mask)
+        
+            scene_codes = tsr_model.forward_batched(images, DEVICE, micro_batch_size)
+            meshes = tsr_model.extract_mesh(
+                scene_codes, resolution=geometry_extract_resolution, threshold=marching_cude_threshold, 
+                marching_cubes_workers=marching_cubes_workers, coarse_block_size=marching_cude_coarse_block_size
+            )
+            meshes = [Mesh.load_trimesh(given_mesh=mesh) for mesh in meshes]
 
-        return (mesh,)
+            return (meshes,)
     
     # Default model are trained on images with this background 
-    def fill_background(self, image):
-        image = np.array(image).astype(np.float32) / 255.0
-        image = image[:, :, :3] * image[:, :, 3:4] + (1 - image[:, :, 3:4]) * 0.5
-        image = Image.fromarray((image * 255.0).astype(np.uint8))
-        return image
+    def fill_background(self, images, masks):
+        # [N, H, W, 3], [N, H, W] in [0, 1] -> [N, H, W, 3], quantized to 8 bits like the former RGBA -> RGB PIL round trip
+        images = torch.cat((images, masks.unsqueeze(3)), dim=3).cpu()
+        images = (255. * images).clamp(0, 255).to(torch.uint8).float() / 255.0
+        images = images[..., :3] * images[..., 3:4] + (1 - images[..., 3:4]) * 0.5
+        return (images * 255.0).to(torch.uint8).float() / 255.0
     
 class Load_SF3D_Model:
     checkpoints_dir = "StableFast3D"
@@ -1980,13 +2075,19 @@ class Load_SF3D_Model:
         
         ckpt_path = resume_or_download_model_from_hf(self.checkpoints_dir_abs, self.default_repo_id, model_name, self.__class__.__name__)
 
-        sf3d_model = SF3D.from_pretrained(
-            config_path=self.config_path_abs,
-            weight_path=ckpt_path
-        )
+        def load_model():
+            sf3d_model = SF3D.from_pretrained(
+                config_path=self.config_path_abs,
+                weight_path=ckpt_path
+            )
+            
+            sf3d_model.eval()
+            sf3d_model.to(DEVICE)
+            return sf3d_model
         
-        sf3d_model.eval()
-        sf3d_model.to(DEVICE)
+        sf3d_model = get_model_residency_manager().load(
+            (self.__class__.__name__, ckpt_path), load_model, size_hint=os.path.getsize(ckpt_path)
+        )
         
         cstr(f"[{self.__class__.__name__}] loaded model ckpt from {ckpt_path}").msg.print()
         
@@ -2018,20 +2119,24 @@ class StableFast3D:
 
     @torch.no_grad()
     def run_SF3D(self, sf3d_model, reference_image, reference_mask, texture_resolution, remesh_option):
-        single_image = torch_imgs_to_pils(reference_image, reference_mask)[0]
+        with use_model(sf3d_model) as sf3d_model:
+            single_image = torch_imgs_to_rgba(reference_image[:1], reference_mask[:1]).to(DEVICE)
         
-        with torch.autocast(device_type=DEVICE_STR, dtype=WEIGHT_DTYPE):
             model_batch = self.create_batch(single_image)
-            model_batch = {k: v.cuda() for k, v in model_batch.items()}
-            trimesh_mesh, _ = sf3d_model.generate_mesh(
-                model_batch, texture_resolution, remesh_option
-            )
-        mesh = Mesh.load_trimesh(given_mesh=trimesh_mesh[0])
+            with torch.autocast(device_type=DEVICE_STR, dtype=WEIGHT_DTYPE):
+                model_batch = {k: v.cuda() for k, v in model_batch.items()}
+                trimesh_mesh, _ = sf3d_model.generate_mesh(
+                    model_batch, texture_resolution, remesh_option
+                )
+            mesh = Mesh.load_trimesh(given_mesh=trimesh_mesh[0])
 
-        return (mesh,)
+            return (mesh,)
     
     # Default model are trained on images with this background 
-    def create_batch(self, input_image: Image):
+    def create_batch(self, input_image: torch.Tensor):
+        """
+            input_image (torch): [1, H, W, 4] RGBA in [0, 1]
+        """
         COND_WIDTH = 512
         COND_HEIGHT = 512
         COND_DISTANCE = 1.6
@@ -2044,17 +2149,18 @@ class StableFast3D:
             COND_FOVY_DEG, COND_HEIGHT, COND_WIDTH
         )
         
+        # same bicubic filter on alpha premultiplied colors as PIL resize, without leaving the device
+        img_cond = input_image[0].float()
+        img_cond = torch.cat((img_cond[:, :, :3] * img_cond[:, :, -1:], img_cond[:, :, -1:]), dim=-1).permute(2, 0, 1).unsqueeze(0)
         img_cond = (
-            torch.from_numpy(
-                np.asarray(input_image.resize((COND_WIDTH, COND_HEIGHT))).astype(np.float32)
-                / 255.0
-            )
-            .float()
+            F.interpolate(img_cond, (COND_HEIGHT, COND_WIDTH), mode="bicubic", align_corners=False, antialias=True)[0]
+            .permute(1, 2, 0)
             .clip(0, 1)
         )
         mask_cond = img_cond[:, :, -1:]
+        img_cond = torch.cat((img_cond[:, :, :3] / mask_cond.clamp(min=1e-6), mask_cond), dim=-1).clip(0, 1)
         rgb_cond = torch.lerp(
-            torch.tensor(BACKGROUND_COLOR)[None, None, :], img_cond[:, :, :3], mask_cond
+            torch.tensor(BACKGROUND_COLOR, device=img_cond.device)[None, None, :], img_cond[:, :, :3], mask_cond
         )
 
         batch_elem = {
@@ -2112,14 +2218,19 @@ class Load_CRM_MVDiffusion_Model:
         ckpt_path = resume_or_download_model_from_hf(self.checkpoints_dir_abs, self.default_repo_id, model_name, self.__class__.__name__)
             
         crm_config = OmegaConf.load(crm_config_path)
-
-        crm_mvdiffusion_model = instantiate_from_config(crm_config.model)
-        crm_mvdiffusion_model.load_state_dict(torch.load(ckpt_path, map_location="cpu"), strict=False)
-        crm_mvdiffusion_model = crm_mvdiffusion_model.to(DEVICE).to(WEIGHT_DTYPE)
-        crm_mvdiffusion_model.device = DEVICE
         
-        crm_mvdiffusion_sampler = get_obj_from_str(crm_config.sampler.target)(
-            crm_mvdiffusion_model, device=DEVICE, dtype=WEIGHT_DTYPE, **crm_config.sampler.params
+        def load_sampler():
+            crm_mvdiffusion_model = instantiate_from_config(crm_config.model)
+            load_checkpoint_into_model(crm_mvdiffusion_model, ckpt_path, device=DEVICE, dtype=WEIGHT_DTYPE, strict=False, class_name=self.__class__.__name__)
+            crm_mvdiffusion_model = crm_mvdiffusion_model.to(DEVICE).to(WEIGHT_DTYPE)
+            crm_mvdiffusion_model.device = DEVICE
+            
+            return get_obj_from_str(crm_config.sampler.target)(
+                crm_mvdiffusion_model, device=DEVICE, dtype=WEIGHT_DTYPE, **crm_config.sampler.params
+            )
+        
+        crm_mvdiffusion_sampler = get_model_residency_manager().load(
+            (self.__class__.__name__, ckpt_path, crm_config_path), load_sampler, size_hint=os.path.getsize(ckpt_path)
         )
         
         cstr(f"[{self.__class__.__name__}] loaded model ckpt from {ckpt_path}").msg.print()
@@ -2172,25 +2283,28 @@ class CRM_Images_MVDiffusion_Model:
         mv_guidance_scale, 
         num_inference_steps, 
     ):
-        pixel_img = torch_imgs_to_pils(reference_image, reference_mask)[0]
-        pixel_img = CRMSampler.process_pixel_img(pixel_img)
-        
-        multiview_images = CRMSampler.stage1_sample(
-            crm_mvdiffusion_sampler,
-            pixel_img,
-            prompt,
-            prompt_neg,
-            seed,
-            mv_guidance_scale, 
-            num_inference_steps
-        ).to(dtype=reference_image.dtype, device=reference_image.device)
-
-        orbit_radius = [4.0] * 6
-        orbit_center = [0.0] * 6
-        orbit_elevations, orbit_azimuths = ORBITPOSE_PRESET_DICT["CRM(6)"]
-        orbit_camposes = compose_orbit_camposes(orbit_radius, orbit_elevations, orbit_azimuths, orbit_center, orbit_center, orbit_center)
-        
-        return (multiview_images, orbit_camposes)
+        with use_model(crm_mvdiffusion_sampler) as crm_mvdiffusion_sampler:
+            # expand to 1:1 square over the fixed background color of CRMSampler.process_pixel_img, the sampler transforms take PIL
+            pixel_img = torch_imgs_add_bg(reference_image[:1], reference_mask[:1], (127 / 255,) * 3)
+            pixel_img = torch_imgs_pad_to_square(pixel_img, 127 / 255)
+            pixel_img = torch_imgs_to_pils(pixel_img)[0]
+        
+            multiview_images = CRMSampler.stage1_sample(
+                crm_mvdiffusion_sampler,
+                pixel_img,
+                prompt,
+                prompt_neg,
+                seed,
+                mv_guidance_scale, 
+                num_inference_steps
+            ).to(dtype=reference_image.dtype, device=reference_image.device)
+
+            orbit_radius = [4.0] * 6
+            orbit_center = [0.0] * 6
+            orbit_elevations, orbit_azimuths = ORBITPOSE_PRESET_DICT["CRM(6)"]
+            orbit_camposes = compose_orbit_camposes(orbit_radius, orbit_elevations, orbit_azimuths, orbit_center, orbit_center, orbit_center)
+        
+            return (multiview_images, orbit_camposes)
     
 class CRM_CCMs_MVDiffusion_Model:
     
@@ -2238,21 +2352,22 @@ class CRM_CCMs_MVDiffusion_Model:
         mv_guidance_scale, 
         num_inference_steps, 
     ):
-        pixel_img = torch_imgs_to_pils(reference_image, reference_mask)[0]
-        pixel_img = CRMSampler.process_pixel_img(pixel_img)
-        
-        multiview_CCMs = CRMSampler.stage2_sample(
-            crm_mvdiffusion_sampler,
-            pixel_img,
-            multiview_images,
-            prompt,
-            prompt_neg,
-            seed,
-            mv_guidance_scale, 
-            num_inference_steps
-        )
+        with use_model(crm_mvdiffusion_sampler) as crm_mvdiffusion_sampler:
+            pixel_img = torch_imgs_to_pils(reference_image, reference_mask)[0]
+            pixel_img = CRMSampler.process_pixel_img(pixel_img)
+        
+            multiview_CCMs = CRMSampler.stage2_sample(
+                crm_mvdiffusion_sampler,
+                pixel_img,
+                multiview_images,
+                prompt,
+                prompt_neg,
+                seed,
+                mv_guidance_scale, 
+                num_inference_steps
+            )
         
-        return(multiview_CCMs, )
+            return(multiview_CCMs, )
     
 class Load_Convolutional_Reconstruction_Model:
     checkpoints_dir = "CRM"
@@ -2288,8 +2403,15 @@ class Load_Convolutional_Reconstruction_Model:
         ckpt_path = resume_or_download_model_from_hf(self.checkpoints_dir_abs, self.default_repo_id, model_name, self.__class__.__name__)
         
         crm_conf = json.load(open(self.config_path_abs))
-        crm_model = ConvolutionalReconstructionModel(crm_conf).to(DEVICE)
-        crm_model.load_state_dict(torch.load(ckpt_path, map_location="cpu"), strict=False)
+        
+        def load_model():
+            crm_model = ConvolutionalReconstructionModel(crm_conf).to(DEVICE)
+            load_checkpoint_into_model(crm_model, ckpt_path, strict=False, class_name=self.__class__.__name__)
+            return crm_model
+        
+        crm_model = get_model_residency_manager().load(
+            (self.__class__.__name__, ckpt_path), load_model, size_hint=os.path.getsize(ckpt_path)
+        )
         
         cstr(f"[{self.__class__.__name__}] loaded model ckpt from {ckpt_path}").msg.print()
         
@@ -2320,12 +2442,13 @@ class Convolutional_Reconstruction_Model:
     @torch.no_grad()
     def run_CRM(self, crm_model, multiview_images, multiview_CCMs):
 
-        np_imgs = np.concatenate(multiview_images.cpu().numpy(), 1) # (256, 256*6==1536, 3)
-        np_xyzs = np.concatenate(multiview_CCMs.cpu().numpy(), 1) # (256, 1536, 3)
+        with use_model(crm_model) as crm_model:
+            np_imgs = np.concatenate(multiview_images.cpu().numpy(), 1) # (256, 256*6==1536, 3)
+            np_xyzs = np.concatenate(multiview_CCMs.cpu().numpy(), 1) # (256, 1536, 3)
         
-        mesh = CRMSampler.generate3d(crm_model, np_imgs, np_xyzs, DEVICE)
+            mesh = CRMSampler.generate3d(crm_model, np_imgs, np_xyzs, DEVICE)
         
-        return (mesh,)
+            return (mesh,)
     
 class Zero123Plus_Diffusion_Model:
     
@@ -2364,30 +2487,30 @@ class Zero123Plus_Diffusion_Model:
         num_inference_steps,
     ):
         
-        single_image = torch_imgs_to_pils(reference_image, reference_mask)[0]
+        with use_model(zero123plus_pipe) as zero123plus_pipe:
+            single_image = torch_imgs_to_pils(reference_image, reference_mask)[0]
 
-        seed = int(seed)
-        generator = torch.Generator(device=zero123plus_pipe.unet.device).manual_seed(seed)
-
-        # sampling
-        output_image = zero123plus_pipe(
-            single_image, 
-            generator=generator,
-            guidance_scale=guidance_scale,
-            num_inference_steps=num_inference_steps, 
-        ).images[0]
-
-        multiview_images = np.asarray(output_image, dtype=np.float32) / 255.0
-        multiview_images = torch.from_numpy(multiview_images).permute(2, 0, 1).contiguous()     # (3, 960, 640)
-        multiview_images = rearrange(multiview_images, 'c (n h) (m w) -> (n m) h w c', n=3, m=2)        # (6, 320, 320, 3)
-        multiview_images = multiview_images.to(dtype=reference_image.dtype, device=reference_image.device)
-
-        orbit_radius = [4.0] * 6
-        orbit_center = [0.0] * 6
-        orbit_elevations, orbit_azimuths = ORBITPOSE_PRESET_DICT["Zero123Plus(6)"]
-        orbit_camposes = compose_orbit_camposes(orbit_radius, orbit_elevations, orbit_azimuths, orbit_center, orbit_center, orbit_center)
+            seed = int(seed)
+            generator = torch.Generator(device=zero123plus_pipe.unet.device).manual_seed(seed)
 
-        return (multiview_images, orbit_camposes)
+            # sampling
+            output_image = zero123plus_pipe(
+                single_image, 
+                generator=generator,
+                guidance_scale=guidance_scale,
+                num_inference_steps=num_inference_steps, 
+                output_type="pt",
+            ).images[0]     # (3, 960, 640) in [0, 1], stays on device
+
+            multiview_images = rearrange(output_image, 'c (n h) (m w) -> (n m) h w c', n=3, m=2)        # (6, 320, 320, 3)
+            multiview_images = multiview_images.to(dtype=reference_image.dtype, device=reference_image.device)
+
+            orbit_radius = [4.0] * 6
+            orbit_center = [0.0] * 6
+            orbit_elevations, orbit_azimuths = ORBITPOSE_PRESET_DICT["Zero123Plus(6)"]
+            orbit_camposes = compose_orbit_camposes(orbit_radius, orbit_elevations, orbit_azimuths, orbit_center, orbit_center, orbit_center)
+
+            return (multiview_images, orbit_camposes)
     
 class Load_InstantMesh_Reconstruction_Model:
     checkpoints_dir = "InstantMesh"
@@ -2429,17 +2552,23 @@ class Load_InstantMesh_Reconstruction_Model:
         config_path = os.path.join(self.config_root_path_abs, config_name)
         config = OmegaConf.load(config_path)
 
-        lrm_model = instantiate_from_config(config.model_config)
         ckpt_path = resume_or_download_model_from_hf(self.checkpoints_dir_abs, self.default_repo_id, model_name, self.__class__.__name__)
+        
+        def load_model():
+            lrm_model = instantiate_from_config(config.model_config)
 
-        state_dict = torch.load(ckpt_path, map_location='cpu')['state_dict']
-        state_dict = {k[14:]: v for k, v in state_dict.items() if k.startswith('lrm_generator.')}
-        lrm_model.load_state_dict(state_dict, strict=True)
+            load_checkpoint_into_model(
+                lrm_model, ckpt_path, device=DEVICE, state_dict_key='state_dict', prefix='lrm_generator.', strict=True, class_name=self.__class__.__name__
+            )
 
-        lrm_model = lrm_model.to(DEVICE)
-        if is_flexicubes:
-            lrm_model.init_flexicubes_geometry(DEVICE, fovy=30.0)
-        lrm_model = lrm_model.eval()
+            lrm_model = lrm_model.to(DEVICE)
+            if is_flexicubes:
+                lrm_model.init_flexicubes_geometry(DEVICE, fovy=30.0)
+            return lrm_model.eval()
+        
+        lrm_model = get_model_residency_manager().load(
+            (self.__class__.__name__, ckpt_path), load_model, size_hint=os.path.getsize(ckpt_path)
+        )
         
         cstr(f"[{self.__class__.__name__}] loaded model ckpt from {ckpt_path}").msg.print()
 
@@ -2472,33 +2601,34 @@ class InstantMesh_Reconstruction_Model:
     @torch.no_grad()
     def run_LRM(self, lrm_model, multiview_images, orbit_camera_poses, orbit_camera_fovy, texture_resolution):
 
-        images = multiview_images.permute(0, 3, 1, 2).unsqueeze(0).to(DEVICE)   # [N, H, W, 3] -> [1, N, 3, H, W]
-        images = v2.functional.resize(images, 320, interpolation=3, antialias=True).clamp(0, 1)
-
-        # convert camera format from orbit to lrm inputs
-        azimuths, elevations, radius = [], [], []
-        for i in range(len(orbit_camera_poses)):
-            azimuths.append(orbit_camera_poses[i][2])
-            elevations.append(orbit_camera_poses[i][1])
-            radius.append(orbit_camera_poses[i][0])
-        input_cameras = oribt_camera_poses_to_input_cameras(azimuths, elevations, radius=radius, fov=orbit_camera_fovy).to(DEVICE)
-
-        # get triplane
-        planes = lrm_model.forward_planes(images, input_cameras)
-
-        # get mesh
-        mesh_out = lrm_model.extract_mesh(
-            planes,
-            use_texture_map=True,
-            texture_resolution=texture_resolution,
-        )
+        with use_model(lrm_model) as lrm_model:
+            images = multiview_images.permute(0, 3, 1, 2).unsqueeze(0).to(DEVICE)   # [N, H, W, 3] -> [1, N, 3, H, W]
+            images = v2.functional.resize(images, 320, interpolation=3, antialias=True).clamp(0, 1)
+
+            # convert camera format from orbit to lrm inputs
+            azimuths, elevations, radius = [], [], []
+            for i in range(len(orbit_camera_poses)):
+                azimuths.append(orbit_camera_poses[i][2])
+                elevations.append(orbit_camera_poses[i][1])
+                radius.append(orbit_camera_poses[i][0])
+            input_cameras = oribt_camera_poses_to_input_cameras(azimuths, elevations, radius=radius, fov=orbit_camera_fovy).to(DEVICE)
+
+            # get triplane
+            planes = lrm_model.forward_planes(images, input_cameras)
+
+            # get mesh
+            mesh_out = lrm_model.extract_mesh(
+                planes,
+                use_texture_map=True,
+                texture_resolution=texture_resolution,
+            )
 
-        vertices, faces, uvs, mesh_tex_idx, tex_map = mesh_out
-        tex_map = troch_image_dilate(tex_map.permute(1, 2, 0))  # [3, H, W] -> [H, W, 3]
+            vertices, faces, uvs, mesh_tex_idx, tex_map = mesh_out
+            tex_map = troch_image_dilate(tex_map.permute(1, 2, 0))  # [3, H, W] -> [H, W, 3]
         
-        mesh = Mesh(v=vertices, f=faces, vt=uvs, ft=mesh_tex_idx, albedo=tex_map, device=DEVICE)
-        mesh.auto_normal()
-        return (mesh,)
+            mesh = Mesh(v=vertices, f=faces, vt=uvs, ft=mesh_tex_idx, albedo=tex_map, device=DEVICE)
+            mesh.auto_normal()
+            return (mesh,)
 
 class Era3D_MVDiffusion_Model:
     
@@ -2546,57 +2676,58 @@ class Era3D_MVDiffusion_Model:
         eta,
         radius,
     ):
-        cfg = load_config_era3d(self.config_path_abs)
-        
-        single_image = torch_imgs_to_pils(reference_image, reference_mask)[0]
-
-        # Get the dataset
-        cfg.dataset.prompt_embeds_path = os.path.join(ROOT_PATH, cfg.dataset.prompt_embeds_path)
-        dataset = Era3DSingleImageDataset(
-            single_image=single_image,
-            crop_size=image_crop_size,
-            dtype=WEIGHT_DTYPE,
-            **cfg.dataset
-        )
+        with use_model(era3d_pipe) as era3d_pipe:
+            cfg = load_config_era3d(self.config_path_abs)
+        
+            single_image = torch_imgs_to_pils(reference_image, reference_mask)[0]
+
+            # Get the dataset
+            cfg.dataset.prompt_embeds_path = os.path.join(ROOT_PATH, cfg.dataset.prompt_embeds_path)
+            dataset = Era3DSingleImageDataset(
+                single_image=single_image,
+                crop_size=image_crop_size,
+                dtype=WEIGHT_DTYPE,
+                **cfg.dataset
+            )
 
-        # Get input data
-        img_batch = dataset.__getitem__(0)
+            # Get input data
+            img_batch = dataset.__getitem__(0)
 
-        imgs_in = torch.cat([img_batch['imgs_in']]*2, dim=0).to(DEVICE, dtype=WEIGHT_DTYPE)    # (B*Nv, 3, H, W) B==1
-        #num_views = imgs_in.shape[1]
+            imgs_in = torch.cat([img_batch['imgs_in']]*2, dim=0).to(DEVICE, dtype=WEIGHT_DTYPE)    # (B*Nv, 3, H, W) B==1
+            #num_views = imgs_in.shape[1]
 
-        normal_prompt_embeddings, clr_prompt_embeddings = img_batch['normal_prompt_embeddings'], img_batch['color_prompt_embeddings'] 
-        prompt_embeddings = torch.cat([normal_prompt_embeddings, clr_prompt_embeddings], dim=0).to(DEVICE, dtype=WEIGHT_DTYPE)    # (B*Nv, N, C) B==1
+            normal_prompt_embeddings, clr_prompt_embeddings = img_batch['normal_prompt_embeddings'], img_batch['color_prompt_embeddings'] 
+            prompt_embeddings = torch.cat([normal_prompt_embeddings, clr_prompt_embeddings], dim=0).to(DEVICE, dtype=WEIGHT_DTYPE)    # (B*Nv, N, C) B==1
 
-        generator = torch.Generator(device=era3d_pipe.unet.device).manual_seed(seed)
+            generator = torch.Generator(device=era3d_pipe.unet.device).manual_seed(seed)
 
-        # sampling
-        with torch.autocast(DEVICE_STR):
-            unet_out = era3d_pipe(
-                imgs_in, None, prompt_embeds=prompt_embeddings,
-                generator=generator, guidance_scale=guidance_scale, output_type='pt', num_images_per_prompt=1, 
-                num_inference_steps=num_inference_steps, eta=eta
-            )
+            # sampling
+            with torch.autocast(DEVICE_STR):
+                unet_out = era3d_pipe(
+                    imgs_in, None, prompt_embeds=prompt_embeddings,
+                    generator=generator, guidance_scale=guidance_scale, output_type='pt', num_images_per_prompt=1, 
+                    num_inference_steps=num_inference_steps, eta=eta
+                )
         
-        out = unet_out.images
-        bsz = out.shape[0] // 2
+            out = unet_out.images
+            bsz = out.shape[0] // 2
 
-        # (1, 3, 512, 512)
-        normals_pred = out[:bsz]    
-        images_pred = out[bsz:] 
+            # (1, 3, 512, 512)
+            normals_pred = out[:bsz]    
+            images_pred = out[bsz:] 
         
-        # [N, 3, H, W] -> [N, H, W, 3]
-        multiview_images = images_pred.permute(0, 2, 3, 1).to(reference_image.dtype, dtype=reference_image.device)   
-        multiview_normals = normals_pred.permute(0, 2, 3, 1).to(reference_image.dtype, dtype=reference_image.device)
+            # [N, 3, H, W] -> [N, H, W, 3]
+            multiview_images = images_pred.permute(0, 2, 3, 1).to(reference_image.dtype, dtype=reference_image.device)   
+            multiview_normals = normals_pred.permute(0, 2, 3, 1).to(reference_image.dtype, dtype=reference_image.device)
         
-        azimuths = [0, 45, 90, 180, -90, -45]
-        elevations = [0.0] * 6
-        radius = [radius] * 6
-        center = [0.0] * 6
+            azimuths = [0, 45, 90, 180, -90, -45]
+            elevations = [0.0] * 6
+            radius = [radius] * 6
+            center = [0.0] * 6
 
-        orbit_camposes = [azimuths, elevations, radius, center, center, center]
+            orbit_camposes = [azimuths, elevations, radius, center, center, center]
 
-        return (multiview_images, multiview_normals, orbit_camposes)
+            return (multiview_images, multiview_normals, orbit_camposes)
     
 class Instant_NGP:
     
@@ -2617,6 +2748,10 @@ class Instant_NGP:
                 "background_color": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 1.0, "step": 0.001}),
                 "force_cuda_rast": ("BOOLEAN", {"default": False}),
             },
+            "optional": {
+                "marching_cude_coarse_block_size": ("INT", {"default": 0, "min": 0, "max": 64}),  # 0: query the dense grid
+                "uv_backend": (UV_BACKENDS,),
+            }
         }
 
     RETURN_TYPES = (
@@ -2641,7 +2776,9 @@ class Instant_NGP:
         marching_cude_threshold,
         texture_resolution,
         background_color,
-        force_cuda_rast
+        force_cuda_rast,
+        marching_cude_coarse_block_size=0,
+        uv_backend="xatlas",
     ):
         with torch.inference_mode(False):
             
@@ -2649,14 +2786,17 @@ class Instant_NGP:
             ngp.prepare_training(reference_image, reference_mask, reference_orbit_camera_poses, reference_orbit_camera_fovy)
             ngp.fit_nerf(training_iterations, background_color)
             
-            vertices, triangles = marching_cubes_density_to_mesh(ngp.get_density, marching_cude_grids_resolution, marching_cude_grids_batch_size, marching_cude_threshold)
+            vertices, triangles = marching_cubes_density_to_mesh(
+                ngp.get_density, marching_cude_grids_resolution, marching_cude_grids_batch_size, marching_cude_threshold, 
+                coarse_block_size=marching_cude_coarse_block_size
+            )
 
             v = torch.from_numpy(vertices).contiguous().float().to(DEVICE)
             f = torch.from_numpy(triangles).contiguous().int().to(DEVICE)
 
             mesh = Mesh(v=v, f=f, device=DEVICE)
             mesh.auto_normal()
-            mesh.auto_uv()
+            mesh.auto_uv(backend=uv_backend)
             
             mesh.albedo = color_func_to_albedo(mesh, ngp.get_color, texture_resolution, device=DEVICE, force_cuda_rast=force_cuda_rast)
             
@@ -2688,6 +2828,10 @@ class FlexiCubes_MVS:
             },
             "optional": {
                 "reference_normal_maps": ("IMAGE",), 
+                "sparse_grid": ("BOOLEAN", {"default": False}),    # only optimize cubes near the surface and grow the grid coarse-to-fine, for resolutions up to 256-384
+                "coarse_grids_resolution": ("INT", {"default": 64, "min": 8, "max": 0xffffffffffffffff}),
+                "band_update_interval": ("INT", {"default": 100, "min": 1, "max": 0xffffffffffffffff}),
+                "band_width": ("INT", {"default": 2, "min": 1, "max": 16}),
             }
         }
 
@@ -2719,7 +2863,11 @@ class FlexiCubes_MVS:
         remove_floaters_weight,
         cube_stabilizer_weight,
         force_cuda_rast,
-        reference_normal_maps=None
+        reference_normal_maps=None,
+        sparse_grid=False,
+        coarse_grids_resolution=64,
+        band_update_interval=100,
+        band_width=2,
     ):
         
         with torch.inference_mode(False):
@@ -2738,6 +2886,10 @@ class FlexiCubes_MVS:
                 remove_floaters_weight,
                 cube_stabilizer_weight,
                 force_cuda_rast,
+                sparse_grid=sparse_grid,
+                coarse_grids_resolution=coarse_grids_resolution,
+                band_update_interval=band_update_interval,
+                band_width=band_width,
                 device=DEVICE
             )
             
@@ -2787,15 +2939,23 @@ class Load_Unique3D_Custom_UNet:
         if cfg.init_config.init_unet_path == "":
             cfg.init_config.init_unet_path = checkpoint_dir_path
         init_config: AttnConfig = load_config(AttnConfig, cfg.init_config)
-        configurable_unet = ConfigurableUNet2DConditionModel(init_config, WEIGHT_DTYPE)
-        configurable_unet.enable_xformers_memory_efficient_attention()
+        
+        def replace_unet(pipe):
+            configurable_unet = ConfigurableUNet2DConditionModel(init_config, WEIGHT_DTYPE)
+            configurable_unet.enable_xformers_memory_efficient_attention()
 
-        state_dict = torch.load(checkpoint_path)
-        configurable_unet.unet.load_state_dict(state_dict, strict=False)
-        # Move unet, vae and text_encoder to device and cast to weight_dtype
-        configurable_unet.unet.to(DEVICE, dtype=WEIGHT_DTYPE)
+            load_checkpoint_into_model(configurable_unet.unet, checkpoint_path, device=DEVICE, dtype=WEIGHT_DTYPE, strict=False, class_name=self.__class__.__name__)
+            # Move unet, vae and text_encoder to device and cast to weight_dtype
+            configurable_unet.unet.to(DEVICE, dtype=WEIGHT_DTYPE)
 
-        pipe.unet = configurable_unet.unet
+            pipe.unet = configurable_unet.unet
+        
+        # same as Set_Diffusers_Pipeline_State_Dict, the unet is replaced in a copy of a managed pipe keyed by the checkpoint,
+        # so running this node again reuses it instead of replacing the unet once more
+        if isinstance(pipe, ManagedModel):
+            pipe = pipe.derive((self.__class__.__name__, checkpoint_path), replace_unet)
+        else:
+            replace_unet(pipe)
         
         cstr(f"[{self.__class__.__name__}] loaded unet ckpt from {checkpoint_path}").msg.print()
         return (pipe, )
@@ -2840,37 +3000,39 @@ class Unique3D_MVDiffusion_Model:
         radius,
         preprocess_images,
     ):
-        from Unique3D.scripts.utils import simple_image_preprocess
+        with use_model(unique3d_pipe) as unique3d_pipe:
+            from Unique3D.scripts.utils import simple_image_preprocess
 
-        pil_image_list = torch_imgs_to_pils(reference_image)
-        for i in range(len(pil_image_list)):
-            if preprocess_images:
-                pil_image_list[i] = simple_image_preprocess(pil_image_list[i])
+            pil_image_list = torch_imgs_to_pils(reference_image)
+            for i in range(len(pil_image_list)):
+                if preprocess_images:
+                    pil_image_list[i] = simple_image_preprocess(pil_image_list[i])
 
-        pil_image_list = pils_rgba_to_rgb(pil_image_list, bkgd="WHITE")
+            pil_image_list = pils_rgba_to_rgb(pil_image_list, bkgd="WHITE")
 
-        generator = torch.Generator(device=unique3d_pipe.unet.device).manual_seed(seed)
+            generator = torch.Generator(device=unique3d_pipe.unet.device).manual_seed(seed)
 
-        image_pils = unique3d_pipe(
-            image=pil_image_list,
-            generator=generator,
-            guidance_scale=guidance_scale,
-            num_inference_steps=num_inference_steps,
-            width=image_resolution,
-            height=image_resolution,
-            height_cond=image_resolution,
-            width_cond=image_resolution,
-        ).images
+            multiview_images = unique3d_pipe(
+                image=pil_image_list,
+                generator=generator,
+                guidance_scale=guidance_scale,
+                num_inference_steps=num_inference_steps,
+                width=image_resolution,
+                height=image_resolution,
+                height_cond=image_resolution,
+                width_cond=image_resolution,
+                output_type="pt",
+            ).images
 
-        # [N, H, W, 3]
-        multiview_images = pils_to_torch_imgs(image_pils, reference_image.dtype, reference_image.device)
+            # [N, 3, H, W] -> [N, H, W, 3]
+            multiview_images = multiview_images.permute(0, 2, 3, 1).to(dtype=reference_image.dtype, device=reference_image.device)
 
-        orbit_radius = [radius] * 4
-        orbit_center = [0.0] * 4
-        orbit_elevations, orbit_azimuths = ORBITPOSE_PRESET_DICT["Unique3D(4)"]
-        orbit_camposes = compose_orbit_camposes(orbit_radius, orbit_elevations, orbit_azimuths, orbit_center, orbit_center, orbit_center)
+            orbit_radius = [radius] * 4
+            orbit_center = [0.0] * 4
+            orbit_elevations, orbit_azimuths = ORBITPOSE_PRESET_DICT["Unique3D(4)"]
+            orbit_camposes = compose_orbit_camposes(orbit_radius, orbit_elevations, orbit_azimuths, orbit_center, orbit_center, orbit_center)
 
-        return (multiview_images, orbit_camposes)
+            return (multiview_images, orbit_camposes)
 
 class Fast_Normal_Maps_To_Mesh:
     @classmethod
@@ -2975,6 +3137,7 @@ class ExplicitTarget_Color_Projection:
             },
             "optional": {
                 "reference_orbit_camera_poses": ("ORBIT_CAMPOSES",),    # [orbit radius, elevation, azimuth, orbit center X,  orbit center Y,  orbit center Z]
+                "complete_unseen_method": (["propagate", "harmonic"],),
             }
         }
 
@@ -3000,9 +3163,8 @@ class ExplicitTarget_Color_Projection:
         texture_projecton,
         texture_type,
         reference_orbit_camera_poses=None,
+        complete_unseen_method="propagate",
     ):
-        pil_image_list = torch_imgs_to_pils(reference_images, reference_masks)
-
         meshes = to_py3d_mesh(mesh.v, mesh.f)
 
         #TODO Convert camera format, currently only support elevation equal to zero
@@ -3027,6 +3189,7 @@ class ExplicitTarget_Color_Projection:
             weights = None
         
         if texture_projecton:
+            pil_image_list = torch_imgs_to_pils(reference_images, reference_masks)
             target_img = multiview_color_projection_texture(meshes, mesh, pil_image_list, weights=weights, resolution=projection_resolution, device=DEVICE, complete_unseen=complete_unseen_rgb, confidence_threshold=confidence_threshold, cameras_list=cam_list)
             target_img = troch_image_dilate(target_img)
             
@@ -3037,7 +3200,9 @@ class ExplicitTarget_Color_Projection:
             else:
                 cstr(f"[{self.__class__.__name__}] Unknow texture type: {texture_type}").error.print()
         else:
-            new_meshes = multiview_color_projection(meshes, pil_image_list, weights=weights, resolution=projection_resolution, device=DEVICE, complete_unseen=complete_unseen_rgb, confidence_threshold=confidence_threshold, cameras_list=cam_list)
+            # [N, 4, H, W] RGBA, projected without leaving the device
+            images = torch_imgs_to_rgba(reference_images, reference_masks).permute(0, 3, 1, 2).float().to(DEVICE)
+            new_meshes = multiview_color_projection(meshes, images, weights=weights, resolution=projection_resolution, device=DEVICE, complete_unseen=complete_unseen_rgb, confidence_threshold=confidence_threshold, cameras_list=cam_list, complete_unseen_method=complete_unseen_method)
             vertices, faces, vertex_colors = from_py3d_mesh(new_meshes)
 
             mesh = Mesh(v=vertices, f=faces, 
@@ -3058,6 +3223,9 @@ class Convert_Vertex_Color_To_Texture:
                 "texture_resolution": ("INT", {"default": 1024, "min": 128, "max": 8192}),
                 "batch_size": ("INT", {"default": 128, "min": 1, "max": 0xffffffffffffffff}),
             },
+            "optional": {
+                "uv_backend": (UV_BACKENDS,),
+            }
         }
 
     RETURN_TYPES = (
@@ -3069,10 +3237,10 @@ class Convert_Vertex_Color_To_Texture:
     FUNCTION = "run_convert_func"
     CATEGORY = "Comfy3D/Algorithm"
     
-    def run_convert_func(self, mesh, texture_resolution, batch_size):
+    def run_convert_func(self, mesh, texture_resolution, batch_size, uv_backend="xatlas"):
         
         if mesh.vc is not None:
-            albedo_img, _ = interpolate_texture_map_attr(mesh, texture_resolution, batch_size, interpolate_color=True)
+            albedo_img, _ = interpolate_texture_map_attr(mesh, texture_resolution, batch_size, interpolate_color=True, uv_backend=uv_backend)
             mesh.albedo = troch_image_dilate(albedo_img)
         else:
             cstr(f"[{self.__class__.__name__}] skip this node since there is no vertex color found in mesh").msg.print()
@@ -3105,7 +3273,7 @@ class Load_CharacterGen_MVDiffusion_Model:
     
     def load_model(self, force_download):
         # Download checkpoints
-        snapshot_download(repo_id=self.default_repo_id, local_dir=self.checkpoints_dir_abs, force_download=force_download, repo_type="model", ignore_patterns=["*.json", "*.py"])
+        resume_or_download_snapshot_from_hf(self.checkpoints_dir_abs, self.default_repo_id, self.__class__.__name__, force_download=force_download, ignore_patterns=["*.json", "*.py"])
         # Load pre-trained models
         character_mv_gen_pipe = Inference2D_API(checkpoint_root_path=self.checkpoints_dir_abs, **OmegaConf.load(self.config_root_path_abs))
         
@@ -3204,7 +3372,7 @@ class Load_CharacterGen_Reconstruction_Model:
     
     def load_model(self, force_download):
         # Download checkpoints
-        snapshot_download(repo_id=self.default_repo_id, local_dir=self.checkpoints_dir_abs, force_download=force_download, repo_type="model", ignore_patterns=["*.json", "*.py"])
+        resume_or_download_snapshot_from_hf(self.checkpoints_dir_abs, self.default_repo_id, self.__class__.__name__, force_download=force_download, ignore_patterns=["*.json", "*.py"])
         # Load pre-trained models
         character_lrm_pipe = Inference3D_API(checkpoint_root_path=self.checkpoints_dir_abs, cfg=load_config_cg3d(self.config_root_path_abs))
         
@@ -3278,13 +3446,18 @@ class Load_Craftsman_Shape_Diffusion_Model:
         
         cfg: ExperimentConfigCraftsman
         cfg = load_config_craftsman(self.config_root_path_abs)
-
-        craftsman_model: BaseSystem = craftsman.find(cfg.system_type)(
-            cfg.system, 
-        )
         
-        craftsman_model.load_state_dict(torch.load(ckpt_path, map_location=torch.device('cpu'))['state_dict'])
-        craftsman_model = craftsman_model.to(DEVICE).eval()
+        def load_model():
+            craftsman_model: BaseSystem = craftsman.find(cfg.system_type)(
+                cfg.system, 
+            )
+            
+            load_checkpoint_into_model(craftsman_model, ckpt_path, device=DEVICE, state_dict_key='state_dict', strict=True, class_name=self.__class__.__name__)
+            return craftsman_model.to(DEVICE).eval()
+        
+        craftsman_model = get_model_residency_manager().load(
+            (self.__class__.__name__, ckpt_path), load_model, size_hint=os.path.getsize(ckpt_path)
+        )
         
         cstr(f"[{self.__class__.__name__}] loaded model ckpt from {self.checkpoints_dir_abs}").msg.print()
         return (craftsman_model,)
@@ -3300,6 +3473,9 @@ class Craftsman_Shape_Diffusion_Model:
                 "guidance_scale": ("FLOAT", {"default": 5.0, "min": 0.0, "step": 0.01}),
                 "num_inference_steps": ("INT", {"default": 50, "min": 1}),
                 "marching_cude_grids_resolution": ("INT", {"default": 256, "min": 1, "max": 0xffffffffffffffff}),
+            },
+            "optional": {
+                "marching_cude_coarse_grids_resolution": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}),  # 0: query the dense grid
             }
         }
 
@@ -3314,35 +3490,38 @@ class Craftsman_Shape_Diffusion_Model:
     CATEGORY = "Comfy3D/Algorithm"
     
     @torch.no_grad()
-    def run_model(self, craftsman_model, multiview_images, seed, guidance_scale, num_inference_steps, marching_cude_grids_resolution):
-        pil_mv_image_list = torch_imgs_to_pils(multiview_images)
-        
-        sample_inputs = {"mvimages": [pil_mv_image_list]}   # view order: front, right, back, left
-        
-        latents = craftsman_model.sample(
-            sample_inputs,
-            sample_times=1,
-            steps=num_inference_steps,
-            guidance_scale=guidance_scale,
-            return_intermediates=False,
-            seed=seed
-        )[0]
-        
-        cstr(f"[{self.__class__.__name__}] Starting to extract mesh...").msg.print()
-        # decode the latents to mesh
-        box_v = 1.1
-        mesh_outputs, _ = craftsman_model.shape_model.extract_geometry(
-            latents,
-            bounds=[-box_v, -box_v, -box_v, box_v, box_v, box_v],
-            grids_resolution=marching_cude_grids_resolution
-        )
-        vertices, faces = torch.from_numpy(mesh_outputs[0][0]).to(DEVICE), torch.from_numpy(mesh_outputs[0][1]).to(torch.int64).to(DEVICE)
+    def run_model(self, craftsman_model, multiview_images, seed, guidance_scale, num_inference_steps, marching_cude_grids_resolution, marching_cude_coarse_grids_resolution=0):
+        with use_model(craftsman_model) as craftsman_model:
+            # [N, H, W, 3] in [0, 1], preprocessed on device by the condition encoder
+            mv_images = multiview_images[..., :3].clamp(0, 1).to(DEVICE)
+        
+            sample_inputs = {"mvimages": [mv_images]}   # view order: front, right, back, left
+        
+            latents = craftsman_model.sample(
+                sample_inputs,
+                sample_times=1,
+                steps=num_inference_steps,
+                guidance_scale=guidance_scale,
+                return_intermediates=False,
+                seed=seed
+            )[0]
+        
+            cstr(f"[{self.__class__.__name__}] Starting to extract mesh...").msg.print()
+            # decode the latents to mesh
+            box_v = 1.1
+            mesh_outputs, _ = craftsman_model.shape_model.extract_geometry(
+                latents,
+                bounds=[-box_v, -box_v, -box_v, box_v, box_v, box_v],
+                grids_resolution=marching_cude_grids_resolution,
+                coarse_grids_resolution=marching_cude_coarse_grids_resolution
+            )
+            vertices, faces = torch.from_numpy(mesh_outputs[0][0]).to(DEVICE), torch.from_numpy(mesh_outputs[0][1]).to(torch.int64).to(DEVICE)
 
-        mesh = Mesh(v=vertices, f=faces, device=DEVICE)
-        mesh.auto_normal()
-        mesh.auto_uv()
+            mesh = Mesh(v=vertices, f=faces, device=DEVICE)
+            mesh.auto_normal()
+            mesh.auto_uv()
         
-        return (mesh,)
+            return (mesh,)
 
 class OrbitPoses_JK:
     def __init__(self):
@@ -3435,24 +3614,33 @@ class Load_CRM_T2I_V2_Models:
             get_obj_from_str,
         )
         
-        t2iadapter_v2 = T2IAdapterV2.from_pretrained(self.t2i_v2_checkpoints_dir_abs).to(DEVICE, dtype=WEIGHT_DTYPE)
+        t2iadapter_v2 = get_model_residency_manager().load(
+            ("T2IAdapterV2", self.t2i_v2_checkpoints_dir_abs), 
+            lambda: T2IAdapterV2.from_pretrained(self.t2i_v2_checkpoints_dir_abs).to(DEVICE, dtype=WEIGHT_DTYPE)
+        )
 
         crm_config_path = os.path.join(self.config_root_path_abs, crm_config_path)
         
         ckpt_path = resume_or_download_model_from_hf(self.crm_checkpoints_dir_abs, self.default_crm_repo_id, crm_model_name, self.__class__.__name__)
             
         crm_config = OmegaConf.load(crm_config_path)
-
-        crm_mvdiffusion_model = instantiate_from_config(crm_config.model)
-        crm_mvdiffusion_model.load_state_dict(torch.load(ckpt_path, map_location="cpu"), strict=False)
-        crm_mvdiffusion_model.device = DEVICE
         
-        crm_mvdiffusion_model.clip_model = crm_mvdiffusion_model.clip_model.to(DEVICE, dtype=WEIGHT_DTYPE)
-        crm_mvdiffusion_model.vae_model = crm_mvdiffusion_model.vae_model.to(DEVICE, dtype=WEIGHT_DTYPE)
-        crm_mvdiffusion_model = crm_mvdiffusion_model.to(DEVICE, dtype=WEIGHT_DTYPE)
+        def load_sampler():
+            crm_mvdiffusion_model = instantiate_from_config(crm_config.model)
+            load_checkpoint_into_model(crm_mvdiffusion_model, ckpt_path, device=DEVICE, dtype=WEIGHT_DTYPE, strict=False, class_name=self.__class__.__name__)
+            crm_mvdiffusion_model.device = DEVICE
+            
+            crm_mvdiffusion_model.clip_model = crm_mvdiffusion_model.clip_model.to(DEVICE, dtype=WEIGHT_DTYPE)
+            crm_mvdiffusion_model.vae_model = crm_mvdiffusion_model.vae_model.to(DEVICE, dtype=WEIGHT_DTYPE)
+            crm_mvdiffusion_model = crm_mvdiffusion_model.to(DEVICE, dtype=WEIGHT_DTYPE)
+            
+            crm_mvdiffusion_sampler_v2 = get_obj_from_str(crm_config.sampler.target)(
+                crm_mvdiffusion_model, device=DEVICE, dtype=WEIGHT_DTYPE, **crm_config.sampler.params
+            )
+            return crm_mvdiffusion_sampler_v2
         
-        crm_mvdiffusion_sampler_v2 = get_obj_from_str(crm_config.sampler.target)(
-            crm_mvdiffusion_model, device=DEVICE, dtype=WEIGHT_DTYPE, **crm_config.sampler.params
+        crm_mvdiffusion_sampler_v2 = get_model_residency_manager().load(
+            (self.__class__.__name__, ckpt_path, crm_config_path), load_sampler, size_hint=os.path.getsize(ckpt_path)
         )
         
         cstr(f"[{self.__class__.__name__}] loaded model ckpt from {ckpt_path}").msg.print()
@@ -3509,37 +3697,38 @@ class CRM_T2I_V2_Models:
         mv_guidance_scale, 
         num_inference_steps, 
     ):  
-        # Convert tensores to pil images
-        batch_reference_images = [CRMSamplerV2.process_pixel_img(img) for img in torch_imgs_to_pils(reference_image, reference_mask)]
-        
-        # Adapter conditioning.
-        normal_maps = normal_maps.permute(0, 3, 1, 2).to(DEVICE, dtype=WEIGHT_DTYPE)    # [N, H, W, 3] -> [N, 3, H, W]
-        down_intrablock_additional_residuals = t2iadapter_v2(normal_maps)
-        down_intrablock_additional_residuals = [
-            sample.to(dtype=WEIGHT_DTYPE).chunk(reference_image.shape[0]) for sample in down_intrablock_additional_residuals
-        ]   # List[ List[ feature maps tensor for one down sample block and for one ip image, ... ], ... ]
-
-        # Inference
-        multiview_images = CRMSamplerV2.stage1_sample(
-            crm_mvdiffusion_sampler_v2,
-            batch_reference_images,
-            prompt,
-            prompt_neg,
-            seed,
-            mv_guidance_scale, 
-            num_inference_steps,
-            additional_residuals=down_intrablock_additional_residuals
-        ).to(dtype=reference_image.dtype, device=reference_image.device)
+        with use_model(t2iadapter_v2) as t2iadapter_v2, use_model(crm_mvdiffusion_sampler_v2) as crm_mvdiffusion_sampler_v2:
+            # Convert tensores to pil images
+            batch_reference_images = [CRMSamplerV2.process_pixel_img(img) for img in torch_imgs_to_pils(reference_image, reference_mask)]
+        
+            # Adapter conditioning.
+            normal_maps = normal_maps.permute(0, 3, 1, 2).to(DEVICE, dtype=WEIGHT_DTYPE)    # [N, H, W, 3] -> [N, 3, H, W]
+            down_intrablock_additional_residuals = t2iadapter_v2(normal_maps)
+            down_intrablock_additional_residuals = [
+                sample.to(dtype=WEIGHT_DTYPE).chunk(reference_image.shape[0]) for sample in down_intrablock_additional_residuals
+            ]   # List[ List[ feature maps tensor for one down sample block and for one ip image, ... ], ... ]
+
+            # Inference
+            multiview_images = CRMSamplerV2.stage1_sample(
+                crm_mvdiffusion_sampler_v2,
+                batch_reference_images,
+                prompt,
+                prompt_neg,
+                seed,
+                mv_guidance_scale, 
+                num_inference_steps,
+                additional_residuals=down_intrablock_additional_residuals
+            ).to(dtype=reference_image.dtype, device=reference_image.device)
             
-        gc.collect()
-        torch.cuda.empty_cache()
+            gc.collect()
+            torch.cuda.empty_cache()
 
-        orbit_radius = [1.63634] * 6
-        orbit_center = [0.0] * 6
-        orbit_elevations, orbit_azimuths = ORBITPOSE_PRESET_DICT["CRM(6)"]
-        orbit_camposes = compose_orbit_camposes(orbit_radius, orbit_elevations, orbit_azimuths, orbit_center, orbit_center, orbit_center)
+            orbit_radius = [1.63634] * 6
+            orbit_center = [0.0] * 6
+            orbit_elevations, orbit_azimuths = ORBITPOSE_PRESET_DICT["CRM(6)"]
+            orbit_camposes = compose_orbit_camposes(orbit_radius, orbit_elevations, orbit_azimuths, orbit_center, orbit_center, orbit_center)
         
-        return (multiview_images, orbit_camposes)
+            return (multiview_images, orbit_camposes)
     
 class Load_CRM_T2I_V3_Models:
     crm_checkpoints_dir = "CRM"
@@ -3596,32 +3785,41 @@ class Load_CRM_T2I_V3_Models:
             get_obj_from_str,
         )
         
-        t2iadapter_v2 = T2IAdapterV2.from_pretrained(self.t2i_v2_checkpoints_dir_abs).to(DEVICE, dtype=WEIGHT_DTYPE)
+        t2iadapter_v2 = get_model_residency_manager().load(
+            ("T2IAdapterV2", self.t2i_v2_checkpoints_dir_abs), 
+            lambda: T2IAdapterV2.from_pretrained(self.t2i_v2_checkpoints_dir_abs).to(DEVICE, dtype=WEIGHT_DTYPE)
+        )
 
         crm_config_path = os.path.join(self.config_root_path_abs, crm_config_path)
         
         ckpt_path = resume_or_download_model_from_hf(self.crm_checkpoints_dir_abs, self.default_crm_repo_id, crm_model_name, self.__class__.__name__)
             
         crm_config = OmegaConf.load(crm_config_path)
-
-        crm_mvdiffusion_model = instantiate_from_config(crm_config.model)
-        crm_mvdiffusion_model.load_state_dict(torch.load(ckpt_path, map_location="cpu"), strict=False)
-        crm_mvdiffusion_model.device = DEVICE
         
-        crm_mvdiffusion_model.clip_model = crm_mvdiffusion_model.clip_model.to(DEVICE, dtype=WEIGHT_DTYPE)
-        crm_mvdiffusion_model.vae_model = crm_mvdiffusion_model.vae_model.to(DEVICE, dtype=WEIGHT_DTYPE)
-        crm_mvdiffusion_model = crm_mvdiffusion_model.to(DEVICE, dtype=WEIGHT_DTYPE)
-        
-        crm_mvdiffusion_sampler_v3 = get_obj_from_str(crm_config.sampler.target)(
-            crm_mvdiffusion_model, device=DEVICE, dtype=WEIGHT_DTYPE, **crm_config.sampler.params
-        )
-        
-        unet = crm_mvdiffusion_model.model
-        mvdiffusion_model = unet.diffusion_model
-        self.inject_lora(mvdiffusion_model, rank, use_dora)
+        def load_sampler():
+            crm_mvdiffusion_model = instantiate_from_config(crm_config.model)
+            load_checkpoint_into_model(crm_mvdiffusion_model, ckpt_path, device=DEVICE, dtype=WEIGHT_DTYPE, strict=False, class_name=self.__class__.__name__)
+            crm_mvdiffusion_model.device = DEVICE
+            
+            crm_mvdiffusion_model.clip_model = crm_mvdiffusion_model.clip_model.to(DEVICE, dtype=WEIGHT_DTYPE)
+            crm_mvdiffusion_model.vae_model = crm_mvdiffusion_model.vae_model.to(DEVICE, dtype=WEIGHT_DTYPE)
+            crm_mvdiffusion_model = crm_mvdiffusion_model.to(DEVICE, dtype=WEIGHT_DTYPE)
+            
+            crm_mvdiffusion_sampler_v3 = get_obj_from_str(crm_config.sampler.target)(
+                crm_mvdiffusion_model, device=DEVICE, dtype=WEIGHT_DTYPE, **crm_config.sampler.params
+            )
+            
+            unet = crm_mvdiffusion_model.model
+            mvdiffusion_model = unet.diffusion_model
+            self.inject_lora(mvdiffusion_model, rank, use_dora)
+            
+            load_checkpoint_into_model(unet, pretrained_lora_model_path, strict=False, class_name=self.__class__.__name__)
+            return crm_mvdiffusion_sampler_v3
         
         pretrained_lora_model_path = os.path.join(self.crm_t2i_v3_checkpoints_dir_abs, crm_t2i_v3_model_name)
-        unet.load_state_dict(torch.load(pretrained_lora_model_path, map_location="cpu"), strict=False)
+        crm_mvdiffusion_sampler_v3 = get_model_residency_manager().load(
+            (self.__class__.__name__, ckpt_path, pretrained_lora_model_path, crm_config_path, rank, use_dora), load_sampler, size_hint=os.path.getsize(ckpt_path)
+        )
         
         cstr(f"[{self.__class__.__name__}] loaded model ckpt from {ckpt_path} and {pretrained_lora_model_path}").msg.print()
         
@@ -3696,51 +3894,52 @@ class CRM_T2I_V3_Models:
         mv_guidance_scale, 
         num_inference_steps, 
     ):  
-        # Convert tensores to pil images
-        batch_reference_images = [CRMSamplerV3.process_pixel_img(img) for img in torch_imgs_to_pils(reference_image, reference_mask)]
-        
-        # Adapter conditioning.
-        normal_maps = normal_maps.permute(0, 3, 1, 2).to(DEVICE, dtype=WEIGHT_DTYPE)    # [N, H, W, 3] -> [N, 3, H, W]
-        down_intrablock_additional_residuals = t2iadapter_v2(normal_maps)
-        down_intrablock_additional_residuals = [
-            sample.to(dtype=WEIGHT_DTYPE).chunk(reference_image.shape[0]) for sample in down_intrablock_additional_residuals
-        ]   # List[ List[ feature maps tensor for one down sample block and for one ip image, ... ], ... ]
-
-        all_multiview_images = [[], [], []] # [list of albedo mvs, list of metalness mvs, list of roughness mvs]
-
-        # Inference
-        multiview_images = CRMSamplerV3.stage1_sample(
-            crm_mvdiffusion_sampler_v3,
-            batch_reference_images,
-            prompt,
-            prompt_neg,
-            seed,
-            mv_guidance_scale, 
-            num_inference_steps,
-            additional_residuals=down_intrablock_additional_residuals
-        )
+        with use_model(t2iadapter_v2) as t2iadapter_v2, use_model(crm_mvdiffusion_sampler_v3) as crm_mvdiffusion_sampler_v3:
+            # Convert tensores to pil images
+            batch_reference_images = [CRMSamplerV3.process_pixel_img(img) for img in torch_imgs_to_pils(reference_image, reference_mask)]
+        
+            # Adapter conditioning.
+            normal_maps = normal_maps.permute(0, 3, 1, 2).to(DEVICE, dtype=WEIGHT_DTYPE)    # [N, H, W, 3] -> [N, 3, H, W]
+            down_intrablock_additional_residuals = t2iadapter_v2(normal_maps)
+            down_intrablock_additional_residuals = [
+                sample.to(dtype=WEIGHT_DTYPE).chunk(reference_image.shape[0]) for sample in down_intrablock_additional_residuals
+            ]   # List[ List[ feature maps tensor for one down sample block and for one ip image, ... ], ... ]
+
+            all_multiview_images = [[], [], []] # [list of albedo mvs, list of metalness mvs, list of roughness mvs]
+
+            # Inference
+            multiview_images = CRMSamplerV3.stage1_sample(
+                crm_mvdiffusion_sampler_v3,
+                batch_reference_images,
+                prompt,
+                prompt_neg,
+                seed,
+                mv_guidance_scale, 
+                num_inference_steps,
+                additional_residuals=down_intrablock_additional_residuals
+            )
         
-        num_mvs = crm_mvdiffusion_sampler_v3.num_frames - 1 # 6
-        num_branches = crm_mvdiffusion_sampler_v3.model.model.diffusion_model.num_branches # 3
-        ip_batch_size = reference_image.shape[0]
-        i_mvs = 0
-        for i_branch in range(num_branches):
-            for _ in range(ip_batch_size):
-                batch_of_mv_imgs = torch.stack(multiview_images[i_mvs:i_mvs+num_mvs], axis=0)
-                i_mvs += num_mvs
+            num_mvs = crm_mvdiffusion_sampler_v3.num_frames - 1 # 6
+            num_branches = crm_mvdiffusion_sampler_v3.model.model.diffusion_model.num_branches # 3
+            ip_batch_size = reference_image.shape[0]
+            i_mvs = 0
+            for i_branch in range(num_branches):
+                for _ in range(ip_batch_size):
+                    batch_of_mv_imgs = torch.stack(multiview_images[i_mvs:i_mvs+num_mvs], axis=0)
+                    i_mvs += num_mvs
             
-                all_multiview_images[i_branch].append(batch_of_mv_imgs)
+                    all_multiview_images[i_branch].append(batch_of_mv_imgs)
               
-        output_images = [None] * num_branches
-        for i_branch in range(num_branches):
-            output_images[i_branch] = torch.cat(all_multiview_images[i_branch], dim=0).to(reference_image.device, dtype=reference_image.dtype)
+            output_images = [None] * num_branches
+            for i_branch in range(num_branches):
+                output_images[i_branch] = torch.cat(all_multiview_images[i_branch], dim=0).to(reference_image.device, dtype=reference_image.dtype)
             
-        gc.collect()
-        torch.cuda.empty_cache()
+            gc.collect()
+            torch.cuda.empty_cache()
 
-        orbit_radius = [1.63634] * 6
-        orbit_center = [0.0] * 6
-        orbit_elevations, orbit_azimuths = ORBITPOSE_PRESET_DICT["CRM(6)"]
-        orbit_camposes = compose_orbit_camposes(orbit_radius, orbit_elevations, orbit_azimuths, orbit_center, orbit_center, orbit_center)
+            orbit_radius = [1.63634] * 6
+            orbit_center = [0.0] * 6
+            orbit_elevations, orbit_azimuths = ORBITPOSE_PRESET_DICT["CRM(6)"]
+            orbit_camposes = compose_orbit_camposes(orbit_radius, orbit_elevations, orbit_azimuths, orbit_center, orbit_center, orbit_center)
         
-        return (output_images[0], output_images[1], output_images[2], orbit_camposes)
\ No newline at end of file
+            return (output_images[0], output_images[1], output_images[2], orbit_camposes)
\ No newline at end of file
@@ -6,8 +6,6 @@ from scipy.spatial.transform import Rotation as R
 
 import torch
 
-from kiui.cam import orbit_camera
-
 #{Key: [elevation, azimuth], ...}
 ORBITPOSE_PRESET_DICT = OrderedDict([
     ("Custom",           [[0.0, 90.0, 0.0, 0.0, -90.0, 0.0], [-90.0, 0.0, 180.0, 90.0, 0.0, 0.0]]),
@@ -85,6 +83,33 @@ def get_look_at_camera_pose(target, target_to_cam_offset, look_distance=0.1, ope
     T[:3, 3] = campos
     return T
 
+def orbit_camera_poses(all_cam_poses, opengl=True):
+    """
+    Vectorized kiui.cam.orbit_camera, calculate the pose (cam2world) matrices of all orbit camera poses at once
+    
+    Args:
+        all_cam_poses (NDArray[float32], shape: [N, 6]): [orbit radius, elevation, azimuth, orbit center X, orbit center Y, orbit center Z] of each pose, elevation and azimuth in degree
+
+    Returns:
+        NDArray[float32]: shape: (N, 4, 4), pose (cam2world) matrices
+    """
+    all_cam_poses = np.asarray(all_cam_poses, dtype=np.float64).reshape(-1, 6)
+    radius = all_cam_poses[:, 0]
+    elevation = np.deg2rad(all_cam_poses[:, 1])
+    azimuth = np.deg2rad(all_cam_poses[:, 2])
+    target = all_cam_poses[:, 3:].astype(np.float32)
+    
+    campos = np.stack([
+        radius * np.cos(elevation) * np.sin(azimuth),
+        - radius * np.sin(elevation),
+        radius * np.cos(elevation) * np.cos(azimuth),
+    ], axis=-1) + target  # [N, 3]
+    
+    T = np.tile(np.eye(4, dtype=np.float32), (len(campos), 1, 1))
+    T[:, :3, :3] = np.swapaxes(look_at(campos, target, opengl), 1, 2)   # look_at stacks batched axes as rows
+    T[:, :3, 3] = campos
+    return T
+
 class OrbitCamera:
     def __init__(self, W, H, r=2, fovy=60, near=0.01, far=100):
         self.W = W
@@ -214,6 +239,9 @@ class MiniCam:
         self.camera_center = -torch.tensor(c2w[:3, 3]).cuda()
 
 class BaseCameraController(ABC):
+    # upper bound of pixels rendered in one batch by render_all_pose, bounds the memory of batched renderers
+    max_render_batch_pixels = 1024 * 1024 * 8
+    
     def __init__(self, renderer, cam_size_W, cam_size_H, reference_orbit_camera_fovy, invert_bg_prob=1.0, static_bg=None, device='cuda'):
         self.device = torch.device(device)
         
@@ -237,41 +265,70 @@ class BaseCameraController(ABC):
     def get_render_result(self, render_pose, bg_color, **kwargs):
         pass
         
-    def render_at_pose(self, cam_pose, **kwargs):
-        radius, elevation, azimuth, center_X, center_Y, center_Z = cam_pose
-        
-        orbit_target = np.array([center_X, center_Y, center_Z], dtype=np.float32)
-        render_pose = orbit_camera(elevation, azimuth, radius, target=orbit_target)
-        
+    def get_batch_render_result(self, render_poses, bg_colors, **kwargs):
+        """
+        Render a batch of poses, subclasses whose renderer can rasterize several views at once should override this
+
+        Args:
+            render_poses (NDArray[float32], shape: [B, 4, 4]): pose (cam2world) matrices
+            bg_colors (Tensor[float32], shape: [B, 3]): background color of each pose
+
+        Returns:
+            dict: every output of get_render_result stacked along a new first dimension of size B
+        """
+        batch_outputs = {}
+        for render_pose, bg_color in zip(render_poses, bg_colors):
+            out = self.get_render_result(render_pose, bg_color, **kwargs)
+            for k in out:
+                batch_outputs.setdefault(k, []).append(out[k])
+                
+        return {k: torch.stack(v, dim=0) for k, v in batch_outputs.items()}
+    
+    def get_bg_colors(self, num):
         if self.static_bg is None:
-            bg_color = self.white_bg if np.random.rand() > self.invert_bg_prob else self.black_bg
+            invert_bg = torch.from_numpy(np.random.rand(num) <= self.invert_bg_prob).to(self.device)
+            return torch.where(invert_bg[:, None], self.black_bg, self.white_bg)
         else:
-            bg_color = self.static_bg
-            
+            return self.static_bg.expand(num, 3)
+    
+    def get_render_chunk_size(self):
+        return max(1, self.max_render_batch_pixels // (self.cam.W * self.cam.H))
+        
+    def render_at_pose(self, cam_pose, **kwargs):
+        render_pose = orbit_camera_poses([cam_pose])[0]
+        bg_color = self.get_bg_colors(1)[0]
         return self.get_render_result(render_pose, bg_color, **kwargs)
     
-    def render_all_pose(self, all_cam_poses, **kwargs):
-        all_rendered_images, all_rendered_masks = [], []
-        extra_outputs = {}
-        for cam_pose in all_cam_poses:
-            out = self.render_at_pose(cam_pose, **kwargs)
-            
-            image = out["image"] # [3, H, W] in [0, 1]
-            mask = out["alpha"] # [1, H, W] in [0, 1]
-            
-            all_rendered_images.append(image)
-            all_rendered_masks.append(mask)
+    def render_all_pose(self, all_cam_poses, chunk_size=None, **kwargs):
+        """
+        Render all orbit camera poses, in chunks of poses rendered as one batch
+
+        Args:
+            all_cam_poses (list): [orbit radius, elevation, azimuth, orbit center X, orbit center Y, orbit center Z] of each pose
+            chunk_size (int, optional): number of poses rendered per batch, defaults to as many as fit in max_render_batch_pixels
+
+        Returns:
+            Tensor[float32], shape: [Number of Poses, 3, H, W]: rendered images in [0, 1]
+            Tensor[float32], shape: [Number of Poses, 1, H, W]: rendered masks in [0, 1]
+            dict: every output of the renderer stacked along the first dimension
+        """
+        if chunk_size is None:
+            chunk_size = self.get_render_chunk_size()
             
+        all_render_poses = orbit_camera_poses(all_cam_poses)
+        all_bg_colors = self.get_bg_colors(len(all_render_poses))
+        
+        extra_outputs = {}
+        for i in range(0, len(all_render_poses), chunk_size):
+            out = self.get_batch_render_result(all_render_poses[i:i+chunk_size], all_bg_colors[i:i+chunk_size], **kwargs)
             for k in out:
-                if k not in extra_outputs:
-                    extra_outputs[k] = []
-                extra_outputs[k].append(out[k])
+                extra_outputs.setdefault(k, []).append(out[k])
                 
         for k in extra_outputs:
-            extra_outputs[k] = torch.stack(extra_outputs[k], dim=0)
+            extra_outputs[k] = torch.cat(extra_outputs[k], dim=0)
             
         # [Number of Poses, 3, H, W], [Number of Poses, 1, H, W] both in [0, 1]
-        return torch.stack(all_rendered_images, dim=0), torch.stack(all_rendered_masks, dim=0), extra_outputs
+        return extra_outputs["image"], extra_outputs["alpha"], extra_outputs
     
 def compose_orbit_camposes(orbit_radius, orbit_elevations, orbit_azimuths, orbit_center_x, orbit_center_y, orbit_center_z):
     orbit_camposes = []
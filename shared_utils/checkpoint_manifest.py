@@ -0,0 +1,315 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from shared_utils.log_utils import cstr
+
+CHECKPOINTS_ROOT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Checkpoints")
+MANIFEST_FILENAME = "checkpoint_manifest.json"
+MANIFEST_VERSION = 1
+
+# Files hashed per read, large reads let hashlib release the GIL so verifier threads run in parallel
+HASH_CHUNK_SIZE = 8 * 1024 ** 2
+
+# Directories of snapshot downloads that are not part of the checkpoints
+SNAPSHOT_IGNORED_DIRS = [".cache", ".git", ".huggingface"]
+
+def hash_file(path, chunk_size=HASH_CHUNK_SIZE, git_blob=False):
+    """sha256 of the file, or its git blob sha1 (the etag of files not stored with git LFS) if git_blob is True"""
+    if git_blob:
+        file_hash = hashlib.sha1(b"blob %d\0" % os.path.getsize(path))
+    else:
+        file_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def etag_matches(path, sha256, etag):
+    """
+    Returns:
+        bool or None: whether the file matches the etag of its repo, None if the etag is not a hash of the content
+    """
+    etag = etag.strip('"').lower()
+    if len(etag) == 64:
+        return sha256 == etag
+    if len(etag) == 40:
+        return hash_file(path, git_blob=True) == etag
+    return None
+
+def read_hf_download_metadata(local_dir, filename):
+    """Etag of filename when huggingface_hub downloaded it into local_dir (kept in .cache/huggingface/download), None if it didn't"""
+    metadata_path = os.path.join(local_dir, ".cache", "huggingface", "download", *filename.split("/")) + ".metadata"
+    try:
+        with open(metadata_path, "r") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    # commit hash, etag, timestamp
+    return lines[1].strip() if len(lines) >= 2 and lines[1].strip() else None
+
+class CheckpointManifest:
+    """
+    Local index of the downloaded checkpoints, stored as json next to them.
+
+    Records size, modification time and sha256 of every checkpoint file, and the files of every downloaded snapshot,
+    so loaders resolve checkpoints with a single stat and no network call. A file is only valid once its hash matched
+    the etag its repo gives for it (sha256 of LFS files), until then it is unverified. Entries whose size or mtime changed are stale:
+    the file is hashed again and only downloaded again if its content changed (e.g. a truncated copy).
+    Hashes are computed and verified in the background by a thread pool.
+    """
+    def __init__(self, root=CHECKPOINTS_ROOT_PATH, hash_workers=4):
+        """
+        Args:
+            root (str, optional): checkpoints root directory, the manifest is saved in it. Defaults to the Checkpoints folder.
+            hash_workers (int, optional): threads hashing checkpoints in the background. Defaults to 4.
+        """
+        self.root = root
+        self.manifest_path = os.path.join(root, MANIFEST_FILENAME)
+        self.hash_workers = hash_workers
+        self.files = {}
+        self.snapshots = {}
+        self._lock = threading.RLock()
+        self._executor = None
+        # manifest key -> future of its hash running in the background
+        self._pending = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.manifest_path):
+            return
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION:
+                self.files = manifest.get("files", {})
+                self.snapshots = manifest.get("snapshots", {})
+        except (OSError, ValueError) as e:
+            cstr(f"[{self.__class__.__name__}] ignoring unreadable manifest {self.manifest_path}: {e}").warning.print()
+
+    def save(self):
+        with self._lock:
+            manifest = {"version": MANIFEST_VERSION, "files": self.files, "snapshots": self.snapshots}
+            os.makedirs(self.root, exist_ok=True)
+            # write then rename so an interrupted save never leaves a truncated manifest
+            tmp_path = self.manifest_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(manifest, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.manifest_path)
+
+    def _key(self, path):
+        path = os.path.abspath(path)
+        relpath = os.path.relpath(path, self.root)
+        return path if relpath.startswith("..") else relpath.replace(os.sep, "/")
+
+    def _path(self, key):
+        return key if os.path.isabs(key) else os.path.join(self.root, key)
+
+    @staticmethod
+    def _stat(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def lookup(self, path):
+        """
+        Returns:
+            str: "valid" if path is recorded, matched the etag of its repo and is unchanged since,
+                 "unverified" if it is recorded and unchanged but did not match the etag of its repo yet,
+                 "stale" if it is recorded but changed, missing or found corrupt,
+                 "unknown" if it exists but was never recorded, "missing" otherwise
+        """
+        stat = self._stat(path)
+        with self._lock:
+            entry = self.files.get(self._key(path))
+        if entry is None:
+            return "missing" if stat is None else "unknown"
+        if stat is None or entry.get("corrupt", False) or stat != (entry["size"], entry["mtime_ns"]):
+            return "stale"
+        if not entry.get("verified", False):
+            return "unverified"
+        return "valid"
+
+    def record(self, path, expected_etag=None, expected_size=None, verify=True, save=True):
+        """
+        Record the current size and mtime of path, with the etag and size its repo gives for it if known (see read_hf_download_metadata).
+        It stays unverified until it is hashed and matches the etag, in the background if verify is True.
+        Recording an unchanged file again keeps its hash.
+        """
+        stat = self._stat(path)
+        if stat is None:
+            return
+        with self._lock:
+            key = self._key(path)
+            entry = self.files.get(key)
+            if entry is None or stat != (entry["size"], entry["mtime_ns"]):
+                entry = {"size": stat[0], "mtime_ns": stat[1], "sha256": None, "verified": False, "verified_at": None}
+            elif (entry.get("expected_etag"), entry.get("expected_size")) != (expected_etag, expected_size):
+                entry["verified"] = False
+                entry["corrupt"] = False
+            entry["expected_etag"] = expected_etag
+            entry["expected_size"] = expected_size
+            self.files[key] = entry
+            if save:
+                self.save()
+        if verify and not entry["verified"]:
+            self.verify_async([path])
+
+    def has_expected_etag(self, path):
+        with self._lock:
+            entry = self.files.get(self._key(path))
+        return entry is not None and entry.get("expected_etag") is not None
+
+    def set_expected_etag(self, path, expected_etag, expected_size=None):
+        """Set the etag and size the repo gives for a recorded file, a file that was never recorded is recorded"""
+        with self._lock:
+            entry = self.files.get(self._key(path))
+            if entry is None:
+                self.record(path, expected_etag, expected_size, verify=False)
+            elif (entry.get("expected_etag"), entry.get("expected_size")) != (expected_etag, expected_size):
+                entry.update(expected_etag=expected_etag, expected_size=expected_size, verified=False, corrupt=False)
+                self.save()
+
+    def verify(self, path):
+        """
+        Hash a recorded file now (or wait for its hash already running in the background) and compare it with the etag of its repo
+
+        Returns:
+            bool or None: True if it matches the etag, False if it doesn't, is missing or changed since it was last hashed,
+                          None if there is no etag to compare with
+        """
+        key = self._key(path)
+        with self._lock:
+            future = self._pending.get(key)
+        if future is not None and not future.done():
+            return future.result()[1]
+        return self._verify(key)[1]
+
+    def forget(self, path):
+        with self._lock:
+            self.files.pop(self._key(path), None)
+            self.save()
+
+    def is_snapshot_complete(self, local_dir):
+        """True if a snapshot was recorded in local_dir and all its files match the etags of its repo"""
+        with self._lock:
+            snapshot = self.snapshots.get(self._key(local_dir))
+        if snapshot is None:
+            return False
+        paths = [self._path(key) for key in snapshot["files"]]
+        return all(self.lookup(path) == "valid" or self.verify(path) for path in paths)
+
+    def changed_snapshot_files(self, local_dir):
+        """Files of the snapshot recorded in local_dir that are missing or don't match the etags of its repo, touched files whose hash still matches are valid again"""
+        with self._lock:
+            snapshot = self.snapshots.get(self._key(local_dir))
+        if snapshot is None:
+            return []
+        paths = [self._path(key) for key in snapshot["files"]]
+        return [path for path in paths if self.lookup(path) != "valid" and self.verify(path) is False]
+
+    def record_snapshot(self, local_dir, repo_id):
+        """Record every file downloaded in local_dir with its etag, hashes are computed and matched in the background"""
+        paths, etags = [], []
+        for root, dirs, files in os.walk(local_dir):
+            dirs[:] = [d for d in dirs if d not in SNAPSHOT_IGNORED_DIRS]
+            for filename in files:
+                path = os.path.join(root, filename)
+                etag = read_hf_download_metadata(local_dir, os.path.relpath(path, local_dir).replace(os.sep, "/"))
+                # files huggingface_hub did not download (e.g. custom pipeline code shipped with this repo) are not part of the snapshot
+                if etag is not None:
+                    paths.append(path)
+                    etags.append(etag)
+
+        with self._lock:
+            for path, etag in zip(paths, etags):
+                self.record(path, expected_etag=etag, verify=False, save=False)
+            self.snapshots[self._key(local_dir)] = {"repo_id": repo_id, "files": [self._key(path) for path in paths]}
+            self.save()
+        self.verify_async(paths)
+
+    def _verify(self, key):
+        path = self._path(key)
+        stat = self._stat(path)
+        with self._lock:
+            entry = self.files.get(key)
+        if entry is None or stat is None:
+            return key, False
+
+        previous_sha256 = entry.get("sha256")
+        unchanged = stat == (entry["size"], entry["mtime_ns"])
+        known_corrupt = unchanged and entry.get("corrupt", False)
+        expected_etag, expected_size = entry.get("expected_etag"), entry.get("expected_size")
+        if expected_size is not None and stat[0] != expected_size:
+            sha256, verified = None, False
+        else:
+            # the recorded hash still holds for an unchanged file
+            sha256 = previous_sha256 if unchanged and previous_sha256 is not None else hash_file(path)
+            if expected_etag is not None:
+                verified = etag_matches(path, sha256, expected_etag)
+            elif previous_sha256 is not None and sha256 != previous_sha256:
+                verified = False
+            else:
+                # nothing to compare with, the file stays unverified
+                verified = None
+
+        with self._lock:
+            entry = self.files.get(key)
+            if entry is None or self._stat(path) != stat:
+                return key, False
+            entry.update(size=stat[0], mtime_ns=stat[1], sha256=sha256, verified=verified is True, corrupt=verified is False, verified_at=time.time())
+            self.save()
+
+        if verified is False and not known_corrupt:
+            cstr(f"[{self.__class__.__name__}] checkpoint {path} doesn't match its repo or changed since it was recorded, it will be downloaded again when loaded").error.print()
+        return key, verified
+
+    def verify_async(self, paths=None):
+        """
+        Hash the given recorded files (all of them if None) in the background thread pool,
+        files which don't match the etag of their repo or whose content changed are marked corrupt
+
+        Returns:
+            list of concurrent.futures.Future: each resolves to (manifest key, verified), verified as returned by verify
+        """
+        with self._lock:
+            keys = list(self.files.keys()) if paths is None else [self._key(path) for path in paths]
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.hash_workers, thread_name_prefix="checkpoint_verifier")
+            futures = []
+            for key in keys:
+                future = self._pending.get(key)
+                if future is None or future.done():
+                    future = self._pending[key] = self._executor.submit(self._verify, key)
+                    future.add_done_callback(lambda future, key=key: self._pop_pending(key, future))
+                futures.append(future)
+        return futures
+
+    def _pop_pending(self, key, future):
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+checkpoint_manifest_conf = None
+checkpoint_manifest = None
+
+def set_checkpoint_manifest_conf(new_checkpoint_manifest_conf):
+    global checkpoint_manifest_conf
+    checkpoint_manifest_conf = new_checkpoint_manifest_conf
+
+def get_checkpoint_manifest():
+    global checkpoint_manifest
+    if checkpoint_manifest is None:
+        conf = checkpoint_manifest_conf if checkpoint_manifest_conf is not None else {}
+        checkpoint_manifest = CheckpointManifest(hash_workers=conf.get('hash_workers', 4))
+        if conf.get('verify_on_startup', False):
+            checkpoint_manifest.verify_async()
+    return checkpoint_manifest
@@ -69,14 +69,77 @@ def get_list_filenames(directory, extension_filter=None, recursive=False):
     else:
         return []
     
+def get_hf_file_etag(local_dir, repo_id, filename, repo_type="model", class_name=""):
+    """
+    Etag (sha256 of LFS files) and size of filename in repo_id: from the download metadata huggingface_hub keeps in local_dir,
+    or asked to the hub if the file was not downloaded there. None if neither is available (e.g. offline).
+
+    Returns:
+        tuple: (etag, size), size is None when read from the local metadata
+    """
+    from .checkpoint_manifest import read_hf_download_metadata
+    etag = read_hf_download_metadata(local_dir, filename)
+    if etag is not None:
+        return etag, None
+    try:
+        from huggingface_hub import get_hf_file_metadata, hf_hub_url
+        metadata = get_hf_file_metadata(hf_hub_url(repo_id, filename, repo_type=repo_type))
+        return metadata.etag, metadata.size
+    except Exception as e:
+        cstr(f"[{class_name}] can't get the metadata of {filename} from repo {repo_id}: {e}").warning.print()
+        return None, None
+
 # Download pre-trained model if it not exist locally
 def resume_or_download_model_from_hf(checkpoints_dir_abs, repo_id, model_name, class_name="", repo_type="model"):
+    from .checkpoint_manifest import get_checkpoint_manifest, read_hf_download_metadata
+    manifest = get_checkpoint_manifest()
     
     ckpt_path = os.path.join(checkpoints_dir_abs, model_name)
-    if not os.path.isfile(ckpt_path):
+    # resolved from the local manifest, no network call unless the checkpoint is missing, changed or was never matched against its repo
+    state = manifest.lookup(ckpt_path)
+    if state == "valid":
+        return ckpt_path
+    if state != "missing":
+        # checkpoint placed before the manifest existed, copied by hand, changed or not hashed yet: only trusted once it matches its repo
+        if not manifest.has_expected_etag(ckpt_path):
+            manifest.set_expected_etag(ckpt_path, *get_hf_file_etag(checkpoints_dir_abs, repo_id, model_name, repo_type, class_name))
+        verified = manifest.verify(ckpt_path)
+        if verified:
+            return ckpt_path
+        if verified is None:
+            cstr(f"[{class_name}] can't verify checkpoint {ckpt_path} against repo {repo_id}, using it unverified").warning.print()
+            return ckpt_path
+        cstr(f"[{class_name}] checkpoint {ckpt_path} doesn't match repo {repo_id} or changed since it was downloaded, will download it again").warning.print()
+    else:
         cstr(f"[{class_name}] can't find checkpoint {ckpt_path}, will download it from repo {repo_id} instead").warning.print()
-        
-        from huggingface_hub import hf_hub_download
-        hf_hub_download(repo_id=repo_id, local_dir=checkpoints_dir_abs, filename=model_name, repo_type=repo_type)
+    
+    from huggingface_hub import hf_hub_download
+    hf_hub_download(repo_id=repo_id, local_dir=checkpoints_dir_abs, filename=model_name, repo_type=repo_type, force_download=(state != "missing"))
+    manifest.record(ckpt_path, expected_etag=read_hf_download_metadata(checkpoints_dir_abs, model_name))
 
     return ckpt_path
+
+def resume_or_download_snapshot_from_hf(checkpoints_dir_abs, repo_id, class_name="", force_download=False, repo_type="model", **kwargs):
+    """
+    Download the snapshot of repo_id into checkpoints_dir_abs, skipped without any network call if the local manifest
+    records a complete snapshot there whose files did not change since. Extra kwargs are passed to snapshot_download.
+    """
+    from .checkpoint_manifest import get_checkpoint_manifest
+    manifest = get_checkpoint_manifest()
+    
+    if not force_download and manifest.is_snapshot_complete(checkpoints_dir_abs):
+        return checkpoints_dir_abs
+    
+    # huggingface local dir metadata may still consider a changed or truncated file up to date, remove it so it is downloaded again
+    for path in manifest.changed_snapshot_files(checkpoints_dir_abs):
+        cstr(f"[{class_name}] checkpoint {path} is missing or changed since it was downloaded, will download it again from repo {repo_id}").warning.print()
+        if os.path.isfile(path):
+            os.remove(path)
+        manifest.forget(path)
+    
+    from huggingface_hub import snapshot_download
+    cstr(f"[{class_name}] downloading snapshot of repo {repo_id} into {checkpoints_dir_abs}").msg.print()
+    snapshot_download(repo_id=repo_id, local_dir=checkpoints_dir_abs, force_download=force_download, repo_type=repo_type, **kwargs)
+    manifest.record_snapshot(checkpoints_dir_abs, repo_id)
+    
+    return checkpoints_dir_abs
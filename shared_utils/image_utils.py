@@ -197,4 +197,151 @@ def pils_resize_foreground(
         new_image = Image.fromarray(new_image, mode="RGBA")
         new_pils.append(new_image)
     
-    return new_pils
\ No newline at end of file
+    return new_pils
+
+def torch_imgs_to_rgba(images, masks=None, alpha_min=0.1):
+    """
+    Tensor counterpart of torch_imgs_to_pils, the images stay in float on their device
+        images (torch): [N, H, W, C] or [H, W, C]
+        masks (torch): [N, H, W] or [H, W]
+
+    Returns:
+        torch: [N, H, W, 4] with color zeroed where mask < alpha_min, or the [N, H, W, C] images if masks is None
+    """
+    if len(images.shape) == 3:
+        images = images.unsqueeze(0)
+
+    if masks is None:
+        return images
+
+    masks = masks.to(dtype=images.dtype, device=images.device)
+    if len(masks.shape) == 2:
+        masks = masks.unsqueeze(0)
+    masks = masks.unsqueeze(3)
+
+    return torch.cat((images[..., :3] * (masks >= alpha_min), masks), dim=3)
+
+def torch_imgs_add_bg(images, masks, bkgd=(1., 1., 1.), alpha_min=0.1):
+    """
+    Composite images over a solid background on their device, tensor counterpart of pils_rgba_to_rgb(torch_imgs_to_pils(images, masks))
+        images (torch): [N, H, W, 3] or [H, W, 3]
+        masks (torch): [N, H, W] or [H, W]
+        bkgd (tuple): background RGB color in [0, 1]
+
+    Returns:
+        torch: [N, H, W, 3]
+    """
+    if len(images.shape) == 3:
+        images = images.unsqueeze(0)
+    masks = masks.to(dtype=images.dtype, device=images.device).reshape(*images.shape[:3], 1)
+    
+    bkgd = torch.tensor(bkgd, dtype=images.dtype, device=images.device).expand_as(images[..., :3])
+    return torch.lerp(bkgd, images[..., :3] * (masks >= alpha_min), masks)
+
+def torch_imgs_pad_to_square(images, value=0.):
+    """
+    Pad images to squares of side max(H, W), the images stay centered
+        images (torch): [N, H, W, C]
+    """
+    H, W = images.shape[1:3]
+    size = max(H, W)
+    top, left = (size - H) // 2, (size - W) // 2
+    return F.pad(images, (0, 0, left, size - W - left, top, size - H - top), value=value)
+
+def torch_imgs_resize_foreground(images, masks, ratio, alpha_min=0.1):
+    """
+    Tensor counterpart of pils_resize_foreground, crop every image to its foreground then pad it so the foreground takes ratio of the side
+        images (torch): [N, H, W, 3]
+        masks (torch): [N, H, W]
+
+    Returns:
+        images (torch): [N, S, S, 3]
+        masks (torch): [N, S, S], S is the largest side among the padded images, the others are resized to it
+    """
+    rgba = torch_imgs_to_rgba(images, masks, alpha_min)
+    # same foreground test as on 8 bits alpha
+    foreground = rgba[..., 3] * 255 >= 1
+    rows, cols = foreground.any(dim=2), foreground.any(dim=1)
+    # the only host sync, images without foreground keep their whole extent
+    bboxes = torch.stack([
+        rows.int().argmax(dim=1), rows.shape[1] - 1 - rows.int().flip(1).argmax(dim=1),
+        cols.int().argmax(dim=1), cols.shape[1] - 1 - cols.int().flip(1).argmax(dim=1),
+    ], dim=1).tolist()
+
+    new_images = []
+    for image, has_foreground, (y1, y2, x1, x2) in zip(rgba, rows.any(dim=1).tolist(), bboxes):
+        if not has_foreground:
+            y1, y2, x1, x2 = 0, image.shape[0], 0, image.shape[1]
+        # crop the foreground
+        fg = image[y1:y2, x1:x2]
+        # pad to square, then to size according to the ratio, double side
+        size = max(fg.shape[0], fg.shape[1])
+        new_size = int(size / ratio)
+        top = (size - fg.shape[0]) // 2 + (new_size - size) // 2
+        left = (size - fg.shape[1]) // 2 + (new_size - size) // 2
+        new_image = torch.zeros((new_size, new_size, 4), dtype=rgba.dtype, device=rgba.device)
+        new_image[top:top + fg.shape[0], left:left + fg.shape[1]] = fg
+        new_images.append(new_image)
+
+    max_size = max(new_image.shape[0] for new_image in new_images)
+    new_images = torch.stack([
+        new_image if new_image.shape[0] == max_size else prepare_torch_img(new_image.unsqueeze(0), max_size, max_size, rgba.device, keep_shape=True)[0]
+        for new_image in new_images
+    ], dim=0)
+    return new_images[..., :3], new_images[..., 3]
+
+def torch_make_image_grid(images, rows=None, cols=None):
+    """
+    Tensor counterpart of pil_make_image_grid
+        images (torch): [N, H, W, C]
+
+    Returns:
+        torch: [1, rows * H, cols * W, C], missing cells are black
+    """
+    num_images = images.shape[0]
+    if rows is None and cols is None:
+        rows = 1
+        cols = num_images
+    if rows is None:
+        rows = num_images // cols
+        if num_images % cols != 0:
+            rows += 1
+    if cols is None:
+        cols = num_images // rows
+        if num_images % rows != 0:
+            cols += 1
+    total_imgs = rows * cols
+    if total_imgs > num_images:
+        images = torch.cat([images, images.new_zeros((total_imgs - num_images, *images.shape[1:]))], dim=0)
+
+    N, H, W, C = images.shape
+    return images[:total_imgs].reshape(rows, cols, H, W, C).permute(0, 2, 1, 3, 4).reshape(1, rows * H, cols * W, C)
+
+def torch_split_image(images, rows=None, cols=None):
+    """
+    Tensor counterpart of pil_split_image, split every image grid into square sub images
+        images (torch): [N, H, W, C]
+
+    Returns:
+        torch: [N * rows * cols, S, S, C] in row-major order of each grid
+    """
+    N, H, W, C = images.shape
+    if rows is None and cols is None:
+        rows = 1
+        cols = W // H
+        assert cols * H == W
+        subimg_size = H
+    elif rows is None:
+        subimg_size = W // cols
+        rows = H // subimg_size
+        assert rows * subimg_size == H
+    elif cols is None:
+        subimg_size = H // rows
+        cols = W // subimg_size
+        assert cols * subimg_size == W
+    else:
+        subimg_size = H // rows
+        assert cols * subimg_size == W
+
+    images = images[:, :rows * subimg_size, :cols * subimg_size]
+    return images.reshape(N, rows, subimg_size, cols, subimg_size, C).permute(0, 1, 3, 2, 4, 5).reshape(-1, subimg_size, subimg_size, C)
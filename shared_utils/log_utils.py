@@ -1,5 +1,6 @@
 import logging
 import sys
+import time
 
 class cstr(str):
     # Modified from: WAS Node Suite
@@ -102,4 +103,17 @@ def setup_logger(logger_name, level, stdout_levels, stderr_levels, formatter):
     stdout_handler = create_handler(sys.stdout, stdout_levels, formatter)
     stderr_handler = create_handler(sys.stderr, stderr_levels, formatter)
     logger.addHandler(stdout_handler)
-    logger.addHandler(stderr_handler)
\ No newline at end of file
+    logger.addHandler(stderr_handler)
+
+def record_time(timings:dict, name:str=None, start:float=0.)->float:
+    """add the seconds since start to timings[name] (if name is given) and return the new start, no-op if timings is None"""
+    if timings is None:
+        return start
+    # torch is imported lazily, install.py imports this module before torch is installed
+    import torch
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    now = time.perf_counter()
+    if name is not None:
+        timings[name] = timings.get(name, 0.) + now - start
+    return now
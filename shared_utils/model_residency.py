@@ -0,0 +1,386 @@
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+
+import torch
+import torch.nn as nn
+
+from shared_utils.log_utils import cstr
+
+GB = 1024 ** 3
+
+# Used when the configured budget is 0 (auto), ComfyUI's own models need the rest of the device memory
+DEFAULT_VRAM_BUDGET_FRACTION = 0.25
+DEFAULT_RAM_BUDGET_FRACTION = 0.5
+
+# Resident models are also offloaded while the device has less free memory than this
+VRAM_FREE_MARGIN = 512 * 1024 ** 2
+
+def iter_model_modules(model):
+    """
+    nn.Modules owning the weights of a loaded model: the model itself, or the nn.Module attributes of a container
+    such as a diffusers pipeline or a sampler wrapping the network
+    """
+    if isinstance(model, nn.Module):
+        return [model]
+    return [value for value in vars(model).values() if isinstance(value, nn.Module)]
+
+def iter_model_tensors(model):
+    seen = set()
+    for module in iter_model_modules(model):
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            if id(tensor) not in seen:
+                seen.add(id(tensor))
+                yield tensor
+
+def get_tensors_device(tensors):
+    for tensor in tensors:
+        return tensor.device
+    return torch.device("cpu")
+
+class ManagedModel:
+    """
+    Handle of a model owned by the ModelResidencyManager, returned by Load_* nodes in place of the raw model.
+
+    Algorithm nodes get the raw model with ``use()`` (or ``use_model`` for inputs which may also be raw models),
+    which keeps it resident on the device until the node is done with it.
+    """
+    def __init__(self, manager, key, load_func, size_hint=0, base=None):
+        self._manager = manager
+        self._key = key
+        self._load_func = load_func
+        # handle of the model this one was derived from and shares weights with, see derive
+        self._base = base
+        # modifier key -> modify_func, in the order they were added
+        self._modifiers = {}
+        self._model = None
+        self._footprint = size_hint
+        self._device = None
+        # number of with blocks using the model, it is not offloaded nor released while > 0
+        self._pins = 0
+
+    @property
+    def is_loaded(self):
+        return self._model is not None
+
+    @property
+    def is_resident(self):
+        return self._model is not None and self._device == self._manager.device
+
+    @property
+    def is_pinned(self):
+        return self._pins > 0
+
+    @contextmanager
+    def use(self):
+        """
+        Make the model resident on the device and pin it there for the duration of the with block, yields the raw model.
+        Loading other models in the block offloads other models instead of this one.
+        """
+        # a derived model shares weights with its base model, which is pinned along with it
+        with self._base.use() if self._base is not None else nullcontext():
+            model = self._manager.acquire(self)
+            self._pins += 1
+            try:
+                yield model
+            finally:
+                self._pins -= 1
+
+    def add_modifier(self, modify_func, key=None):
+        """
+        Apply modify_func (e.g. swapping a sub-module) to the model in place, it is applied again whenever the model is reloaded.
+        A modifier is only applied once per key (modify_func itself if None), adding it again does nothing.
+        """
+        key = modify_func if key is None else key
+        if key in self._modifiers:
+            return
+        self._modifiers[key] = modify_func
+        with self.use() as model:
+            modify_func(model)
+        self._footprint = self._manager.get_footprint(self)
+
+    def derive(self, modifier_key, modify_func):
+        """
+        Handle of a separate copy of the model with modify_func applied, registered under its own key,
+        so the model of this handle stays untouched for the other nodes using it.
+        A diffusers pipeline is copied by building a new pipeline from its components, which the copy shares,
+        so modify_func must replace the components it changes (e.g. assign a new unet) instead of modifying them in place.
+        Other models are loaded again from their checkpoint.
+        Deriving again with the same modifier_key returns the same handle without loading or modifying anything.
+
+        Returns:
+            ManagedModel: handle of the modified copy, already resident on the device
+        """
+        with self.use() as model:
+            is_pipeline = hasattr(model, "components")
+
+        if is_pipeline:
+            def load_func():
+                with self.use() as base_pipe:
+                    pipe = type(base_pipe)(**base_pipe.components)
+                    modify_func(pipe)
+                return pipe
+        else:
+            base_load_func = self._load_func
+            base_modifiers = list(self._modifiers.values())
+            def load_func():
+                model = base_load_func()
+                for base_modify_func in base_modifiers:
+                    base_modify_func(model)
+                modify_func(model)
+                return model
+
+        return self._manager.load(
+            (self._key, modifier_key), load_func, 
+            size_hint=0 if is_pipeline else self._footprint, base=self if is_pipeline else None
+        )
+
+    def __repr__(self):
+        state = "resident" if self.is_resident else ("offloaded" if self.is_loaded else "released")
+        return f"ManagedModel({self._key}, {state}, {self._footprint / GB:.2f} GB)"
+
+class ConfiguredModel:
+    """
+    Managed model with runtime settings of its loader node (e.g. a chunk size) which don't change the loaded weights:
+    loaders only differing in those settings share the model, and each handle applies its own settings whenever a node uses it.
+    """
+    def __init__(self, handle, apply_settings):
+        self._handle = handle
+        self._apply_settings = apply_settings
+
+    @contextmanager
+    def use(self):
+        """Same as ManagedModel.use, with the settings applied to the model"""
+        with self._handle.use() as model:
+            self._apply_settings(model)
+            yield model
+
+    def __repr__(self):
+        return f"ConfiguredModel({self._handle})"
+
+class ModelResidencyManager:
+    """
+    Central registry of the models loaded by Comfy3D nodes.
+
+    Keeps the total footprint of models resident on the device under vram_budget by moving least recently used ones
+    to (pinned) CPU memory, and releases the least recently used offloaded ones when they exceed ram_budget.
+    Offloaded models are moved back and released ones are reloaded from their checkpoint when a node uses them again.
+    ComfyUI offloads and releases them too when it needs memory, see hook_comfy_model_management.
+    """
+    def __init__(self, device="cuda", vram_budget=0, ram_budget=0, pin_memory=True):
+        """
+        Args:
+            device (str, optional): device models are used on. Defaults to "cuda".
+            vram_budget (int, optional): bytes of device memory models may occupy, 0 for a fraction of the device memory. Defaults to 0.
+            ram_budget (int, optional): bytes of CPU memory offloaded models may occupy, 0 for a fraction of the system memory. Defaults to 0.
+            pin_memory (bool, optional): offload into page-locked memory so models are restored with asynchronous copies. Defaults to True.
+        """
+        self.device = self._normalize_device(device)
+        self.vram_budget = vram_budget if vram_budget > 0 else self._default_vram_budget()
+        self.ram_budget = ram_budget if ram_budget > 0 else self._default_ram_budget()
+        self.pin_memory = pin_memory and self.device.type == "cuda"
+
+        # least recently used first
+        self.models = OrderedDict()
+
+    @staticmethod
+    def _normalize_device(device):
+        device = torch.device(device)
+        if device.type == "cuda" and device.index is None:
+            device = torch.device("cuda", torch.cuda.current_device())
+        return device
+
+    def _default_vram_budget(self):
+        if self.device.type == "cuda":
+            return int(torch.cuda.get_device_properties(self.device).total_memory * DEFAULT_VRAM_BUDGET_FRACTION)
+        return float('inf')
+
+    def _default_ram_budget(self):
+        try:
+            import psutil
+            return int(psutil.virtual_memory().total * DEFAULT_RAM_BUDGET_FRACTION)
+        except ImportError:
+            return float('inf')
+
+    def load(self, key, load_func, size_hint=0, base=None):
+        """
+        Get the handle of the model identified by key, loading it with load_func if it is not registered yet.
+
+        Args:
+            key (hashable): identifies the model: loader node name, checkpoint path and the inputs changing the architecture (e.g. a config),
+                settings which can change after loading belong in a ConfiguredModel instead
+            load_func (Callable[[], Any]): builds the model and moves it to the device, called again if the model got released
+            size_hint (int, optional): expected footprint in bytes (e.g. checkpoint size) used to make room before loading. Defaults to 0.
+            base (ManagedModel, optional): handle of the model this one shares weights with, see ManagedModel.derive. Defaults to None.
+
+        Returns:
+            ManagedModel: handle of the model, already resident on the device
+        """
+        handle = self.models.get(key)
+        if handle is None:
+            handle = ManagedModel(self, key, load_func, size_hint, base)
+            self.models[key] = handle
+        self.acquire(handle)
+        return handle
+
+    def acquire(self, handle):
+        """Make the model of handle resident on the device and mark it as most recently used, returns the raw model"""
+        self.models.move_to_end(handle._key)
+        if handle.is_resident:
+            return handle._model
+
+        self._make_room(handle._footprint, exclude=handle)
+        if handle._model is None:
+            cstr(f"[{self.__class__.__name__}] loading {handle._key}").msg.print()
+            handle._model = handle._load_func()
+            for modify_func in handle._modifiers.values():
+                modify_func(handle._model)
+            handle._footprint = self.get_footprint(handle)
+            handle._device = get_tensors_device(self._own_tensors(handle))
+
+        if handle._device != self.device:
+            self._move(handle, self.device)
+
+        self._make_room(0, exclude=handle)
+        return handle._model
+
+    def offload(self, handle):
+        if handle.is_resident:
+            cstr(f"[{self.__class__.__name__}] offloading {handle._key} ({handle._footprint / GB:.2f} GB) to CPU").msg.print()
+            self._move(handle, torch.device("cpu"))
+            torch.cuda.empty_cache()
+        self._fit_ram_budget()
+
+    def release(self, handle):
+        # models derived from this one hold its weights, they are released with it and derive again from the reloaded model
+        for derived_handle in list(self.models.values()):
+            if derived_handle._base is handle:
+                self.release(derived_handle)
+        if handle.is_loaded:
+            cstr(f"[{self.__class__.__name__}] releasing {handle._key} ({handle._footprint / GB:.2f} GB)").msg.print()
+            handle._model = None
+            handle._device = None
+            if self.device.type == "cuda":
+                torch.cuda.empty_cache()
+
+    def get_footprint(self, handle):
+        return sum(tensor.numel() * tensor.element_size() for tensor in self._own_tensors(handle))
+
+    def _own_tensors(self, handle):
+        # weights shared with the base model of a derived model are moved and accounted with the base model
+        tensors = iter_model_tensors(handle._model)
+        if handle._base is None or handle._base._model is None:
+            return list(tensors)
+        shared = set(id(tensor) for tensor in iter_model_tensors(handle._base._model))
+        return [tensor for tensor in tensors if id(tensor) not in shared]
+
+    def free_memory(self, memory_required, device):
+        """Offload models not in use, least recently used first, until the device has memory_required bytes free"""
+        if self._normalize_device(device) != self.device:
+            return
+        for handle in list(self.models.values()):
+            if self._device_free_memory() >= memory_required:
+                break
+            if handle.is_resident and not handle.is_pinned:
+                self.offload(handle)
+
+    def release_all(self):
+        """Release every model not in use, they are reloaded from their checkpoint when a node uses them again"""
+        for handle in list(self.models.values()):
+            if not handle.is_pinned:
+                self.release(handle)
+
+    def resident_footprint(self):
+        return sum(handle._footprint for handle in self.models.values() if handle.is_resident)
+
+    def offloaded_footprint(self):
+        return sum(handle._footprint for handle in self.models.values() if handle.is_loaded and not handle.is_resident)
+
+    def _device_free_memory(self):
+        if self.device.type == "cuda":
+            return torch.cuda.mem_get_info(self.device)[0]
+        return float('inf')
+
+    def _make_room(self, bytes_needed, exclude=None):
+        # offload least recently used models until bytes_needed fits in both the budget and the memory really free on the device
+        for handle in list(self.models.values()):
+            if (self.resident_footprint() + bytes_needed <= self.vram_budget
+                and self._device_free_memory() >= bytes_needed + VRAM_FREE_MARGIN):
+                break
+            if handle is not exclude and handle.is_resident and not handle.is_pinned:
+                self.offload(handle)
+
+    def _fit_ram_budget(self):
+        for handle in list(self.models.values()):
+            if self.offloaded_footprint() <= self.ram_budget:
+                break
+            if handle.is_loaded and not handle.is_resident:
+                self.release(handle)
+
+    def _move(self, handle, device):
+        pin = self.pin_memory and device.type == "cpu"
+        with torch.no_grad():
+            for tensor in self._own_tensors(handle):
+                if pin:
+                    tensor.data = torch.empty_like(tensor.data, device=device, pin_memory=True).copy_(tensor.data, non_blocking=True)
+                else:
+                    # copies from pinned memory are asynchronous on the current stream
+                    tensor.data = tensor.data.to(device, non_blocking=True)
+        if pin:
+            torch.cuda.current_stream(self.device).synchronize()
+        handle._device = device
+        # models may grow after loading (e.g. cached buffers), keep the accounting current
+        handle._footprint = self.get_footprint(handle)
+
+@contextmanager
+def use_model(model):
+    """Raw model of a ManagedModel or ConfiguredModel, pinned on the device for the duration of the with block, any other model is yielded as is"""
+    if isinstance(model, (ManagedModel, ConfiguredModel)):
+        with model.use() as raw_model:
+            yield raw_model
+    else:
+        yield model
+
+def hook_comfy_model_management(manager):
+    """
+    Make the models of manager give way to ComfyUI's own: comfy.model_management.free_memory, called before ComfyUI loads a model,
+    also offloads the models of manager, and unload_all_models (e.g. the "Unload Models" button) also releases them
+    """
+    try:
+        import comfy.model_management as model_management
+    except ImportError:
+        return
+
+    comfy_free_memory = model_management.free_memory
+    comfy_unload_all_models = model_management.unload_all_models
+
+    def free_memory(memory_required, device, *args, **kwargs):
+        manager.free_memory(memory_required, device)
+        return comfy_free_memory(memory_required, device, *args, **kwargs)
+
+    def unload_all_models(*args, **kwargs):
+        # release first, otherwise free_memory called by unload_all_models would copy them to CPU before
+        manager.release_all()
+        return comfy_unload_all_models(*args, **kwargs)
+
+    model_management.free_memory = free_memory
+    model_management.unload_all_models = unload_all_models
+
+model_residency_conf = None
+model_residency_manager = None
+
+def set_model_residency_conf(new_model_residency_conf):
+    global model_residency_conf
+    model_residency_conf = new_model_residency_conf
+
+def get_model_residency_manager(device="cuda" if torch.cuda.is_available() else "cpu"):
+    global model_residency_manager
+    if model_residency_manager is None:
+        conf = model_residency_conf if model_residency_conf is not None else {}
+        model_residency_manager = ModelResidencyManager(
+            device,
+            vram_budget=int(conf.get('vram_budget_gb', 0) * GB),
+            ram_budget=int(conf.get('ram_budget_gb', 0) * GB),
+            pin_memory=conf.get('offload_to_pinned_memory', True),
+        )
+        hook_comfy_model_management(model_residency_manager)
+    return model_residency_manager
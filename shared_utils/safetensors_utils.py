@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import shutil
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+from shared_utils.log_utils import cstr
+
+GB = 1024 ** 3
+
+# Shards of converted checkpoints are kept under this size
+DEFAULT_MAX_SHARD_SIZE = 2 * GB
+
+SAFETENSORS_INDEX_SUFFIX = ".safetensors.index.json"
+
+# Disk space left free after a conversion, checkpoints are not converted without it
+CONVERSION_FREE_DISK_MARGIN = 1 * GB
+
+safetensors_conversion_conf = None
+
+def set_safetensors_conversion_conf(new_safetensors_conversion_conf):
+    global safetensors_conversion_conf
+    safetensors_conversion_conf = new_safetensors_conversion_conf
+
+def get_peak_rss():
+    """Peak resident memory of the process over its lifetime in bytes, None if it can't be measured on this platform"""
+    try:
+        import resource
+        # ru_maxrss is in kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        # peak working set on windows
+        return getattr(psutil.Process().memory_info(), "peak_wset", None)
+    except ImportError:
+        return None
+
+def get_safetensors_index_path(ckpt_path):
+    return os.path.splitext(ckpt_path)[0] + SAFETENSORS_INDEX_SUFFIX
+
+def get_safetensors_files(ckpt_path):
+    """
+    Safetensors files holding the tensors of ckpt_path: itself if it already is a .safetensors file,
+    the shards of its converted copy if there is one, None otherwise
+    """
+    if ckpt_path.endswith(".safetensors"):
+        return [ckpt_path]
+    index_path = get_safetensors_index_path(ckpt_path)
+    # a checkpoint downloaded again after its conversion has to be converted again
+    if not os.path.isfile(index_path) or os.path.getmtime(index_path) < os.path.getmtime(ckpt_path):
+        return None
+    with open(index_path, "r") as f:
+        index = json.load(f)
+    ckpt_dir = os.path.dirname(ckpt_path)
+    return [os.path.join(ckpt_dir, shard_name) for shard_name in sorted(set(index["weight_map"].values()))]
+
+def torch_load_state_dict(ckpt_path, state_dict_key=None):
+    """Load a pickled checkpoint, memory mapped when its format allows it, and return its state dict"""
+    try:
+        ckpt = torch.load(ckpt_path, map_location="cpu", mmap=True)
+    except RuntimeError:
+        # legacy (non zip) checkpoints can't be memory mapped
+        ckpt = torch.load(ckpt_path, map_location="cpu")
+    if state_dict_key is not None:
+        ckpt = ckpt[state_dict_key]
+    return {k: v for k, v in ckpt.items() if isinstance(v, torch.Tensor)}
+
+def convert_checkpoint_to_safetensors(ckpt_path, state_dict_key=None, max_shard_size=DEFAULT_MAX_SHARD_SIZE):
+    """
+    Convert a pickled checkpoint into safetensors shards next to it, named <name>-00001-of-0000N.safetensors,
+    plus a <name>.safetensors.index.json mapping every tensor to its shard (same layout as huggingface sharded checkpoints).
+    The index is written last, so a checkpoint is only considered converted once all its shards are complete.
+
+    Args:
+        ckpt_path (str): path of the checkpoint loadable by torch.load
+        state_dict_key (str, optional): key of the state dict in the checkpoint (e.g. "state_dict" for lightning checkpoints). Defaults to None.
+        max_shard_size (int, optional): maximum bytes of tensors per shard. Defaults to 2 GB.
+
+    Returns:
+        list of str: paths of the written shards
+    """
+    ckpt_dir = os.path.dirname(ckpt_path)
+    # the shards take about as much space as the checkpoint, which is kept
+    disk_free = shutil.disk_usage(ckpt_dir or ".").free
+    if disk_free < os.path.getsize(ckpt_path) + CONVERSION_FREE_DISK_MARGIN:
+        raise OSError(f"not enough free disk space to convert {ckpt_path} ({disk_free / GB:.2f} GB free, needs {os.path.getsize(ckpt_path) / GB:.2f} GB)")
+
+    state_dict = torch_load_state_dict(ckpt_path, state_dict_key)
+
+    shards = [{}]
+    shard_size = 0
+    seen_storages = set()
+    for name, tensor in state_dict.items():
+        tensor_size = tensor.numel() * tensor.element_size()
+        if shard_size > 0 and shard_size + tensor_size > max_shard_size:
+            shards.append({})
+            shard_size = 0
+        # safetensors can't store tensors sharing memory (e.g. tied weights or views), each gets its own copy
+        storage_ptr = tensor.untyped_storage().data_ptr()
+        if storage_ptr in seen_storages:
+            tensor = tensor.clone()
+        seen_storages.add(storage_ptr)
+        shards[-1][name] = tensor.contiguous()
+        shard_size += tensor_size
+
+    ckpt_stem = os.path.splitext(os.path.basename(ckpt_path))[0]
+    index_path = get_safetensors_index_path(ckpt_path)
+    weight_map = {}
+    shard_paths = []
+    written_paths = []
+    try:
+        for i, shard in enumerate(shards):
+            shard_name = f"{ckpt_stem}-{i+1:05d}-of-{len(shards):05d}.safetensors"
+            shard_path = os.path.join(ckpt_dir, shard_name)
+            written_paths += [shard_path + ".tmp", shard_path]
+            save_file(shard, shard_path + ".tmp", metadata={"format": "pt"})
+            os.replace(shard_path + ".tmp", shard_path)
+            shutil.copymode(ckpt_path, shard_path)
+            weight_map.update({name: shard_name for name in shard})
+            shard_paths.append(shard_path)
+
+        index = {
+            "metadata": {"source": os.path.basename(ckpt_path), "state_dict_key": state_dict_key, "total_size": sum(
+                tensor.numel() * tensor.element_size() for tensor in state_dict.values())},
+            "weight_map": weight_map,
+        }
+        written_paths.append(index_path + ".tmp")
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(index_path + ".tmp", index_path)
+    except BaseException:
+        # without its index the conversion is not used, remove what it wrote (e.g. when the disk got full)
+        for path in written_paths:
+            if os.path.isfile(path):
+                os.remove(path)
+        raise
+
+    shards_size = sum(os.path.getsize(shard_path) for shard_path in shard_paths)
+    cstr(f"converted {ckpt_path} into {len(shard_paths)} safetensors shards, taking {shards_size / GB:.2f} GB of disk next to it "
+         f"({shutil.disk_usage(ckpt_dir or '.').free / GB:.2f} GB left)").msg.print()
+    return shard_paths
+
+def get_tied_parameter_names(model):
+    """Groups of names under which a same parameter is registered in several modules (e.g. tied input and output embeddings)"""
+    names_by_param = {}
+    for name, param in model.named_parameters(remove_duplicate=False):
+        names_by_param.setdefault(id(param), []).append(name)
+    return [names for names in names_by_param.values() if len(names) > 1]
+
+def tie_parameters(model, names, loaded_names=()):
+    """Register the parameter loaded under one of names (the first of them if none was loaded) under all of them"""
+    source_name = next((name for name in names if name in loaded_names), names[0])
+    param = model.get_parameter(source_name)
+    for name in names:
+        module_name, _, param_name = name.rpartition(".")
+        setattr(model.get_submodule(module_name), param_name, param)
+
+def load_checkpoint_into_model(model, ckpt_path, device=None, dtype=None, state_dict_key=None, prefix="", strict=True, convert=None, class_name=""):
+    """
+    Load the weights of a checkpoint into model, streaming every tensor from memory mapped safetensors straight to its device,
+    so the host never holds a full copy of the state dict next to the model.
+    Pickled checkpoints can be converted to safetensors shards on their first load (see convert_checkpoint_to_safetensors).
+
+    Args:
+        model (nn.Module): model to load the weights into, its parameters are replaced by the loaded tensors
+        ckpt_path (str): path of the .safetensors file or of the pickled checkpoint
+        device (str or torch.device, optional): device tensors are loaded to, None for the device of the tensor they replace. Defaults to None.
+        dtype (torch.dtype, optional): dtype floating point tensors are cast to, None for the dtype of the tensor they replace. Defaults to None.
+        state_dict_key (str, optional): key of the state dict in a pickled checkpoint (e.g. "state_dict"). Defaults to None.
+        prefix (str, optional): only tensors whose name starts with prefix are loaded, with the prefix removed (e.g. "lrm_generator."). Defaults to "".
+        strict (bool, optional): same as nn.Module.load_state_dict. Defaults to True.
+        convert (bool, optional): convert pickled checkpoints to safetensors if they aren't yet, otherwise they are loaded with torch.load.
+            None for convert_checkpoints of the safetensors_conversion config. Defaults to None.
+        class_name (str, optional): name of the calling node, used in log messages. Defaults to "".
+
+    Returns:
+        NamedTuple: missing_keys and unexpected_keys, same as nn.Module.load_state_dict
+    """
+    start_time = time.perf_counter()
+    start_peak_rss = get_peak_rss()
+
+    conf = safetensors_conversion_conf if safetensors_conversion_conf is not None else {}
+    if convert is None:
+        convert = conf.get('convert_checkpoints', False)
+
+    safetensors_files = get_safetensors_files(ckpt_path)
+    if safetensors_files is None and convert:
+        try:
+            cstr(f"[{class_name}] converting checkpoint {ckpt_path} to safetensors, this only happens once").msg.print()
+            safetensors_files = convert_checkpoint_to_safetensors(ckpt_path, state_dict_key, int(conf.get('max_shard_size_gb', DEFAULT_MAX_SHARD_SIZE / GB) * GB))
+        except Exception as e:
+            cstr(f"[{class_name}] failed to convert {ckpt_path} to safetensors, loading it with torch.load instead: {e}").warning.print()
+
+    model_state_dict = model.state_dict()
+    tied_parameter_names = get_tied_parameter_names(model)
+    def to_target(name, tensor):
+        target = model_state_dict.get(name)
+        tensor_dtype = dtype if dtype is not None and tensor.is_floating_point() else (target.dtype if target is not None else tensor.dtype)
+        tensor_device = device if device is not None else (target.device if target is not None else tensor.device)
+        return tensor.to(tensor_device, dtype=tensor_dtype)
+
+    state_dict = {}
+    if safetensors_files is not None:
+        for safetensors_file in safetensors_files:
+            with safe_open(safetensors_file, framework="pt", device="cpu") as f:
+                for key in f.keys():
+                    if key.startswith(prefix):
+                        # each tensor is read from the memory map and moved on its own, freeing its host copy right after
+                        name = key[len(prefix):]
+                        state_dict[name] = to_target(name, f.get_tensor(key))
+    else:
+        for key, tensor in torch_load_state_dict(ckpt_path, state_dict_key).items():
+            if key.startswith(prefix):
+                name = key[len(prefix):]
+                state_dict[name] = to_target(name, tensor)
+
+    # assign the loaded tensors in place of the initial parameters instead of copying into them, so they are not held twice
+    result = model.load_state_dict(state_dict, strict=strict, assign=True)
+    # assigning gives every name its own parameter, tie the shared ones again
+    for names in tied_parameter_names:
+        tie_parameters(model, names, state_dict)
+
+    message = f"[{class_name}] loaded {len(state_dict)} tensors from {ckpt_path} in {time.perf_counter() - start_time:.2f}s"
+    peak_rss = get_peak_rss()
+    if peak_rss is not None:
+        # the process peak only grows when this load exceeds every earlier one, so its growth is a lower bound of the load's own peak
+        message += f", process peak RSS {peak_rss / GB:.2f} GB (+{(peak_rss - start_peak_rss) / GB:.2f} GB during this load)"
+    cstr(message).msg.print()
+    return result
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert pickled checkpoints to sharded safetensors ahead of their first load")
+    parser.add_argument("ckpt_paths", nargs="+", help="checkpoints to convert")
+    parser.add_argument("--state_dict_key", default=None, help='key of the state dict in the checkpoints, e.g. "state_dict"')
+    parser.add_argument("--max_shard_size_gb", type=float, default=DEFAULT_MAX_SHARD_SIZE / GB)
+    args = parser.parse_args()
+
+    for ckpt_path in args.ckpt_paths:
+        convert_checkpoint_to_safetensors(ckpt_path, args.state_dict_key, int(args.max_shard_size_gb * GB))
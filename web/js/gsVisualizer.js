@@ -26,6 +26,10 @@ var needUpdate = false;
 let currentURL;
 var url = location.protocol + '//' + location.host;
 
+// .splat records are 32 bytes each and sorted by importance, so any prefix of the file is a coarser version of the whole splat
+const SPLAT_ROW_LENGTH = 32;
+const SPLAT_FIRST_PREVIEW_ROWS = 16384;
+
 function frameUpdate() {
 
     var filepath = visualizer.getAttribute("filepath");
@@ -54,6 +58,50 @@ const onProgress = function ( progress ) {
     progressIndicator.value = progress * 100;
 };
 
+function showSplatPrefix(data, byteLength, splat) {
+    if (splat !== null) {
+        scene.removeObject(splat);
+    }
+    const rowsLength = byteLength - byteLength % SPLAT_ROW_LENGTH;
+    return SPLAT.Loader.LoadFromArrayBuffer(data.slice(0, rowsLength).buffer, scene);
+}
+
+// Stream a .splat file and re-display the received prefix each time its size doubles
+async function loadSplatProgressive(fileURL, timestamp) {
+    const response = await fetch(fileURL);
+    const total = parseInt(response.headers.get("Content-Length"));
+    if (!response.ok || !response.body || isNaN(total)) {
+        return await SPLAT.Loader.LoadAsync(fileURL, scene, onProgress);
+    }
+
+    const reader = response.body.getReader();
+    const data = new Uint8Array(total);
+    let loaded = 0;
+    let nextPreview = SPLAT_FIRST_PREVIEW_ROWS * SPLAT_ROW_LENGTH;
+    let splat = null;
+    while (true) {
+        const { done, value } = await reader.read();
+        // A newer file was requested while this one was still loading
+        if (timestamp != lastTimestamp) {
+            reader.cancel();
+            return null;
+        }
+        if (done) {
+            break;
+        }
+
+        data.set(value, loaded);
+        loaded += value.length;
+        onProgress(loaded / total);
+
+        if (loaded >= nextPreview && loaded < total) {
+            splat = showSplatPrefix(data, loaded, splat);
+            nextPreview = loaded * 2;
+        }
+    }
+    return showSplatPrefix(data, loaded, splat);
+}
+
 async function main(filepath="") {
     // Check if file name is valid
     if (/^.+\.[a-zA-Z]+$/.test(filepath)){
@@ -66,7 +114,16 @@ async function main(filepath="") {
         if (fileExt == "ply"){
             splat = await SPLAT.PLYLoader.LoadAsync(currentURL, scene, onProgress);
         } else if (fileExt == "splat") {
-            splat = await SPLAT.Loader.LoadAsync(currentURL, scene, onProgress);
+            // Keep rendering while the file streams in, so the coarse prefix shows up right away
+            needUpdate = true;
+            requestAnimationFrame( frameUpdate );
+            const loadedSplat = await loadSplatProgressive(currentURL, lastTimestamp);
+            // null: a newer file was requested meanwhile, its load owns the progress dialog
+            if (loadedSplat === null) {
+                return;
+            }
+            progressDialog.close();
+            return;
         } else {
             throw new Error(`File extension name has to be either .ply or .splat, got .${fileExt}`);
         }
@@ -102,6 +102,74 @@ const onError = function ( e ) {
     console.error( e );
 };
 
+// Received .obj text is parsed again each time it doubles, so the total parsing cost stays under twice the one of the whole file
+const OBJ_FIRST_PREVIEW_BYTES = 1 << 20;
+
+function addObj(obj) {
+    obj.scale.setScalar( 5 );
+    obj.traverse(node => {
+        if (node.material && node.material.map == null) {
+            node.material.vertexColors = true;
+        }
+    });
+    scene.add( obj );
+    return obj;
+}
+
+function showObjPrefix(loader, text, obj) {
+    if (obj !== null) {
+        scene.remove(obj);
+        obj.traverse(node => {
+            if (node.geometry) {
+                node.geometry.dispose();
+            }
+        });
+    }
+    // Only complete lines, faces of the prefix only use the vertices written before them
+    return addObj(loader.parse(text.substring(0, text.lastIndexOf("\n") + 1)));
+}
+
+// Stream an .obj file and re-display the received prefix each time its size doubles
+async function loadObjProgressive(loader, fileURL, timestamp) {
+    const response = await fetch(fileURL);
+    if (!response.ok || !response.body) {
+        return addObj(await loader.loadAsync(fileURL, onProgress));
+    }
+    // Content-Length is the compressed size when the server gzipped the file, progress is only known for identity bodies
+    const total = response.headers.get("Content-Encoding") ? NaN : parseInt(response.headers.get("Content-Length"));
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let text = "";
+    let loaded = 0;
+    let nextPreview = OBJ_FIRST_PREVIEW_BYTES;
+    let obj = null;
+    while (true) {
+        const { done, value } = await reader.read();
+        // A newer file was requested while this one was still loading
+        if (timestamp != lastTimestamp) {
+            reader.cancel();
+            return null;
+        }
+        if (done) {
+            break;
+        }
+
+        text += decoder.decode(value, { stream: true });
+        loaded += value.length;
+        if (!isNaN(total)) {
+            progressIndicator.value = loaded / total * 100;
+        }
+
+        if (text.length >= nextPreview) {
+            obj = showObjPrefix(loader, text, obj);
+            nextPreview = text.length * 2;
+        }
+    }
+    text += decoder.decode();
+    return showObjPrefix(loader, text + "\n", obj);
+}
+
 async function main(filepath="") {
     // Check if file name is valid
     if (/^.+\.[a-zA-Z]+$/.test(filepath)){
@@ -121,21 +189,26 @@ async function main(filepath="") {
 
             const mtlLoader = new MTLLoader();
             mtlLoader.setPath(url + '/viewfile?' + new URLSearchParams({"filepath": mtlFolderpath}));
-            mtlLoader.load( mtlFilepath, function ( mtl ) {
+            // Materials have to be set before the first prefix of the mesh is parsed
+            try {
+                const mtl = await mtlLoader.loadAsync( mtlFilepath );
                 mtl.preload();
                 loader.setMaterials( mtl );
-            }, onProgress, onError );
-
-            loader.load( currentURL, function ( obj ) {
-                obj.scale.setScalar( 5 );
-                scene.add( obj );
-                obj.traverse(node => {
-                    if (node.material && node.material.map == null) {
-                        node.material.vertexColors = true;
-                    }
-                  });
+            } catch (e) {
+                onError(e);
+            }
 
-            }, onProgress, onError );
+            // Keep rendering while the file streams in, so the first part of the mesh shows up right away
+            scene.add( ambientLight );
+            scene.add( camera );
+            needUpdate = true;
+            requestAnimationFrame( frameUpdate );
+            const obj = await loadObjProgressive(loader, currentURL, lastTimestamp);
+            // null: a newer file was requested meanwhile, its load owns the progress dialog
+            if (obj !== null) {
+                progressDialog.close();
+            }
+            return;
 
         } else if (fileExt == "glb") {
             const dracoLoader = new DRACOLoader();
@@ -1,6 +1,8 @@
 import server
 import folder_paths as comfy_paths
 import os
+import asyncio
+import mimetypes
 
 from ..shared_utils.log_utils import cstr
 
@@ -19,6 +21,13 @@ SUPPORTED_VIEW_EXTENSIONS = (
     '.splat'
 )
 
+# Text formats that are worth compressing on the fly when the client accepts it
+COMPRESSIBLE_VIEW_EXTENSIONS = (
+    '.mtl',
+    '.obj',
+)
+
+STREAM_CHUNK_SIZE = 1 << 20
 
 web_conf = None
 
@@ -26,6 +35,57 @@ def set_web_conf(new_web_conf):
     global web_conf
     web_conf = new_web_conf
 
+# Content codings used for compressible files, in order of preference
+CONTENT_CODINGS = ("gzip", "deflate")
+
+def get_file_etag(stat, content_coding=None):
+    # Same format as aiohttp's FileResponse for the identity body, compressed bodies are different bytes so they get their own tag
+    etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    return f'"{etag}-{content_coding}"' if content_coding is not None else f'"{etag}"'
+
+def choose_content_coding(accept_encoding):
+    """First of CONTENT_CODINGS accepted by the Accept-Encoding header (with a non zero q value), None for the identity body"""
+    if accept_encoding is None:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        accepted[coding.lower()] = q
+    for coding in CONTENT_CODINGS:
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+def etag_matches(if_none_match, etag):
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+async def stream_compressed_file(request, filepath, headers, content_coding):
+    response = web.StreamResponse(headers=headers)
+    response.enable_compression(web.ContentCoding(content_coding))
+    await response.prepare(request)
+    
+    loop = asyncio.get_running_loop()
+    with open(filepath, "rb") as f:
+        while True:
+            chunk = await loop.run_in_executor(None, f.read, STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            await response.write(chunk)
+            
+    await response.write_eof()
+    return response
+
 @server.PromptServer.instance.routes.get("/viewfile")
 async def view_file(request):
     query = request.rel_url.query
@@ -35,7 +95,28 @@ async def view_file(request):
         
         cstr(f"[Server Query view_file] Get file {filepath}").msg.print()
         
-        if filepath.lower().endswith(SUPPORTED_VIEW_EXTENSIONS) and os.path.exists(filepath):
-            return web.FileResponse(filepath)
+        if filepath.lower().endswith(SUPPORTED_VIEW_EXTENSIONS) and os.path.isfile(filepath):
+            compressible = filepath.lower().endswith(COMPRESSIBLE_VIEW_EXTENSIONS)
+            # Range requests are answered by FileResponse, compressed bodies are only for full downloads
+            content_coding = None
+            if compressible and "Range" not in request.headers:
+                content_coding = choose_content_coding(request.headers.get("Accept-Encoding"))
+            
+            etag = get_file_etag(os.stat(filepath), content_coding)
+            # Outputs are often overwritten under the same name, so clients must revalidate every time
+            headers = {"ETag": etag, "Cache-Control": "no-cache"}
+            # Every encoding keeps the file's own mimetype
+            headers["Content-Type"] = mimetypes.guess_type(filepath)[0] or "application/octet-stream"
+            if compressible:
+                # The body depends on Accept-Encoding, caches must not serve one encoding to a client asking for another
+                headers["Vary"] = "Accept-Encoding"
+            
+            if etag_matches(request.headers.get("If-None-Match"), etag):
+                return web.Response(status=304, headers=headers)
+            
+            if content_coding is not None:
+                return await stream_compressed_file(request, filepath, headers, content_coding)
+            
+            return web.FileResponse(filepath, chunk_size=STREAM_CHUNK_SIZE, headers=headers)
     
-    return web.Response(status=404)
\ No newline at end of file
+    return web.Response(status=404)